@@ -0,0 +1,67 @@
+# answer_key.py
+import json
+from utils import fib_grading_form
+
+
+def resolve_option_index(options, info):
+    """Index of the correct option from the stored answer info (an index or the option text), or None."""
+    if isinstance(info, int) and 0 <= info < len(options):
+        return info
+    if isinstance(info, str):
+        if info in options:
+            return options.index(info)
+        lowered = [o.lower() for o in options]
+        if info.lower() in lowered:
+            return lowered.index(info.lower())
+    return None
+
+
+class AnswerKey:
+    """
+    A question's grading key, compiled once when the question is created (Question.answer_key_json):
+    the resolved multiple-choice index, the normalized accepted fill-in-the-blank answers and the
+    display string. grade() then only parses / normalizes the submission itself.
+    """
+    __slots__ = ('question_type', 'correct_index', 'accepted', 'display')
+
+    def __init__(self, question_type, correct_index=None, accepted=(), display="N/A"):
+        self.question_type = question_type
+        self.correct_index = correct_index
+        self.accepted = frozenset(accepted)
+        self.display = display
+
+    @classmethod
+    def compile(cls, question_type, options, correct_answer_info, suggested_answer=None):
+        if question_type == 'multiple_choice':
+            index = resolve_option_index(options, correct_answer_info)
+            display = options[index] if index is not None else "N/A (Invalid Info)"
+            return cls(question_type, correct_index=index, display=display)
+        if question_type == 'fill_in_the_blank':
+            if correct_answer_info is None:
+                return cls(question_type, accepted=(fib_grading_form(""),), display="N/A")
+            return cls(question_type, accepted=(fib_grading_form(str(correct_answer_info)),), display=str(correct_answer_info))
+        if question_type == 'free_response':
+            return cls(question_type, display=suggested_answer or "No suggested answer.")
+        return cls(question_type)
+
+    def to_json(self):
+        return json.dumps({"type": self.question_type, "index": self.correct_index,
+                           "accepted": sorted(self.accepted), "display": self.display})
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data["type"], correct_index=data["index"], accepted=data["accepted"], display=data["display"])
+
+    def grade(self, user_input):
+        """Returns (is_correct, score); (None, None) for free response, which is graded elsewhere."""
+        if self.question_type == 'multiple_choice':
+            try:
+                is_correct = self.correct_index is not None and int(user_input) == self.correct_index
+            except (ValueError, TypeError):
+                is_correct = False
+            return is_correct, 1.0 if is_correct else 0.0
+        if self.question_type == 'fill_in_the_blank':
+            is_correct = fib_grading_form(user_input) in self.accepted
+            return is_correct, 1.0 if is_correct else 0.0
+        return None, None
@@ -2,23 +2,100 @@
 import os
 import json
 import time
+import asyncio
+import hashlib
+import functools
+import queue
+import threading
+from contextlib import closing
 import re # Import regex for cleaning CSS
-from openai import OpenAI, APIError, RateLimitError, AuthenticationError
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from openai import APIError, RateLimitError, AuthenticationError
+from cache import LRUCache
+from utils import split_into_chunks, condense_text, strip_repeated_lines
+from retry_policy import RetryPolicy, TokenBucket, RetryDeadlineExceeded, is_retryable, retry_stats
+from llm_providers import StubProvider, create_openai_provider
+from telemetry import LLMCallRecord
+from json_stream import JSONArrayStreamParser
+from circuit_breaker import CircuitOpenError, circuit_breaker
 
 # ... (Constants remain the same) ...
 DEFAULT_MODEL = "gpt-4o-mini"
 MAX_RETRIES = 3
-RETRY_DELAY = 5
+GRADING_BATCH_SIZE = 10 # Max free-response answers graded in one completion
+HINT_BATCH_SIZE = 20 # Max questions per batched hint completion
+OPTION_EXPLANATION_BATCH_SIZE = 10 # Max multiple-choice questions per batched option-explanation completion
+DEFAULT_RETRY_POLICY = RetryPolicy(max_attempts=MAX_RETRIES)
+UNLIMITED = TokenBucket(rate_per_second=None) # Used when a handler has no per-key limiter
+QUESTION_PROMPT_VERSION = "2" # Bump when the question prompt changes (invalidates cached question sets)
+CSS_PROMPT_VERSION = "1" # Bump when the CSS theme prompt changes (invalidates cached themes)
+DEFAULT_QUESTION_TYPES = ['multiple_choice', 'fill_in_the_blank', 'free_response']
+MAX_SOURCE_TOKENS_PER_CALL = 3000 # Source budget for one prompt (condensed, not truncated); long documents go through generate_questions_map_reduce
+_RAISE = object() # llm_errors default: re-raise instead of returning a fallback
+
+
+# --- Error Handling ---
+def _handle_llm_error(name, action, expected, fallback, error):
+    """Called from an except block: returns the fallback or re-raises."""
+    if isinstance(error, CircuitOpenError):
+        raise # Routes degrade on this (see routes/tests.py)
+    if isinstance(error, expected):
+        print(f"Error {action}: {error}")
+        if fallback is _RAISE:
+            raise
+    else:
+        print(f"An unexpected error occurred in {name}: {error}")
+        if fallback is _RAISE:
+            raise ValueError(f"{name} failed due to an unexpected error.")
+    return fallback
+
+
+def llm_errors(action, expected=(APIError, ValueError), fallback=_RAISE):
+    """
+    Error handling for the public generation methods (sync or async). CircuitOpenError always
+    propagates; `expected` errors are logged and re-raised, anything else is logged and raised as
+    ValueError. With a `fallback`, both kinds return it instead of raising.
+    """
+    def decorate(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await method(*args, **kwargs)
+                except Exception as e:
+                    return _handle_llm_error(method.__name__, action, expected, fallback, e)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                return _handle_llm_error(method.__name__, action, expected, fallback, e)
+        return wrapper
+    return decorate
+
 
 class ChatGPTHandler:
     # ... (__init__ and _make_api_call remain the same) ...
-    def __init__(self, api_key):
+    def __init__(self, api_key, provider=None, validate=True, retry_policy=None, rate_limiter=None,
+                 circuit_breaker=None, circuit_scopes=()):
         if not api_key:
             raise ValueError("API key is required to initialize ChatGPTHandler.")
+        self.provider = provider or create_openai_provider(api_key, DEFAULT_MODEL) # See llm_providers.py
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.rate_limiter = rate_limiter or UNLIMITED
+        self.circuit_breaker = circuit_breaker
+        self.circuit_scopes = circuit_scopes # (key scope, provider scope), see HandlerRegistry.circuit_scopes
+        if validate:
+            self.validate_key()
+
+    def validate_key(self):
+        """Makes a cheap authenticated call to confirm the key works. Raises ValueError if it doesn't."""
         try:
-            self.client = OpenAI(api_key=api_key)
-            self.client.models.list()
-            print("OpenAI client initialized successfully.")
+            self.provider.validate_key()
+            print(f"LLM provider '{self.provider.name}' initialized successfully.")
         except AuthenticationError:
             print("AuthenticationError: Invalid OpenAI API key.")
             raise ValueError("Invalid OpenAI API key provided.")
@@ -26,73 +103,137 @@ class ChatGPTHandler:
             print(f"Error initializing OpenAI client: {e}")
             raise
 
-    def _make_api_call(self, messages, validation_func=None, max_retries=MAX_RETRIES, is_json_mode=False):
-        """Internal method for API calls with retry, validation, and optional JSON mode."""
+    # --- Circuit Breaker Hooks (no-ops without a breaker) ---
+    def _circuit_check(self):
+        """Raises CircuitOpenError right away if the key's or the provider's circuit is open."""
+        if self.circuit_breaker:
+            self.circuit_breaker.before_call(self.circuit_scopes)
+
+    def _circuit_success(self):
+        if self.circuit_breaker:
+            self.circuit_breaker.record_success(self.circuit_scopes)
+
+    def _circuit_failure(self, error):
+        """Only outage-type errors count; a 429 is about this key's quota, not the provider's health."""
+        if self.circuit_breaker and is_retryable(error):
+            scopes = self.circuit_scopes[:1] if isinstance(error, RateLimitError) else self.circuit_scopes
+            self.circuit_breaker.record_failure(scopes)
+
+    def _check_response(self, content, messages, validation_func, attempt):
+        """Validates a response. Returns None if valid, else a ValueError (and appends retry feedback to messages)."""
+        print(f"API Response received:\n{content[:200]}...")
+        if not validation_func:
+            return None
+        is_valid, validation_details = validation_func(content)
+        if is_valid:
+            print("API response validated successfully.")
+            return None
+        print(f"Validation failed for attempt {attempt}: {validation_details}")
+        # Add feedback for retry if validation failed
+        messages.append({"role": "assistant", "content": content})
+        messages.append({"role": "user", "content": f"The previous response was invalid ({validation_details}). Please adhere strictly to the required format and try again."})
+        return ValueError(f"API response failed validation: {validation_details}")
+
+    def _make_api_call(self, messages, validation_func=None, max_retries=None, is_json_mode=False, operation=None):
+        """
+        Internal method for API calls with retry, validation, and optional JSON mode.
+
+        Retries follow self.retry_policy (exponential backoff + jitter, Retry-After, per-call
+        deadline); calls are paced by the per-key token bucket. Validation failures are
+        retried immediately with feedback, non-retryable API errors fail fast.
+        Every attempt first checks the circuit breaker, so an open circuit raises
+        CircuitOpenError without sleeping. Every call is recorded in telemetry under `operation`.
+        """
+        state = self.retry_policy.begin(max_attempts=max_retries)
+        record = LLMCallRecord(operation, self.provider.model)
         last_error = None
-        for attempt in range(max_retries):
-            try:
-                print(f"Attempting API call ({attempt + 1}/{max_retries})...")
-                completion_args = {
-                    "model": DEFAULT_MODEL,
-                    "messages": messages,
-                    "temperature": 0.5,
-                }
-                # Use JSON mode if requested and model supports it (check OpenAI docs)
-                # Note: JSON mode requires specific prompt instructions for the model
-                if is_json_mode:
-                    # Check if the selected model supports JSON mode, adjust if necessary
-                    # For example, gpt-3.5-turbo-1106 and later support it.
-                    # Might need to change DEFAULT_MODEL if it doesn't.
-                    completion_args["response_format"] = {"type": "json_object"}
-                    print("Using JSON mode for API call.")
-
-
-                response = self.client.chat.completions.create(**completion_args)
-                content = response.choices[0].message.content.strip()
-
-                print(f"API Response received:\n{content[:200]}...")
-
-                if validation_func:
-                    is_valid, validation_details = validation_func(content)
-                    if is_valid:
-                        print("API response validated successfully.")
-                        return content
-                    else:
-                        print(f"Validation failed for attempt {attempt + 1}: {validation_details}")
-                        last_error = ValueError(f"API response failed validation: {validation_details}")
-                        # Add feedback for retry if validation failed
-                        messages.append({"role": "assistant", "content": content})
-                        messages.append({"role": "user", "content": f"The previous response was invalid ({validation_details}). Please adhere strictly to the required format and try again."})
-
-                else:
-                    return content # No validation needed
-
-            except (APIError, RateLimitError) as e:
-                print(f"API Error on attempt {attempt + 1}: {e}")
-                last_error = e
-                delay = RETRY_DELAY * (attempt + 1) # Simple linear backoff
-                if isinstance(e, RateLimitError):
-                    print(f"Rate limit exceeded, waiting {delay*2}s...")
-                    time.sleep(delay * 2)
-                else:
-                    print(f"Waiting {delay}s before retry...")
+        succeeded = False
+        try:
+            while state.next_attempt():
+                self._circuit_check()
+                waited = self.rate_limiter.acquire(timeout=state.remaining())
+                if waited is None:
+                    last_error = RetryDeadlineExceeded("Rate limiter queue is longer than the request deadline.")
+                    break
+                state.limiter_wait += waited
+                try:
+                    print(f"Attempting API call ({state.attempt}/{state.max_attempts})...")
+                    completion = self.provider.complete(messages, json_mode=is_json_mode, operation=operation)
+                    record.add_usage(completion.prompt_tokens, completion.completion_tokens)
+                    content = completion.text.strip()
+                except Exception as e:
+                    last_error = e
+                    self._circuit_failure(e)
+                    if not is_retryable(e):
+                        print(f"Non-retryable error on attempt {state.attempt}: {e}")
+                        raise
+                    delay = self.retry_policy.compute_delay(state.attempt, e)
+                    if not state.can_wait(delay):
+                        break
+                    print(f"API Error on attempt {state.attempt}: {e}. Waiting {delay:.2f}s before retry...")
                     time.sleep(delay)
-            except Exception as e:
-                print(f"Unexpected error on attempt {attempt + 1}: {e}")
-                last_error = e
-                time.sleep(RETRY_DELAY * (attempt + 1))
-
-            # Wait before retrying after validation failure
-            if isinstance(last_error, ValueError) and attempt < max_retries - 1:
-                print(f"Waiting {RETRY_DELAY}s before retrying after validation failure...")
-                time.sleep(RETRY_DELAY)
-
-        print(f"API call failed after {max_retries} retries.")
-        if last_error:
-            raise last_error # Raise the last error encountered (API or Validation)
-        else:
-            raise APIError("API call failed for an unknown reason after retries.")
+                    state.backoff_wait += delay
+                    continue
+
+                self._circuit_success() # The backend answered; validation problems aren't outages
+                last_error = self._check_response(content, messages, validation_func, state.attempt)
+                if last_error is None:
+                    succeeded = True
+                    return content
+                record.validation_failures += 1
+        finally:
+            retry_stats.record(state, succeeded)
+            record.finish(state, succeeded)
+
+        print(f"API call failed after {state.attempt} attempt(s).")
+        raise last_error or RetryDeadlineExceeded("API call failed for an unknown reason after retries.")
+
+    def _stream_api_call(self, messages, max_retries=None, operation=None, is_json_mode=False):
+        """
+        Streams a plain-text completion, yielding content deltas as they arrive.
+        Only failures before the first token are retried (a half-sent answer can't be replayed).
+        """
+        state = self.retry_policy.begin(max_attempts=max_retries)
+        record = LLMCallRecord(operation, self.provider.model)
+        last_error = None
+        succeeded = False
+        try:
+            while state.next_attempt():
+                self._circuit_check()
+                waited = self.rate_limiter.acquire(timeout=state.remaining())
+                if waited is None:
+                    last_error = RetryDeadlineExceeded("Rate limiter queue is longer than the request deadline.")
+                    break
+                state.limiter_wait += waited
+                received_any = False
+                usage = {}
+                try:
+                    print(f"Attempting streaming API call ({state.attempt}/{state.max_attempts})...")
+                    for delta in self.provider.stream(messages, json_mode=is_json_mode, operation=operation, usage=usage):
+                        if not received_any:
+                            received_any = True
+                            self._circuit_success()
+                        yield delta
+                    record.add_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+                    succeeded = True
+                    return
+                except Exception as e:
+                    last_error = e
+                    self._circuit_failure(e)
+                    if received_any or not is_retryable(e):
+                        raise
+                    delay = self.retry_policy.compute_delay(state.attempt, e)
+                    if not state.can_wait(delay):
+                        break
+                    print(f"API Error on streaming attempt {state.attempt}: {e}. Waiting {delay:.2f}s before retry...")
+                    time.sleep(delay)
+                    state.backoff_wait += delay
+        finally:
+            retry_stats.record(state, succeeded)
+            record.finish(state, succeeded)
 
+        print(f"Streaming API call failed after {state.attempt} attempt(s).")
+        raise last_error or RetryDeadlineExceeded("Streaming API call failed for an unknown reason after retries.")
 
     # --- Validation Functions ---
     def _validate_question_json(self, response_content):
@@ -113,16 +254,9 @@ class ChatGPTHandler:
 
             # --- Added Check: Iterate through questions ---
             for i, q_item in enumerate(data['questions']):
-                if not isinstance(q_item, dict):
-                    # Found an item that is not a dictionary (e.g., a string)
-                    return False, f"Item at index {i} in 'questions' list is not a valid JSON object (got type {type(q_item)})."
-
-                # Now we know q_item is a dict, perform previous checks
-                required_keys = ('type', 'text', 'answer')
-                if not all(k in q_item for k in required_keys):
-                    return False, f"Question at index {i} missing required keys {required_keys}. Found: {q_item.keys()}"
-                if q_item.get('type') == 'multiple_choice' and 'options' not in q_item:
-                    return False, f"Multiple choice question at index {i} missing 'options'."
+                problem = self._check_question_item(q_item, i)
+                if problem:
+                    return False, problem
             # --- End Added Check ---
 
             return True, "Valid structure"
@@ -137,6 +271,18 @@ class ChatGPTHandler:
         except Exception as e:
             return False, f"Unexpected validation error: {e}"
 
+    def _check_question_item(self, q_item, index):
+        """Returns None if one question dict has the required shape, otherwise a description of the problem."""
+        if not isinstance(q_item, dict):
+            # Found an item that is not a dictionary (e.g., a string)
+            return f"Item at index {index} in 'questions' list is not a valid JSON object (got type {type(q_item)})."
+        required_keys = ('type', 'text', 'answer')
+        if not all(k in q_item for k in required_keys):
+            return f"Question at index {index} missing required keys {required_keys}. Found: {q_item.keys()}"
+        if q_item.get('type') == 'multiple_choice' and 'options' not in q_item:
+            return f"Multiple choice question at index {index} missing 'options'."
+        return None
+
     def _validate_css(self, response_content):
         """Basic validation for CSS. Returns (bool, str_details). Allows backticks but warns."""
         content = response_content.strip()
@@ -167,6 +313,14 @@ class ChatGPTHandler:
 
         return is_valid, " ".join(details)
 
+    def _check_score_value(self, score, label="'score'"):
+        """Returns None if `score` is a number in [0.0, 1.0], otherwise a description of the problem."""
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            return f"{label} is not a number (got {type(score)})."
+        if not (0.0 <= score <= 1.0):
+            return f"{label} ({score}) is outside the valid range [0.0, 1.0]."
+        return None
+
     def _validate_score_json(self, response_content):
         """Validates score JSON. Expects {"score": float}. Returns (bool, str_details)."""
         try:
@@ -179,22 +333,23 @@ class ChatGPTHandler:
                 return False, "Response is not a JSON object."
             if 'score' not in data:
                 return False, "JSON missing 'score' key."
-            score = data['score']
-            if not isinstance(score, (int, float)):
-                return False, f"'score' is not a number (got {type(score)})."
-            if not (0.0 <= score <= 1.0):
-                return False, f"'score' ({score}) is outside the valid range [0.0, 1.0]."
+            problem = self._check_score_value(data['score'])
+            if problem:
+                return False, problem
             return True, "Valid score format."
         except json.JSONDecodeError as e:
             return False, f"Invalid JSON: {e}. Response snippet: {response_content[:100]}"
         except Exception as e:
             return False, f"Unexpected validation error: {e}"
 
-    # --- Generation Methods ---
-    def generate_questions(self, text, num_questions=5, question_types=['multiple_choice', 'fill_in_the_blank', 'free_response']):
-        """Generates study questions. Uses JSON mode."""
-        # ... (Prompt remains largely the same, but ensure it asks for JSON object explicitly) ...
+    # --- Prompt Builders / Response Parsers (shared by sync and async handlers) ---
+    def _build_questions_messages(self, text, num_questions, question_types, exclude_texts=None):
         type_string = ", ".join(question_types)
+        source_text = condense_text(text, MAX_SOURCE_TOKENS_PER_CALL)
+        exclude_note = ""
+        if exclude_texts: # Follow-up request for missing items
+            exclude_note = "\nThese questions already exist - do NOT repeat them or ask about the same fact:\n"
+            exclude_note += "\n".join(f"- {t}" for t in exclude_texts) + "\n"
         prompt = f"""
 Based on the following text, generate {num_questions} study questions...
 Include a mix of the following types ONLY: {type_string}. DO NOT use any other type names like "text".
@@ -216,54 +371,27 @@ Example formats MUST be followed precisely:
 {{ "type": "free_response", "text": "...", "answer": "..." }}
 
 Ensure the entire output is ONLY the JSON object, starting with {{ and ending with }}. NO extra text, NO explanations, NO markdown.
-
+{exclude_note}
 Source Text:
 ---
-{text[:3000]}
+{source_text}
 ---
 """
-        messages = [{"role": "system", "content": "You are a helpful assistant designed to create study questions. Respond ONLY with the requested JSON object."},
-                    {"role": "user", "content": prompt}]
-
-        try:
-            # Request JSON mode
-            response_content = self._make_api_call(messages, validation_func=self._validate_question_json, is_json_mode=True)
-
-            # Clean potential markdown just in case JSON mode still adds it (less likely)
-            if response_content.startswith("```json"):
-                response_content = re.sub(r"^```json\s*|\s*```$", "", response_content, flags=re.MULTILINE)
+        return [{"role": "system", "content": "You are a helpful assistant designed to create study questions. Respond ONLY with the requested JSON object."},
+                {"role": "user", "content": prompt}]
 
-            data = json.loads(response_content)
-            questions_data = data.get('questions', []) # Get the list of dicts
-
-            # --- REMOVED THE LOOP THAT CREATED Question OBJECTS ---
-            # generated_questions = []
-            # for q_data in questions_data:
-            #     try:
-            #         # This call is moved to the route
-            #         # question = create_question_from_dict(q_data)
-            #         # generated_questions.append(question)
-            #         pass # Just validate structure was okay earlier
-            #     except ValueError as e:
-            #          print(f"Skipping question due to parsing error: {e}. Data: {q_data}")
-            #     except Exception as e:
-            #          print(f"Unexpected error creating question object: {e}. Data: {q_data}")
-
-            print(f"API returned {len(questions_data)} potential questions.")
-            # Return the raw list of dictionaries
-            return questions_data
-
-
-        except (APIError, ValueError, json.JSONDecodeError) as e:
-            print(f"Error generating questions: {e}")
-            raise e
-        except Exception as e:
-            print(f"An unexpected error occurred in generate_questions: {e}")
-            raise ValueError("Failed to generate questions due to an unexpected error.")
+    def _parse_questions(self, response_content):
+        # Clean potential markdown just in case JSON mode still adds it (less likely)
+        if response_content.startswith("```json"):
+            response_content = re.sub(r"^```json\s*|\s*```$", "", response_content, flags=re.MULTILINE)
 
+        data = json.loads(response_content)
+        questions_data = data.get('questions', []) # Get the list of dicts
+        print(f"API returned {len(questions_data)} potential questions.")
+        # Return the raw list of dictionaries (Question objects are created in the route)
+        return questions_data
 
-    def generate_hint(self, question_text, context_text=""):
-        # ... (Remains the same) ...
+    def _build_hint_messages(self, question_text, context_text=""):
         prompt = f"""
         A student needs a hint for the following study question.
         Provide a helpful clue or piece of related information that guides them towards the answer, but **DO NOT give away the final answer directly**.
@@ -276,23 +404,10 @@ Source Text:
             prompt += f"\nRelevant context from the source material (optional):\n---\n{context_text[:500]}\n---\n"
         prompt += "\nHint:"
 
-        messages = [{"role": "system", "content": "You are a helpful study assistant providing hints for questions without revealing the answer."},
-                    {"role": "user", "content": prompt}]
-        try:
-            # No complex validation needed, just expect text back
-            hint_text = self._make_api_call(messages, validation_func=None)
-            print(f"Hint generated successfully for: {question_text[:50]}")
-            return hint_text
-        except APIError as e:
-            print(f"Error generating hint: {e}")
-            raise # Re-raise to be handled by the Flask route
-        except Exception as e:
-            print(f"An unexpected error occurred in generate_hint: {e}")
-            raise ValueError("Failed to generate hint due to an unexpected error.")
-
+        return [{"role": "system", "content": "You are a helpful study assistant providing hints for questions without revealing the answer."},
+                {"role": "user", "content": prompt}]
 
-    def generate_explanation(self, question_text, correct_answer_display, user_answer=None, is_correct=None):
-        # ... (Remains the same) ...
+    def _build_explanation_messages(self, question_text, correct_answer_display, user_answer=None, is_correct=None):
         prompt = f"""
         Explain briefly (1-3 sentences) why the answer to the following question is correct.
         Focus on the core concept being tested.
@@ -303,7 +418,7 @@ Source Text:
         Correct Answer:
         "{correct_answer_display}"
         """
-        # ... (Include user answer/status in prompt if available - same as before) ...
+        # Include user answer/status in prompt if available
         if user_answer is not None and is_correct is not None:
             status = "correctly" if is_correct else "incorrectly"
             prompt += f'\nThe student answered "{user_answer}" ({status}). '
@@ -313,25 +428,15 @@ Source Text:
                 prompt += "Reinforce why their understanding is correct."
         prompt += "\n\nExplanation:"
 
-        messages = [{"role": "system", "content": "You are an educational assistant explaining the reasoning behind answers."},
-                    {"role": "user", "content": prompt}]
-
-        try:
-            explanation_text = self._make_api_call(messages, validation_func=None)
-            print(f"Explanation generated successfully for: {question_text[:50]}")
-            if explanation_text.startswith('"') and explanation_text.endswith('"'):
-                explanation_text = explanation_text[1:-1]
-            return explanation_text
-        except APIError as e:
-            print(f"Error generating explanation: {e}")
-            raise
-        except Exception as e:
-            print(f"An unexpected error occurred in generate_explanation: {e}")
-            raise ValueError("Failed to generate explanation due to an unexpected error.")
+        return [{"role": "system", "content": "You are an educational assistant explaining the reasoning behind answers."},
+                {"role": "user", "content": prompt}]
 
+    def _clean_explanation(self, explanation_text):
+        if explanation_text.startswith('"') and explanation_text.endswith('"'):
+            explanation_text = explanation_text[1:-1]
+        return explanation_text
 
-    def generate_css_theme(self, theme_description):
-        """Generates CSS rules based on a theme description. Cleans output."""
+    def _build_css_messages(self, theme_description):
         prompt = f"""
         Generate CSS code ONLY to style a simple web application based on the following theme description.
         The application uses Bootstrap 5, so target common Bootstrap classes and standard HTML elements (body, .navbar, .btn, .btn-primary, .card, .alert, h1, p, a).
@@ -343,44 +448,23 @@ Source Text:
 
         CSS Code:
         """
-        messages = [{"role": "system", "content": "You are a CSS generator. Output ONLY valid CSS code based on the user's theme description. NO MARKDOWN."},
-                    {"role": "user", "content": prompt}]
-
-        try:
-            # Use the updated CSS validation (warns on backticks, fails on intro text)
-            css_code = self._make_api_call(messages, validation_func=self._validate_css)
-
-            # --- Explicitly clean the output ---
-            # Remove markdown code blocks (```css ... ``` or just ``` ... ```)
-            cleaned_css = re.sub(r"^```[a-z]*\s*|\s*```$", "", css_code, flags=re.MULTILINE | re.IGNORECASE).strip()
-
-            # Remove potential leading non-CSS text if validation missed it (less likely now)
-            lines = cleaned_css.splitlines()
-            first_meaningful_line = 0
-            for i, line in enumerate(lines):
-                if line.strip().startswith(('/', '{', '.', '#', '@', '*')) or ':' in line:
-                    first_meaningful_line = i
-                    break
-            cleaned_css = "\n".join(lines[first_meaningful_line:])
-
-
-            print(f"CSS theme generated and cleaned successfully for: {theme_description}")
-            return cleaned_css
-
-        except (APIError, ValueError) as e: # Catch validation errors too
-            print(f"Error generating CSS theme: {e}")
-            raise
-        except Exception as e:
-            print(f"An unexpected error occurred in generate_css_theme: {e}")
-            raise ValueError("Failed to generate CSS theme due to an unexpected error.")
-
-    def grade_free_response(self, question_text, suggested_answer, user_answer):
-        """
-        Uses API to grade a free-response answer against a suggested answer.
-
-        Returns:
-            float: Score between 0.0 and 1.0.
-        """
+        return [{"role": "system", "content": "You are a CSS generator. Output ONLY valid CSS code based on the user's theme description. NO MARKDOWN."},
+                {"role": "user", "content": prompt}]
+
+    def _clean_css(self, css_code):
+        # Remove markdown code blocks (```css ... ``` or just ``` ... ```)
+        cleaned_css = re.sub(r"^```[a-z]*\s*|\s*```$", "", css_code, flags=re.MULTILINE | re.IGNORECASE).strip()
+
+        # Remove potential leading non-CSS text if validation missed it (less likely now)
+        lines = cleaned_css.splitlines()
+        first_meaningful_line = 0
+        for i, line in enumerate(lines):
+            if line.strip().startswith(('/', '{', '.', '#', '@', '*')) or ':' in line:
+                first_meaningful_line = i
+                break
+        return "\n".join(lines[first_meaningful_line:])
+
+    def _build_score_messages(self, question_text, suggested_answer, user_answer):
         prompt = f"""
         Evaluate the student's answer to the following question based on the provided suggested answer.
         Determine how well the student's answer captures the key points or concepts of the suggested answer.
@@ -397,26 +481,828 @@ Source Text:
 
         JSON Response:
         """
-        messages = [{"role": "system", "content": "You are an impartial grader evaluating student answers. Respond ONLY with a JSON object like {\"score\": float_value}."},
-                    {"role": "user", "content": prompt}]
+        return [{"role": "system", "content": "You are an impartial grader evaluating student answers. Respond ONLY with a JSON object like {\"score\": float_value}."},
+                {"role": "user", "content": prompt}]
 
-        try:
-            # Use JSON mode and validation
-            response_content = self._make_api_call(messages, validation_func=self._validate_score_json, is_json_mode=True)
+    def _parse_score(self, response_content):
+        # Clean potential markdown just in case
+        if response_content.startswith("```json"):
+            response_content = re.sub(r"^```json\s*|\s*```$", "", response_content, flags=re.MULTILINE)
+        data = json.loads(response_content)
+        return float(data['score'])
+
+    def _validate_score_batch_json(self, response_content, expected_ids=None):
+        """
+        Validates batch score JSON: {"scores": [{"id": int, "score": float}, ...]}.
+
+        Returns (bool, str_details, valid_scores): valid_scores maps id -> score for every item that
+        passed, so callers can keep those and re-grade only the rest. bool is True only when the
+        structure is valid and (if given) every id in expected_ids has a valid score.
+        """
+        def check_score(item_id, score):
+            return self._check_score_value(score, label=f"score for id {item_id}")
+        is_valid, details, valid_scores = self._validate_batch_items(response_content, 'scores', 'score', check_score, expected_ids)
+        return is_valid, details, {i: float(score) for i, score in valid_scores.items()}
+
+    def _validate_score_batch_structure(self, response_content):
+        """validation_func for _make_api_call: only the overall shape must be right; bad items are re-graded separately."""
+        return self._validate_batch_structure(self._validate_score_batch_json(response_content))
+
+    def _build_score_batch_messages(self, items, ids):
+        answers = "\n".join(
+            json.dumps({"id": i, "question": items[i][0], "suggested_answer": items[i][1], "student_answer": items[i][2]})
+            for i in ids
+        )
+        prompt = f"""
+        Evaluate each student's answer below based on its suggested answer.
+        Determine how well each student answer captures the key points or concepts of the suggested answer.
+        Respond ONLY with a JSON object of the form {{"scores": [{{"id": <id>, "score": <float>}}, ...]}} containing exactly one entry per id,
+        where each score is a floating-point number between 0.0 (completely incorrect/irrelevant) and 1.0 (perfectly correct/captures all key points).
+        Grade every answer independently.
+
+        Answers (one JSON object per line):
+        {answers}
+
+        JSON Response:
+        """
+        return [{"role": "system", "content": "You are an impartial grader evaluating student answers. Respond ONLY with a JSON object like {\"scores\": [{\"id\": 0, \"score\": float_value}]}."},
+                {"role": "user", "content": prompt}]
 
-            # Clean potential markdown just in case
+    def _validate_batch_items(self, response_content, list_key, value_key, check_value, expected_ids=None):
+        """
+        Validates batch JSON of the form {list_key: [{"id": int, value_key: ...}, ...]}. `check_value(id, value)`
+        returns None or a problem description. Returns (bool, str_details, valid_values) like _validate_score_batch_json.
+        """
+        try:
             if response_content.startswith("```json"):
                 response_content = re.sub(r"^```json\s*|\s*```$", "", response_content, flags=re.MULTILINE)
-
             data = json.loads(response_content)
-            score = float(data['score'])
-            print(f"Free response graded. Score: {score} for question: {question_text[:50]}...")
-            return score
-
-        except (APIError, ValueError, json.JSONDecodeError) as e:
-            print(f"Error grading free response: {e}")
-            # Decide on fallback score - 0.0 seems safest if grading fails
-            return 0.0
+            if not isinstance(data, dict):
+                return False, "Response is not a JSON object.", {}
+            if not isinstance(data.get(list_key), list):
+                return False, f"JSON missing '{list_key}' list.", {}
+
+            valid_values = {}
+            problems = []
+            for i, item in enumerate(data[list_key]):
+                if not isinstance(item, dict) or 'id' not in item or value_key not in item:
+                    problems.append(f"Item at index {i} needs 'id' and '{value_key}' keys.")
+                    continue
+                problem = check_value(item['id'], item[value_key])
+                if problem:
+                    problems.append(problem)
+                    continue
+                valid_values[item['id']] = item[value_key]
+
+            if expected_ids is not None:
+                valid_values = {i: v for i, v in valid_values.items() if i in expected_ids}
+                missing = [i for i in expected_ids if i not in valid_values]
+                if missing:
+                    problems.append(f"No valid {value_key} for id(s) {missing}.")
+            if problems:
+                return False, " ".join(problems), valid_values
+            return True, f"Valid batch {value_key} format.", valid_values
+        except json.JSONDecodeError as e:
+            return False, f"Invalid JSON: {e}. Response snippet: {response_content[:100]}", {}
         except Exception as e:
-            print(f"An unexpected error occurred during free response grading: {e}")
-            return 0.0 # Fallback score
\ No newline at end of file
+            return False, f"Unexpected validation error: {e}", {}
+
+    def _validate_hint_batch_json(self, response_content, expected_ids=None):
+        """Validates batch hint JSON: {"hints": [{"id": int, "hint": str}, ...]}."""
+        def check_hint(item_id, hint):
+            if not isinstance(hint, str) or not hint.strip():
+                return f"Hint for id {item_id} is empty or not a string."
+            return None
+        is_valid, details, valid_hints = self._validate_batch_items(response_content, 'hints', 'hint', check_hint, expected_ids)
+        return is_valid, details, {i: h.strip() for i, h in valid_hints.items()}
+
+    @staticmethod
+    def _validate_batch_structure(result):
+        """Turns a batch validator's (bool, details, valid_items) into a validation_func result: any valid item is enough."""
+        is_valid, details, valid_items = result
+        return (True, details) if valid_items or is_valid else (False, details)
+
+    def _validate_hint_batch_structure(self, response_content):
+        """validation_func for _make_api_call: only the overall shape must be right; bad items are re-requested separately."""
+        return self._validate_batch_structure(self._validate_hint_batch_json(response_content))
+
+    def _build_hint_batch_messages(self, question_texts, ids):
+        questions = "\n".join(json.dumps({"id": i, "question": question_texts[i]}) for i in ids)
+        prompt = f"""
+        Students will need hints for the following study questions.
+        For each question, provide a helpful clue or piece of related information that guides them towards the answer, but **DO NOT give away the final answer directly**.
+        Each hint should make them think or recall the relevant concept. Keep each hint concise (1-2 sentences).
+        Respond ONLY with a JSON object of the form {{"hints": [{{"id": <id>, "hint": "<hint>"}}, ...]}} containing exactly one entry per id.
+
+        Questions (one JSON object per line):
+        {questions}
+
+        JSON Response:
+        """
+        return [{"role": "system", "content": "You are a helpful study assistant providing hints for questions without revealing the answer. Respond ONLY with a JSON object like {\"hints\": [{\"id\": 0, \"hint\": \"...\"}]}."},
+                {"role": "user", "content": prompt}]
+
+    def _validate_option_explanation_batch_json(self, response_content, option_counts, expected_ids=None):
+        """
+        Validates {"explanations": [{"id": int, "options": [str, ...]}, ...]}; each list needs exactly
+        option_counts[id] non-empty strings.
+        """
+        def check_options(item_id, explanations):
+            if item_id not in option_counts:
+                return f"Unknown id {item_id}."
+            if not isinstance(explanations, list) or len(explanations) != option_counts[item_id]:
+                return f"Explanations for id {item_id} must be a list of {option_counts[item_id]} strings."
+            if not all(isinstance(e, str) and e.strip() for e in explanations):
+                return f"Explanations for id {item_id} contain an empty or non-string entry."
+            return None
+        is_valid, details, valid = self._validate_batch_items(response_content, 'explanations', 'options', check_options, expected_ids)
+        return is_valid, details, {i: [e.strip() for e in explanations] for i, explanations in valid.items()}
+
+    def _build_option_explanation_batch_messages(self, questions, ids):
+        lines = "\n".join(
+            json.dumps({"id": i, "question": questions[i][0], "options": questions[i][1], "correct_index": questions[i][2]})
+            for i in ids
+        )
+        prompt = f"""
+        For each multiple-choice question below, explain briefly (1-3 sentences each) what a student who picks each option should know.
+        For the option at "correct_index", explain why it is correct. For every other option, clarify the misunderstanding behind it and point towards the correct answer.
+        Focus on the core concept being tested.
+        Respond ONLY with a JSON object of the form {{"explanations": [{{"id": <id>, "options": ["<explanation for option 0>", ...]}}, ...]}}
+        containing exactly one entry per id, with exactly one explanation per option in the same order as the options.
+
+        Questions (one JSON object per line):
+        {lines}
+
+        JSON Response:
+        """
+        return [{"role": "system", "content": "You are an educational assistant explaining the reasoning behind answers. Respond ONLY with the requested JSON object."},
+                {"role": "user", "content": prompt}]
+
+    # --- Generation Methods ---
+    @llm_errors("generating questions")
+    def generate_questions(self, text, num_questions=5, question_types=['multiple_choice', 'fill_in_the_blank', 'free_response']):
+        """Generates study questions. Uses JSON mode."""
+        messages = self._build_questions_messages(text, num_questions, question_types)
+        # Request JSON mode
+        response_content = self._make_api_call(messages, validation_func=self._validate_question_json, is_json_mode=True,
+                                               operation="generate_questions")
+        return self._parse_questions(response_content)
+
+
+    def generate_questions_stream(self, text, num_questions=5, question_types=DEFAULT_QUESTION_TYPES,
+                                  chunk_tokens=1500, max_workers=4, token_budget=None, exclude_texts=()):
+        """
+        Yields validated question dicts one at a time, as soon as each has been streamed.
+
+        Long texts are chunked as in generate_questions_map_reduce; every chunk gets a share of
+        `num_questions` and is streamed in its own thread. Malformed or duplicate items are dropped
+        and only the shortfall is requested again, so one bad item never costs the whole response.
+        Questions arrive in completion order, not document order. Questions whose text is in
+        `exclude_texts` (e.g. already stored by an interrupted run) are treated as duplicates.
+        If the consumer stops early (closes the generator or raises), the workers stop at their
+        next delta and chunks that haven't started are cancelled, so no more completions are paid for.
+        """
+        text = condense_text(text, token_budget) if token_budget else strip_repeated_lines(text)
+        chunks = split_into_chunks(text, max_tokens=chunk_tokens) or [text]
+        assignments = self._assign_chunk_quotas(chunks, num_questions)
+        print(f"Streaming generation: {num_questions} questions over {len(assignments)} chunk(s).")
+
+        results = queue.Queue()
+        stop = threading.Event()
+        seen = {" ".join(str(t).lower().split()) for t in exclude_texts}
+        seen_lock = threading.Lock()
+
+        def claim(q_item):
+            key = " ".join(str(q_item.get('text', '')).lower().split())
+            with seen_lock:
+                if key in seen:
+                    return False
+                seen.add(key)
+                return True
+
+        def worker(chunk, quota):
+            try:
+                for q_item in self._stream_chunk_questions(chunk, quota, question_types, claim, stop):
+                    results.put(('item', q_item))
+                results.put(('done', None))
+            except Exception as e:
+                results.put(('error', e))
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(assignments))), thread_name_prefix='question-stream')
+        for chunk, quota in assignments:
+            executor.submit(worker, chunk, quota)
+
+        produced = 0
+        errors = []
+        pending = len(assignments)
+        try:
+            while pending:
+                kind, value = results.get()
+                if kind == 'item':
+                    produced += 1
+                    yield value
+                    continue
+                pending -= 1
+                if kind == 'error':
+                    print(f"Streaming chunk failed: {value}")
+                    errors.append(value)
+        finally:
+            stop.set() # No-op for finished workers; stops the rest if the consumer gave up early
+            executor.shutdown(wait=False, cancel_futures=True)
+        if not produced and errors:
+            raise errors[0]
+
+    @staticmethod
+    def _assign_chunk_quotas(chunks, num_questions):
+        """Spreads num_questions over the chunks as evenly as possible. Returns [(chunk, quota), ...]."""
+        if len(chunks) >= num_questions: # One question each from evenly spaced chunks
+            return [(chunks[i * len(chunks) // num_questions], 1) for i in range(num_questions)]
+        base, extra = divmod(num_questions, len(chunks))
+        return [(chunk, base + (1 if i < extra else 0)) for i, chunk in enumerate(chunks)]
+
+    def _stream_chunk_questions(self, text, quota, question_types, claim, stop=None):
+        """
+        Streams up to `quota` questions for one chunk, re-requesting only the missing ones (up to MAX_RETRIES rounds).
+        Returns early, closing the completion stream, once `stop` (a threading.Event) is set.
+        """
+        accepted_texts = []
+        last_error = None
+        for round_number in range(MAX_RETRIES):
+            if stop is not None and stop.is_set():
+                return
+            missing = quota - len(accepted_texts)
+            messages = self._build_questions_messages(text, missing, question_types, exclude_texts=accepted_texts)
+            parser = JSONArrayStreamParser('questions')
+            try:
+                with closing(self._stream_api_call(messages, is_json_mode=True, operation="stream_questions")) as deltas:
+                    for delta in deltas:
+                        if stop is not None and stop.is_set():
+                            return
+                        for q_item in parser.feed(delta):
+                            problem = self._check_question_item(q_item, parser.items_parsed - 1)
+                            if problem:
+                                print(f"Skipping streamed question: {problem}")
+                                continue
+                            if not claim(q_item):
+                                print(f"Skipping duplicate streamed question: {str(q_item.get('text'))[:50]}")
+                                continue
+                            accepted_texts.append(q_item['text'])
+                            yield q_item
+                            if len(accepted_texts) >= quota:
+                                return
+            except Exception as e:
+                if not is_retryable(e) and not isinstance(e, RetryDeadlineExceeded):
+                    raise
+                last_error = e
+                print(f"Question stream interrupted: {e}")
+            for raw, error in parser.errors:
+                print(f"Skipping malformed streamed question ({error}): {raw[:100]}")
+            print(f"Stream round {round_number + 1} left {quota - len(accepted_texts)} question(s) missing; requesting only those.")
+        if not accepted_texts and last_error:
+            raise last_error
+
+    @llm_errors("generating hint", expected=(APIError,)) # Re-raised to be handled by the Flask route
+    def generate_hint(self, question_text, context_text=""):
+        messages = self._build_hint_messages(question_text, context_text)
+        # No complex validation needed, just expect text back
+        hint_text = self._make_api_call(messages, validation_func=None, operation="generate_hint")
+        print(f"Hint generated successfully for: {question_text[:50]}")
+        return hint_text
+
+
+    @llm_errors("generating explanation", expected=(APIError,))
+    def generate_explanation(self, question_text, correct_answer_display, user_answer=None, is_correct=None):
+        messages = self._build_explanation_messages(question_text, correct_answer_display, user_answer, is_correct)
+        explanation_text = self._make_api_call(messages, validation_func=None, operation="generate_explanation")
+        print(f"Explanation generated successfully for: {question_text[:50]}")
+        return self._clean_explanation(explanation_text)
+
+
+    @llm_errors("generating CSS theme") # Validation errors (ValueError) are expected too
+    def generate_css_theme(self, theme_description):
+        """Generates CSS rules based on a theme description. Cleans output."""
+        messages = self._build_css_messages(theme_description)
+        # Use the updated CSS validation (warns on backticks, fails on intro text)
+        css_code = self._make_api_call(messages, validation_func=self._validate_css, operation="generate_css_theme")
+        cleaned_css = self._clean_css(css_code)
+        print(f"CSS theme generated and cleaned successfully for: {theme_description}")
+        return cleaned_css
+
+    @llm_errors("grading free response", fallback=0.0) # 0.0 seems safest if grading fails
+    def grade_free_response(self, question_text, suggested_answer, user_answer):
+        """
+        Uses API to grade a free-response answer against a suggested answer.
+
+        Returns:
+            float: Score between 0.0 and 1.0.
+        """
+        messages = self._build_score_messages(question_text, suggested_answer, user_answer)
+        # Use JSON mode and validation
+        response_content = self._make_api_call(messages, validation_func=self._validate_score_json, is_json_mode=True,
+                                               operation="grade_free_response")
+        score = self._parse_score(response_content)
+        print(f"Free response graded. Score: {score} for question: {question_text[:50]}...")
+        return score
+
+
+    def grade_free_responses_batch(self, items, batch_size=GRADING_BATCH_SIZE):
+        """
+        Grades many free-response answers with one completion per `batch_size` answers.
+
+        Args:
+            items: list of (question_text, suggested_answer, user_answer) tuples.
+
+        Returns:
+            list[float]: Scores in the same order as `items` (0.0 for anything that never validated).
+        """
+        scores = [None] * len(items)
+        for start in range(0, len(items), batch_size):
+            pending = list(range(start, min(start + batch_size, len(items))))
+            for round_number in range(MAX_RETRIES):
+                try:
+                    content = self._make_api_call(self._build_score_batch_messages(items, pending),
+                                                  validation_func=self._validate_score_batch_structure, is_json_mode=True,
+                                                  operation="grade_free_responses_batch")
+                except Exception as e:
+                    print(f"Error grading free response batch: {e}")
+                    break
+                pending = self._apply_batch_scores(content, pending, scores)
+                if not pending:
+                    break
+                print(f"Re-grading {len(pending)} item(s) that failed validation (round {round_number + 1}).")
+        print(f"Batch graded {len(items)} free response(s).")
+        return [score if score is not None else 0.0 for score in scores]
+
+    def generate_hints_batch(self, question_texts, batch_size=HINT_BATCH_SIZE):
+        """
+        Generates hints for many questions with one JSON completion per `batch_size` questions
+        (the instructions are sent once per batch instead of once per hint).
+
+        A batch whose call fails is skipped, so the other batches' hints are still returned.
+
+        Returns:
+            dict: index into `question_texts` -> hint, for every question that got a valid hint.
+        """
+        hints = {}
+        for start in range(0, len(question_texts), batch_size):
+            pending = list(range(start, min(start + batch_size, len(question_texts))))
+            for round_number in range(MAX_RETRIES):
+                try:
+                    content = self._make_api_call(self._build_hint_batch_messages(question_texts, pending),
+                                                  validation_func=self._validate_hint_batch_structure, is_json_mode=True,
+                                                  operation="generate_hints_batch")
+                except Exception as e:
+                    print(f"Error generating hint batch: {e}")
+                    break
+                is_valid, details, valid_hints = self._validate_hint_batch_json(content, expected_ids=pending)
+                if not is_valid:
+                    print(f"Batch hint validation: {details}")
+                hints.update(valid_hints)
+                pending = [i for i in pending if i not in hints]
+                if not pending:
+                    break
+                print(f"Re-requesting {len(pending)} hint(s) that failed validation (round {round_number + 1}).")
+        print(f"Batch generated {len(hints)} of {len(question_texts)} hint(s).")
+        return hints
+
+    def generate_option_explanations_batch(self, questions, batch_size=OPTION_EXPLANATION_BATCH_SIZE):
+        """
+        Precomputes feedback for every option of many multiple-choice questions, one JSON completion
+        per `batch_size` questions.
+
+        A batch whose call fails is skipped, so the other batches' explanations are still returned.
+
+        Args:
+            questions: list of (question_text, options, correct_index) tuples.
+
+        Returns:
+            dict: index into `questions` -> list of explanations (one per option), for every question that validated.
+        """
+        option_counts = {i: len(q[1]) for i, q in enumerate(questions)}
+        explanations = {}
+        for start in range(0, len(questions), batch_size):
+            pending = list(range(start, min(start + batch_size, len(questions))))
+            for round_number in range(MAX_RETRIES):
+                try:
+                    content = self._make_api_call(
+                        self._build_option_explanation_batch_messages(questions, pending),
+                        validation_func=lambda c: self._validate_batch_structure(self._validate_option_explanation_batch_json(c, option_counts)),
+                        is_json_mode=True, operation="generate_option_explanations_batch")
+                except Exception as e:
+                    print(f"Error generating option explanation batch: {e}")
+                    break
+                is_valid, details, valid = self._validate_option_explanation_batch_json(content, option_counts, expected_ids=pending)
+                if not is_valid:
+                    print(f"Batch option explanation validation: {details}")
+                explanations.update(valid)
+                pending = [i for i in pending if i not in explanations]
+                if not pending:
+                    break
+                print(f"Re-requesting option explanations for {len(pending)} question(s) (round {round_number + 1}).")
+        print(f"Batch generated option explanations for {len(explanations)} of {len(questions)} question(s).")
+        return explanations
+
+    def _apply_batch_scores(self, content, pending, scores):
+        """Stores valid scores from a batch response. Returns the ids that still need grading."""
+        is_valid, details, valid_scores = self._validate_score_batch_json(content, expected_ids=pending)
+        if not is_valid:
+            print(f"Batch score validation: {details}")
+        for i, score in valid_scores.items():
+            scores[i] = score
+        return [i for i in pending if scores[i] is None]
+
+    # --- Streaming Methods (yield text deltas; caller assembles and persists the final text) ---
+    def stream_hint(self, question_text, context_text=""):
+        return self._stream_api_call(self._build_hint_messages(question_text, context_text), operation="stream_hint")
+
+    def stream_explanation(self, question_text, correct_answer_display, user_answer=None, is_correct=None):
+        return self._stream_api_call(self._build_explanation_messages(question_text, correct_answer_display, user_answer, is_correct),
+                                     operation="stream_explanation")
+
+class AsyncChatGPTHandler(ChatGPTHandler):
+    """
+    asyncio version of ChatGPTHandler. Same public methods, but each one is a coroutine,
+    so independent calls (e.g. grading + explanation) can run concurrently.
+
+    Coroutines must run on the shared background loop: use run_async() / run_concurrently().
+    """
+
+    def __init__(self, api_key, provider=None, retry_policy=None, rate_limiter=None, circuit_breaker=None, circuit_scopes=()):
+        if not api_key:
+            raise ValueError("API key is required to initialize AsyncChatGPTHandler.")
+        self.provider = provider or create_openai_provider(api_key, DEFAULT_MODEL, use_async=True)
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.rate_limiter = rate_limiter or UNLIMITED
+        self.circuit_breaker = circuit_breaker
+        self.circuit_scopes = circuit_scopes
+
+    # --- Circuit Breaker Hooks (the breaker does blocking DB I/O, so it runs in a worker thread, never on the loop) ---
+    async def _circuit_check_async(self):
+        if self.circuit_breaker:
+            await asyncio.to_thread(self._circuit_check)
+
+    async def _circuit_success_async(self):
+        if self.circuit_breaker:
+            await asyncio.to_thread(self._circuit_success)
+
+    async def _circuit_failure_async(self, error):
+        if self.circuit_breaker:
+            await asyncio.to_thread(self._circuit_failure, error)
+
+    async def _make_api_call(self, messages, validation_func=None, max_retries=None, is_json_mode=False, operation=None):
+        """Async twin of ChatGPTHandler._make_api_call: backoff and rate-limit waits never block the loop."""
+        state = self.retry_policy.begin(max_attempts=max_retries)
+        record = LLMCallRecord(operation, self.provider.model)
+        last_error = None
+        succeeded = False
+        try:
+            while state.next_attempt():
+                await self._circuit_check_async()
+                waited = await self.rate_limiter.acquire_async(timeout=state.remaining())
+                if waited is None:
+                    last_error = RetryDeadlineExceeded("Rate limiter queue is longer than the request deadline.")
+                    break
+                state.limiter_wait += waited
+                try:
+                    print(f"Attempting async API call ({state.attempt}/{state.max_attempts})...")
+                    completion = await self.provider.acomplete(messages, json_mode=is_json_mode, operation=operation)
+                    record.add_usage(completion.prompt_tokens, completion.completion_tokens)
+                    content = completion.text.strip()
+                except Exception as e:
+                    last_error = e
+                    await self._circuit_failure_async(e)
+                    if not is_retryable(e):
+                        print(f"Non-retryable error on attempt {state.attempt}: {e}")
+                        raise
+                    delay = self.retry_policy.compute_delay(state.attempt, e)
+                    if not state.can_wait(delay):
+                        break
+                    print(f"API Error on attempt {state.attempt}: {e}. Waiting {delay:.2f}s before retry...")
+                    await asyncio.sleep(delay)
+                    state.backoff_wait += delay
+                    continue
+
+                await self._circuit_success_async() # The backend answered; validation problems aren't outages
+                last_error = self._check_response(content, messages, validation_func, state.attempt)
+                if last_error is None:
+                    succeeded = True
+                    return content
+                record.validation_failures += 1
+        finally:
+            retry_stats.record(state, succeeded)
+            record.finish(state, succeeded)
+
+        print(f"Async API call failed after {state.attempt} attempt(s).")
+        raise last_error or RetryDeadlineExceeded("API call failed for an unknown reason after retries.")
+
+    @llm_errors("generating questions")
+    async def generate_questions(self, text, num_questions=5, question_types=['multiple_choice', 'fill_in_the_blank', 'free_response']):
+        messages = self._build_questions_messages(text, num_questions, question_types)
+        response_content = await self._make_api_call(messages, validation_func=self._validate_question_json, is_json_mode=True,
+                                                     operation="generate_questions")
+        return self._parse_questions(response_content)
+
+    async def generate_questions_map_reduce(self, text, num_questions=5, question_types=DEFAULT_QUESTION_TYPES,
+                                            chunk_tokens=1500, max_workers=4, token_budget=None):
+        """
+        Generates questions over the whole document instead of a truncated prefix.
+
+        Map: split the text into token-bounded chunks and ask for candidates from each chunk
+        concurrently (at most `max_workers` calls in flight). Reduce: pick `num_questions`
+        round-robin across chunks so every part of the document is covered.
+
+        Boilerplate (page numbers, running headers/footers) is stripped first; documents over
+        `token_budget` tokens are condensed to their most salient sentences before chunking.
+        """
+        text = condense_text(text, token_budget) if token_budget else strip_repeated_lines(text)
+        chunks = split_into_chunks(text, max_tokens=chunk_tokens)
+        if len(chunks) <= 1:
+            return await self.generate_questions(text, num_questions=num_questions, question_types=question_types)
+
+        # Ask each chunk for a fair share plus one spare, to survive duplicates and bad items
+        per_chunk = max(1, -(-num_questions // len(chunks))) + 1
+        print(f"Map-reduce generation: {len(chunks)} chunks, {per_chunk} candidates each, {max_workers} workers.")
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def generate_for_chunk(chunk):
+            async with semaphore:
+                return await self.generate_questions(chunk, num_questions=per_chunk, question_types=question_types)
+
+        results = await asyncio.gather(*(generate_for_chunk(c) for c in chunks), return_exceptions=True)
+        candidates = [r for r in results if not isinstance(r, Exception)]
+        if not candidates:
+            raise next(r for r in results if isinstance(r, Exception))
+        for i, r in enumerate(results):
+            if isinstance(r, Exception):
+                print(f"Chunk {i + 1}/{len(chunks)} failed and was skipped: {r}")
+
+        return self._select_with_coverage(candidates, num_questions)
+
+    @staticmethod
+    def _select_with_coverage(candidate_lists, num_questions):
+        """Round-robin over per-chunk candidate lists, skipping duplicate question texts."""
+        selected = []
+        seen = set()
+        for i in range(max(len(c) for c in candidate_lists)):
+            for candidates in candidate_lists:
+                if len(selected) >= num_questions:
+                    return selected
+                if i >= len(candidates):
+                    continue
+                q_item = candidates[i]
+                key = " ".join(str(q_item.get('text', '')).lower().split()) if isinstance(q_item, dict) else None
+                if key in seen:
+                    continue
+                seen.add(key)
+                selected.append(q_item)
+        return selected
+
+    @llm_errors("generating hint", expected=(APIError,))
+    async def generate_hint(self, question_text, context_text=""):
+        messages = self._build_hint_messages(question_text, context_text)
+        hint_text = await self._make_api_call(messages, validation_func=None, operation="generate_hint")
+        print(f"Hint generated successfully for: {question_text[:50]}")
+        return hint_text
+
+    @llm_errors("generating explanation", expected=(APIError,))
+    async def generate_explanation(self, question_text, correct_answer_display, user_answer=None, is_correct=None):
+        messages = self._build_explanation_messages(question_text, correct_answer_display, user_answer, is_correct)
+        explanation_text = await self._make_api_call(messages, validation_func=None, operation="generate_explanation")
+        print(f"Explanation generated successfully for: {question_text[:50]}")
+        return self._clean_explanation(explanation_text)
+
+    @llm_errors("generating CSS theme")
+    async def generate_css_theme(self, theme_description):
+        messages = self._build_css_messages(theme_description)
+        css_code = await self._make_api_call(messages, validation_func=self._validate_css, operation="generate_css_theme")
+        cleaned_css = self._clean_css(css_code)
+        print(f"CSS theme generated and cleaned successfully for: {theme_description}")
+        return cleaned_css
+
+    @llm_errors("grading free response", fallback=0.0)
+    async def grade_free_response(self, question_text, suggested_answer, user_answer):
+        messages = self._build_score_messages(question_text, suggested_answer, user_answer)
+        response_content = await self._make_api_call(messages, validation_func=self._validate_score_json, is_json_mode=True,
+                                                     operation="grade_free_response")
+        score = self._parse_score(response_content)
+        print(f"Free response graded. Score: {score} for question: {question_text[:50]}...")
+        return score
+
+    async def grade_free_responses_batch(self, items, batch_size=GRADING_BATCH_SIZE):
+        """Async batch grading: batches are graded concurrently; failed items are re-graded within their batch."""
+        scores = [None] * len(items)
+
+        async def grade_batch(pending):
+            for round_number in range(MAX_RETRIES):
+                try:
+                    content = await self._make_api_call(self._build_score_batch_messages(items, pending),
+                                                        validation_func=self._validate_score_batch_structure, is_json_mode=True,
+                                                        operation="grade_free_responses_batch")
+                except Exception as e:
+                    print(f"Error grading free response batch: {e}")
+                    return
+                pending = self._apply_batch_scores(content, pending, scores)
+                if not pending:
+                    return
+                print(f"Re-grading {len(pending)} item(s) that failed validation (round {round_number + 1}).")
+
+        await asyncio.gather(*(grade_batch(list(range(start, min(start + batch_size, len(items)))))
+                               for start in range(0, len(items), batch_size)))
+        print(f"Batch graded {len(items)} free response(s).")
+        return [score if score is not None else 0.0 for score in scores]
+
+# --- Background Event Loop ---
+class _AsyncLoopThread:
+    """One long-lived event loop per process, so pooled async clients stay bound to a single loop."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+
+    def get_loop(self):
+        with self._lock:
+            # Restart after a fork (gunicorn workers) - threads don't survive fork()
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="llm-async-loop", daemon=True)
+                thread.start()
+                self._pid = os.getpid()
+            return self._loop
+
+
+_loop_thread = _AsyncLoopThread()
+
+
+def run_async(coro, timeout=None):
+    """Runs a coroutine on the background loop from sync (Flask) code and returns its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, _loop_thread.get_loop())
+    return future.result(timeout)
+
+
+async def _gather(coros):
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+
+def run_concurrently(*coros, timeout=None):
+    """Runs several coroutines at the same time. Returns results in order; failures are returned as exception objects."""
+    return run_async(_gather(coros), timeout=timeout)
+
+
+# --- Process-wide Handler Registry ---
+def hash_api_key(api_key):
+    """Stable, non-reversible identifier for an API key (never store/log the raw key)."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+
+class HandlerRegistry:
+    """
+    Reuses ChatGPTHandler instances per API key instead of building a new OpenAI
+    client (and calling models.list()) on every request.
+
+    - All clients share one httpx connection pool, so TLS connections are reused.
+    - Successful key validation is remembered for `validation_ttl` seconds.
+    - Idle handlers are evicted LRU-style once `max_clients` is exceeded or after `idle_ttl`.
+    - LLM_PROVIDER='stub' swaps OpenAI for one shared StubProvider (offline load tests).
+    - Handlers share the process-wide circuit breaker, scoped per key and per provider.
+    """
+
+    def __init__(self, max_clients=64, idle_ttl=1800, validation_ttl=600):
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._async_http_client = None
+        self.configure(max_clients=max_clients, idle_ttl=idle_ttl, validation_ttl=validation_ttl)
+
+    def configure(self, max_clients=64, idle_ttl=1800, validation_ttl=600, retry_policy=None,
+                  rate_per_minute=None, rate_burst=10, provider='openai', stub_options=None):
+        if provider not in ('openai', 'stub'):
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        self.provider_name = provider
+        self._stub_provider = StubProvider(**(stub_options or {})) if provider == 'stub' else None
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.rate_per_minute = rate_per_minute
+        self.rate_burst = rate_burst
+        self._rate_limiters = LRUCache(max_size=max_clients * 4) # One token bucket per key, shared by sync/async handlers
+        self._handlers = LRUCache(max_size=max_clients, ttl=idle_ttl, sliding=True)
+        self._async_handlers = LRUCache(max_size=max_clients, ttl=idle_ttl, sliding=True)
+        self._validated = LRUCache(max_size=max_clients * 4, ttl=validation_ttl)
+
+    def init_app(self, app):
+        self.configure(
+            max_clients=app.config.get('OPENAI_CLIENT_POOL_SIZE', 64),
+            idle_ttl=app.config.get('OPENAI_CLIENT_IDLE_TTL', 1800),
+            validation_ttl=app.config.get('OPENAI_KEY_VALIDATION_TTL', 600),
+            retry_policy=RetryPolicy(
+                max_attempts=app.config.get('OPENAI_RETRY_MAX_ATTEMPTS', MAX_RETRIES),
+                base_delay=app.config.get('OPENAI_RETRY_BASE_DELAY', 0.5),
+                max_delay=app.config.get('OPENAI_RETRY_MAX_DELAY', 8.0),
+                deadline=app.config.get('OPENAI_REQUEST_DEADLINE', 30.0),
+            ),
+            rate_per_minute=app.config.get('OPENAI_RATE_LIMIT_PER_MINUTE'),
+            rate_burst=app.config.get('OPENAI_RATE_LIMIT_BURST', 10),
+            provider=app.config.get('LLM_PROVIDER', 'openai'),
+            stub_options=dict(
+                latency=app.config.get('STUB_LLM_LATENCY', 0.0),
+                latency_jitter=app.config.get('STUB_LLM_LATENCY_JITTER', 0.0),
+                error_rate=app.config.get('STUB_LLM_ERROR_RATE', 0.0),
+                rate_limit_rate=app.config.get('STUB_LLM_RATE_LIMIT_RATE', 0.0),
+                retry_after=app.config.get('STUB_LLM_RETRY_AFTER', 1.0),
+                seed=app.config.get('STUB_LLM_SEED'),
+            ),
+        )
+
+    @property
+    def model_name(self):
+        """Model identifier for cache keys, so stub output never gets served as real generations."""
+        return self._stub_provider.model if self._stub_provider else DEFAULT_MODEL
+
+    def circuit_scopes(self, api_key):
+        """Breaker scopes for a key: its own circuit plus the provider-wide one."""
+        return (f"key:{hash_api_key(api_key)}", f"provider:{self.provider_name}")
+
+    def is_circuit_open(self, api_key):
+        """Cheap pre-check for routes that would rather degrade than start an LLM call."""
+        return bool(api_key) and circuit_breaker.is_open(self.circuit_scopes(api_key))
+
+    def _get_rate_limiter(self, key_hash):
+        with self._lock:
+            limiter = self._rate_limiters.get(key_hash)
+            if limiter is None:
+                rate = self.rate_per_minute / 60.0 if self.rate_per_minute else None
+                limiter = TokenBucket(rate_per_second=rate, capacity=self.rate_burst)
+                self._rate_limiters.set(key_hash, limiter)
+            return limiter
+
+    def _get_http_client(self):
+        # Created lazily so each gunicorn worker builds its own pool after forking
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                )
+            return self._http_client
+
+    def _get_async_http_client(self):
+        # Only ever used from the background loop (see run_async)
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                )
+            return self._async_http_client
+
+    def get_handler(self, api_key):
+        """Returns a validated handler for `api_key`. Raises ValueError if the key is invalid."""
+        if not api_key:
+            raise ValueError("API key is required to initialize ChatGPTHandler.")
+        key_hash = hash_api_key(api_key)
+
+        handler = self._handlers.get(key_hash)
+        if handler is None:
+            provider = self._stub_provider or create_openai_provider(api_key, DEFAULT_MODEL, http_client=self._get_http_client())
+            handler = ChatGPTHandler(api_key, provider=provider, validate=False, retry_policy=self.retry_policy,
+                                     rate_limiter=self._get_rate_limiter(key_hash),
+                                     circuit_breaker=circuit_breaker, circuit_scopes=self.circuit_scopes(api_key))
+            self._handlers.set(key_hash, handler)
+
+        # While the circuit is open, validation would just hit the outage; the handler's calls fail fast instead
+        if not self._validated.get(key_hash) and not circuit_breaker.is_open(handler.circuit_scopes):
+            handler.validate_key() # Raises ValueError on a bad key
+            self._validated.set(key_hash, True)
+        return handler
+
+    def get_async_handler(self, api_key):
+        """Returns a pooled AsyncChatGPTHandler for `api_key` (validated through the same TTL cache)."""
+        self.get_handler(api_key) # Ensures the key is validated
+        key_hash = hash_api_key(api_key)
+        handler = self._async_handlers.get(key_hash)
+        if handler is None:
+            provider = self._stub_provider or create_openai_provider(api_key, DEFAULT_MODEL, http_client=self._get_async_http_client(),
+                                                                     use_async=True)
+            handler = AsyncChatGPTHandler(api_key, provider=provider, retry_policy=self.retry_policy,
+                                          rate_limiter=self._get_rate_limiter(key_hash),
+                                          circuit_breaker=circuit_breaker, circuit_scopes=self.circuit_scopes(api_key))
+            self._async_handlers.set(key_hash, handler)
+        return handler
+
+    def invalidate(self, api_key):
+        """Forgets a key (e.g. after an AuthenticationError or when the user changes it)."""
+        key_hash = hash_api_key(api_key)
+        self._handlers.pop(key_hash)
+        self._async_handlers.pop(key_hash)
+        self._validated.pop(key_hash)
+
+    def stats(self):
+        return {
+            "provider": self.provider_name,
+            "handlers": self._handlers.stats(),
+            "async_handlers": self._async_handlers.stats(),
+            "retries": retry_stats.stats(),
+            "circuit_breaker": circuit_breaker.stats(),
+            "validations": self._validated.stats(),
+        }
+
+
+handler_registry = HandlerRegistry()
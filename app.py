@@ -17,9 +17,17 @@ from wtforms.validators import DataRequired, Length, EqualTo, ValidationError, O
 # --- App Initialization ---
 from config import Config
 from models import db, User, TestDefinition, Question, Attempt, Answer # Import models
-from api_handler import ChatGPTHandler, APIError, AuthenticationError
+from api_handler import ChatGPTHandler, APIError, AuthenticationError, handler_registry
 from utils import extract_text_from_pdf, extract_text_from_pdf # Assuming utils has PDF extractor
 from encryption import encrypt_data, decrypt_data # Import encryption
+from generation_cache import question_set_cache, explanation_cache, theme_cache, theme_stylesheets
+from question_cache import question_snapshots
+from commands import register_commands
+from jobs import job_runner
+from telemetry import telemetry
+from circuit_breaker import circuit_breaker
+from single_flight import hint_flight
+from local_grader import local_grader
 
 # --- Flask Extensions ---
 migrate = Migrate()
@@ -39,6 +47,24 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    handler_registry.init_app(app)
+    circuit_breaker.init_app(app)
+    hint_flight.init_app(app, timeout_key='HINT_SINGLE_FLIGHT_TIMEOUT')
+    local_grader.init_app(app)
+    question_set_cache.init_app(app)
+    explanation_cache.init_app(app)
+    theme_cache.init_app(app)
+    theme_stylesheets.init_app(app)
+    question_snapshots.init_app(app)
+    job_runner.init_app(app)
+    telemetry.init_app(app)
+    telemetry.register_stats_source('handler_registry', handler_registry.stats)
+    telemetry.register_stats_source('question_set_cache', question_set_cache.stats)
+    telemetry.register_stats_source('explanation_cache', explanation_cache.memory.stats)
+    telemetry.register_stats_source('theme_cache', theme_cache.stats)
+    telemetry.register_stats_source('question_snapshots', question_snapshots.stats)
+    telemetry.register_stats_source('local_grader', local_grader.stats)
+    register_commands(app)
 
     # --- Blueprints ---
     from routes.main import bp as main_bp
@@ -0,0 +1,87 @@
+# benchmark_grading.py
+# Microbenchmark for per-submission grading: the original check_answer_logic (JSON decoding and
+# answer normalization on every call) against grading with a precompiled AnswerKey (the
+# snapshot path in routes/tests.view_question). Also checks that both give the same results.
+# To run: python benchmark_grading.py [--number 100000]
+import string
+import argparse
+import timeit
+from models import Question
+from answer_key import AnswerKey
+
+
+def legacy_check_answer_logic(question_model, user_input):
+    """check_answer_logic as it was in the original routes/tests.py, before the explanation cache and compiled answer keys."""
+    is_correct = None; score = None
+    q_type = question_model.question_type
+    correct_info = question_model.correct_answer_info
+    if q_type == 'multiple_choice':
+        try:
+            user_choice_index = int(user_input)
+            opts = question_model.options
+            correct_index = -1
+            if isinstance(correct_info, int) and 0 <= correct_info < len(opts):
+                correct_index = correct_info
+            elif isinstance(correct_info, str):
+                try: correct_index = opts.index(correct_info)
+                except ValueError: pass
+                if correct_index == -1:
+                    try: correct_index = [o.lower() for o in opts].index(correct_info.lower())
+                    except ValueError: pass
+            is_correct = (user_choice_index == correct_index) if correct_index != -1 else False
+            score = 1.0 if is_correct else 0.0
+        except (ValueError, TypeError, IndexError): is_correct = False; score = 0.0
+    elif q_type == 'fill_in_the_blank':
+        correct_answer_str = str(correct_info) if correct_info is not None else ""
+        translator = str.maketrans('', '', string.punctuation)
+        processed_user = str(user_input).lower().translate(translator).strip()
+        processed_correct = correct_answer_str.lower().translate(translator).strip()
+        is_correct = (processed_user == processed_correct)
+        score = 1.0 if is_correct else 0.0
+    return is_correct, score
+
+
+def sample_questions():
+    """(label, question, submissions) covering the answer-info shapes the generator produces."""
+    options = ["The mitochondria", "The Nucleus", "Ribosomes", "The cell membrane", "Chloroplasts"]
+    mc_index = Question(question_type='multiple_choice', options=options, correct_answer_info=3)
+    mc_text = Question(question_type='multiple_choice', options=options, correct_answer_info="the nucleus")
+    fib = Question(question_type='fill_in_the_blank', correct_answer_info="Adenosine Triphosphate (ATP)")
+    return [
+        ("multiple choice (index)", mc_index, ["3", "0", "x", ""]),
+        ("multiple choice (text)", mc_text, ["1", "4", " 1 "]),
+        ("fill in the blank", fib, ["adenosine triphosphate atp", "ATP", " Adenosine Triphosphate, (ATP)! ",
+                                    "Adenosine  Triphosphate (ATP)", None]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grading with and without compiled answer keys.")
+    parser.add_argument('--number', type=int, default=100000, help="Gradings per measurement")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'question':<26}{'legacy us':>12}{'compiled us':>14}{'speedup':>10}")
+    for label, question, submissions in sample_questions():
+        question.compile_answer_key()
+        key = AnswerKey.from_json(question.answer_key_json) # Decoded once, as in QuestionSnapshot
+        for submission in submissions:
+            expected = legacy_check_answer_logic(question, submission)
+            assert key.grade(submission) == expected, (label, submission, key.grade(submission), expected)
+
+        def legacy():
+            for submission in submissions:
+                legacy_check_answer_logic(question, submission)
+
+        def compiled():
+            for submission in submissions:
+                key.grade(submission)
+
+        per_call = args.number * len(submissions) / 1e6 # -> microseconds per grading
+        legacy_us = min(timeit.repeat(legacy, number=args.number, repeat=args.repeat)) / per_call
+        compiled_us = min(timeit.repeat(compiled, number=args.number, repeat=args.repeat)) / per_call
+        print(f"{label:<26}{legacy_us:>12.3f}{compiled_us:>14.3f}{legacy_us / compiled_us:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
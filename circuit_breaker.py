@@ -0,0 +1,175 @@
+# circuit_breaker.py
+import time
+import threading
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from models import db, CircuitBreakerState
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the backend while a circuit is open. Safe to show to users."""
+
+    def __init__(self, scope, retry_after):
+        self.scope = scope
+        self.retry_after = max(1, int(retry_after))
+        super().__init__(f"The AI service is temporarily unavailable. Please try again in {self.retry_after} seconds.")
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker per scope ("provider:openai", "key:<sha256>"),
+    shared by all workers through the circuit_breaker_state table.
+
+    - closed: calls go through; `failure_threshold` consecutive failures open the circuit.
+    - open: calls fail immediately with CircuitOpenError for `recovery_timeout` seconds.
+    - half_open: one worker wins the right to send a probe call; success closes the circuit,
+      failure re-opens it. Other callers keep failing fast until then.
+
+    State is read through a per-process cache (`cache_ttl` seconds), so the hot path usually
+    costs no DB round trip. The table is accessed with its own engine connection, never the
+    request's session, so breaker writes can't commit or roll back route work.
+    """
+    table = CircuitBreakerState.__table__
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0, cache_ttl=1.0, enabled=True):
+        self.configure(failure_threshold, recovery_timeout, cache_ttl, enabled)
+        self.engine = None
+        self._cache = {} # scope -> (row dict or None, fetched_at)
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    def configure(self, failure_threshold=5, recovery_timeout=30.0, cache_ttl=1.0, enabled=True):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.cache_ttl = cache_ttl
+        self.enabled = enabled
+
+    def init_app(self, app):
+        self.configure(
+            failure_threshold=app.config.get('CIRCUIT_FAILURE_THRESHOLD', 5),
+            recovery_timeout=app.config.get('CIRCUIT_RECOVERY_TIMEOUT', 30.0),
+            cache_ttl=app.config.get('CIRCUIT_STATE_CACHE_TTL', 1.0),
+            enabled=app.config.get('CIRCUIT_BREAKER_ENABLED', True),
+        )
+        with app.app_context():
+            self.engine = db.engine
+
+    # --- State Access ---
+    def _get(self, scope, fresh=False):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(scope)
+        if cached is not None and not fresh and now - cached[1] < self.cache_ttl:
+            return cached[0]
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table).where(self.table.c.scope == scope)).mappings().first()
+        row = dict(row) if row else None
+        self._remember(scope, row)
+        return row
+
+    def _remember(self, scope, row):
+        with self._lock:
+            self._cache[scope] = (row, time.monotonic())
+
+    def _guard(self, action, scopes):
+        """Runs a state change; a breaker DB problem must never take API calls down with it."""
+        if not self.enabled or self.engine is None:
+            return
+        try:
+            action(scopes)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            print(f"Circuit breaker unavailable ({e}); allowing call.")
+
+    # --- Call Hooks ---
+    def before_call(self, scopes):
+        """Raises CircuitOpenError if any scope is open (or half-open with a probe already in flight)."""
+        self._guard(self._before_call, scopes)
+
+    def _before_call(self, scopes):
+        now = time.time()
+        for scope in scopes:
+            row = self._get(scope)
+            if row is None or row['state'] == 'closed':
+                continue
+            elapsed = now - (row['opened_at'] or 0)
+            if elapsed < self.recovery_timeout:
+                self._reject(scope, self.recovery_timeout - elapsed) # Open, or a probe is still running
+            # Cool-down over (or the last probe never reported back): try to become the probe
+            with self.engine.begin() as conn:
+                claimed = conn.execute(
+                    update(self.table)
+                    .where(self.table.c.scope == scope, self.table.c.state == row['state'],
+                           self.table.c.opened_at == row['opened_at'])
+                    .values(state='half_open', opened_at=now, updated_at=now)
+                ).rowcount == 1
+            self._get(scope, fresh=True)
+            if not claimed:
+                self._reject(scope, self.recovery_timeout)
+            print(f"Circuit '{scope}' half-open: sending probe call.")
+
+    def _reject(self, scope, retry_after):
+        with self._lock:
+            self.rejected += 1
+        raise CircuitOpenError(scope, retry_after)
+
+    def record_success(self, scopes):
+        self._guard(self._record_success, scopes)
+
+    def _record_success(self, scopes):
+        for scope in scopes:
+            row = self._get(scope)
+            if row is None or (row['state'] == 'closed' and not row['failure_count']):
+                continue # Nothing to reset: no DB write on the hot path
+            now = time.time()
+            with self.engine.begin() as conn:
+                conn.execute(update(self.table).where(self.table.c.scope == scope)
+                             .values(state='closed', failure_count=0, opened_at=None, updated_at=now))
+            if row['state'] != 'closed':
+                print(f"Circuit '{scope}' closed again.")
+            self._get(scope, fresh=True)
+
+    def record_failure(self, scopes):
+        self._guard(self._record_failure, scopes)
+
+    def _record_failure(self, scopes):
+        for scope in scopes:
+            now = time.time()
+            with self.engine.begin() as conn:
+                row = conn.execute(select(self.table).where(self.table.c.scope == scope).with_for_update()).mappings().first()
+                if row is None:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(insert(self.table).values(scope=scope, state='closed', failure_count=0, updated_at=now))
+                    except IntegrityError:
+                        pass # Another worker created it first
+                    row = conn.execute(select(self.table).where(self.table.c.scope == scope).with_for_update()).mappings().first()
+                failures = row['failure_count'] + 1
+                values = {"failure_count": failures, "updated_at": now}
+                if row['state'] == 'half_open' or (row['state'] == 'closed' and failures >= self.failure_threshold):
+                    values.update(state='open', opened_at=now)
+                    with self._lock:
+                        self.opened += 1
+                    print(f"Circuit '{scope}' opened after {failures} consecutive failure(s).")
+                conn.execute(update(self.table).where(self.table.c.scope == scope).values(**values))
+            self._get(scope, fresh=True)
+
+    def is_open(self, scopes):
+        """True if a call for these scopes would be rejected right now (no probe is claimed)."""
+        if not self.enabled or self.engine is None:
+            return False
+        try:
+            now = time.time()
+            return any(row is not None and row['state'] != 'closed' and now - (row['opened_at'] or 0) < self.recovery_timeout
+                       for row in (self._get(scope) for scope in scopes))
+        except Exception:
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {"rejected": self.rejected, "opened": self.opened}
+
+
+circuit_breaker = CircuitBreaker()
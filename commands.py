@@ -0,0 +1,55 @@
+# commands.py
+import click
+from generation_cache import question_set_cache, theme_cache
+from api_handler import CSS_PROMPT_VERSION
+from counters import backfill_counters, find_counter_drift
+from models import db, Question
+
+
+def register_commands(app):
+    """Registers maintenance CLI commands (run with `flask <command>`)."""
+
+    @app.cli.command('prune-question-cache')
+    def prune_question_cache():
+        """Removes expired / least recently used cached question sets."""
+        removed = question_set_cache.prune()
+        click.echo(f"Removed {removed} cached question set(s).")
+
+    @app.cli.command('prune-theme-cache')
+    def prune_theme_cache():
+        """Removes idle, outdated and least recently used cached CSS themes."""
+        removed = theme_cache.prune(prompt_version=CSS_PROMPT_VERSION)
+        click.echo(f"Removed {removed} cached theme(s).")
+
+    @app.cli.command('backfill-test-counters')
+    def backfill_test_counters():
+        """Recomputes every test's denormalized counters from its questions and attempts."""
+        updated = backfill_counters()
+        click.echo(f"Recomputed counters for {updated} test(s).")
+
+    @app.cli.command('check-test-counters')
+    @click.option('--limit', default=50, help="Stop after this many mismatches.")
+    def check_test_counters(limit):
+        """Reports tests whose stored counters don't match their rows (exit code 1 if any)."""
+        drift = find_counter_drift(limit=limit)
+        for test_id, column, stored, actual in drift:
+            click.echo(f"{test_id}: {column} stored={stored} actual={actual}")
+        if drift:
+            click.echo(f"Found {len(drift)} mismatched counter(s). Run `flask backfill-test-counters` to repair.")
+            raise SystemExit(1)
+        click.echo("All test counters are consistent.")
+
+    @app.cli.command('compile-answer-keys')
+    @click.option('--batch-size', default=500, help="Questions compiled per commit.")
+    def compile_answer_keys(batch_size):
+        """Compiles answer keys for questions created before answer_key_json existed."""
+        compiled = 0
+        while True:
+            batch = Question.query.filter(Question.answer_key_json.is_(None)).limit(batch_size).all()
+            if not batch:
+                break
+            for question in batch:
+                question.compile_answer_key()
+            db.session.commit()
+            compiled += len(batch)
+        click.echo(f"Compiled answer keys for {compiled} question(s).")
@@ -17,4 +17,89 @@ class Config:
         raise ValueError("CRITICAL ERROR: ENCRYPTION_KEY environment variable not set. Generate one using Fernet.generate_key()")
     # --- End of update ---
 
-    # OpenAI API Key is per-user
\ No newline at end of file
+    # OpenAI API Key is per-user
+
+    # --- OpenAI client pooling (see api_handler.HandlerRegistry) ---
+    OPENAI_CLIENT_POOL_SIZE = int(os.environ.get('OPENAI_CLIENT_POOL_SIZE', 64)) # Max cached per-key clients
+    OPENAI_CLIENT_IDLE_TTL = int(os.environ.get('OPENAI_CLIENT_IDLE_TTL', 1800)) # Seconds before an idle client is dropped
+    OPENAI_KEY_VALIDATION_TTL = int(os.environ.get('OPENAI_KEY_VALIDATION_TTL', 600)) # Seconds a validated key is trusted
+
+    # --- Generated question set cache (see generation_cache.py) ---
+    QUESTION_CACHE_MEMORY_SIZE = int(os.environ.get('QUESTION_CACHE_MEMORY_SIZE', 256)) # Entries in the per-process LRU
+    QUESTION_CACHE_TTL = int(os.environ.get('QUESTION_CACHE_TTL', 30 * 24 * 3600)) # Seconds before a cached set expires
+    QUESTION_CACHE_MAX_ENTRIES = int(os.environ.get('QUESTION_CACHE_MAX_ENTRIES', 5000)) # Max rows kept in the DB tier
+    EXPLANATION_CACHE_MEMORY_SIZE = int(os.environ.get('EXPLANATION_CACHE_MEMORY_SIZE', 2048)) # (question, answer) explanations kept per process
+
+    # --- Generated CSS theme cache (see generation_cache.ThemeCache) ---
+    THEME_CACHE_MEMORY_SIZE = int(os.environ.get('THEME_CACHE_MEMORY_SIZE', 256)) # Themes kept in the per-process LRU
+    THEME_CACHE_MAX_ENTRIES = int(os.environ.get('THEME_CACHE_MAX_ENTRIES', 2000)) # Max rows kept in the DB tier
+    THEME_CACHE_MAX_IDLE = int(os.environ.get('THEME_CACHE_MAX_IDLE', 90 * 24 * 3600)) # Seconds unused before a theme is pruned
+    THEME_CACHE_TOUCH_INTERVAL = int(os.environ.get('THEME_CACHE_TOUCH_INTERVAL', 300)) # Max seconds between flushing memory-tier hit counts to the DB
+    THEME_CACHE_PRUNE_INTERVAL = int(os.environ.get('THEME_CACHE_PRUNE_INTERVAL', 3600)) # Seconds between prunes in worker.py
+
+    # --- Per-test question snapshots for the answer loop (see question_cache.py) ---
+    QUESTION_SNAPSHOT_CACHE_SIZE = int(os.environ.get('QUESTION_SNAPSHOT_CACHE_SIZE', 512)) # Tests kept in the per-process LRU
+    QUESTION_SNAPSHOT_LOCAL_TTL = int(os.environ.get('QUESTION_SNAPSHOT_LOCAL_TTL', 60)) # Seconds before a worker re-reads (bounds cross-worker staleness)
+    QUESTION_SNAPSHOT_SHARED_TTL = int(os.environ.get('QUESTION_SNAPSHOT_SHARED_TTL', 3600)) # Seconds entries live in the shared tier
+    QUESTION_SNAPSHOT_REDIS_URL = os.environ.get('QUESTION_SNAPSHOT_REDIS_URL') # Optional shared tier, e.g. redis://localhost:6379/0 (needs `redis`)
+
+    # --- Dashboard ---
+    DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 20)) # Tests per dashboard page (keyset paginated)
+
+    # --- Streaming ---
+    STREAM_EXPLANATIONS = os.environ.get('STREAM_EXPLANATIONS', 'true').lower() == 'true' # Explanations load over SSE after an answer is saved
+
+    # --- Question generation over long documents (map-reduce) ---
+    MAX_SOURCE_CHARS = int(os.environ.get('MAX_SOURCE_CHARS', 200000)) # Hard cap on accepted source text
+    GENERATION_CHUNK_TOKENS = int(os.environ.get('GENERATION_CHUNK_TOKENS', 1500)) # Approx. tokens per chunk
+    GENERATION_MAX_WORKERS = int(os.environ.get('GENERATION_MAX_WORKERS', 4)) # Concurrent chunk calls per request
+    GENERATION_TOKEN_BUDGET = int(os.environ.get('GENERATION_TOKEN_BUDGET', 20000)) # Longer sources are condensed to their most salient sentences (0 = no limit)
+
+    # --- OpenAI retries and rate limiting (see retry_policy.py) ---
+    OPENAI_RETRY_MAX_ATTEMPTS = int(os.environ.get('OPENAI_RETRY_MAX_ATTEMPTS', 3))
+    OPENAI_RETRY_BASE_DELAY = float(os.environ.get('OPENAI_RETRY_BASE_DELAY', 0.5)) # First backoff step (seconds, jittered)
+    OPENAI_RETRY_MAX_DELAY = float(os.environ.get('OPENAI_RETRY_MAX_DELAY', 8.0)) # Backoff cap (Retry-After may ask for more)
+    OPENAI_REQUEST_DEADLINE = float(os.environ.get('OPENAI_REQUEST_DEADLINE', 30.0)) # Total time budget per call, incl. waits
+    OPENAI_RATE_LIMIT_PER_MINUTE = int(os.environ.get('OPENAI_RATE_LIMIT_PER_MINUTE', 60)) # Per API key; 0 disables the limiter
+    OPENAI_RATE_LIMIT_BURST = int(os.environ.get('OPENAI_RATE_LIMIT_BURST', 10))
+
+    # --- Background test generation (see jobs.py / worker.py) ---
+    GENERATION_JOB_EXECUTOR = os.environ.get('GENERATION_JOB_EXECUTOR', 'thread') # 'thread', 'process' or 'external' (python worker.py)
+    GENERATION_JOB_WORKERS = int(os.environ.get('GENERATION_JOB_WORKERS', 2)) # Pool size per web process
+    GENERATION_JOB_STALE_AFTER = int(os.environ.get('GENERATION_JOB_STALE_AFTER', 900)) # Seconds before a stuck running job is requeued (worker.py or the in-process runner)
+    GENERATION_JOB_ORPHAN_AFTER = int(os.environ.get('GENERATION_JOB_ORPHAN_AFTER', 60)) # Seconds a pending job may wait before the in-process runner dispatches it again
+    GENERATION_STREAMING = os.environ.get('GENERATION_STREAMING', 'true').lower() == 'true' # Store questions as they stream in; the test is playable before generation ends
+    HINT_PREGENERATION = os.environ.get('HINT_PREGENERATION', 'true').lower() == 'true' # Generate all hints in batched calls after a test is created
+    HINT_BATCH_SIZE = int(os.environ.get('HINT_BATCH_SIZE', 20)) # Questions per batched hint completion
+    OPTION_EXPLANATION_PREGENERATION = os.environ.get('OPTION_EXPLANATION_PREGENERATION', 'true').lower() == 'true' # Store feedback for every multiple-choice option after a test is created
+    OPTION_EXPLANATION_BATCH_SIZE = int(os.environ.get('OPTION_EXPLANATION_BATCH_SIZE', 10)) # Questions per batched option-explanation completion
+
+    # --- Local free-response pre-scoring (see local_grader.py); only 'uncertain' answers are sent to the LLM ---
+    LOCAL_GRADER_ENABLED = os.environ.get('LOCAL_GRADER_ENABLED', 'true').lower() == 'true'
+    LOCAL_GRADER_ACCEPT_THRESHOLD = float(os.environ.get('LOCAL_GRADER_ACCEPT_THRESHOLD', 0.9)) # Combined and embedding similarity at/above which an answer scores 1.0 locally (needs an embedding model)
+    LOCAL_GRADER_REJECT_THRESHOLD = float(os.environ.get('LOCAL_GRADER_REJECT_THRESHOLD', 0.05)) # At/below (confirmed by embedding similarity) scores 0.0 locally
+    LOCAL_GRADER_EMBEDDING_MODEL = os.environ.get('LOCAL_GRADER_EMBEDDING_MODEL') # e.g. 'all-MiniLM-L6-v2' (needs sentence-transformers); unset = only exact matches and blanks are decided locally
+    LOCAL_GRADER_EMBEDDING_CACHE_SIZE = int(os.environ.get('LOCAL_GRADER_EMBEDDING_CACHE_SIZE', 1024)) # Cached suggested-answer embeddings per process
+
+    # --- Circuit breaker per API key and per provider (see circuit_breaker.py) ---
+    CIRCUIT_BREAKER_ENABLED = os.environ.get('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true'
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5)) # Consecutive failed attempts that open a circuit
+    CIRCUIT_RECOVERY_TIMEOUT = float(os.environ.get('CIRCUIT_RECOVERY_TIMEOUT', 30.0)) # Seconds open before one probe call is let through
+    CIRCUIT_STATE_CACHE_TTL = float(os.environ.get('CIRCUIT_STATE_CACHE_TTL', 1.0)) # Seconds a worker trusts its cached copy of the shared state
+
+    # --- Single-flight coalescing of duplicate LLM work (see single_flight.py) ---
+    HINT_SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('HINT_SINGLE_FLIGHT_TIMEOUT', 45.0)) # Lock lifetime / max wait for another request's hint
+    SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get('SINGLE_FLIGHT_POLL_INTERVAL', 0.25)) # Seconds between checks for another worker's result
+
+    # --- LLM backend (see llm_providers.py) ---
+    LLM_PROVIDER = os.environ.get('LLM_PROVIDER', 'openai') # 'openai' or 'stub' (offline, no API spend)
+    STUB_LLM_LATENCY = float(os.environ.get('STUB_LLM_LATENCY', 0.0)) # Seconds added to every stub call
+    STUB_LLM_LATENCY_JITTER = float(os.environ.get('STUB_LLM_LATENCY_JITTER', 0.0)) # Extra random 0..jitter seconds
+    STUB_LLM_ERROR_RATE = float(os.environ.get('STUB_LLM_ERROR_RATE', 0.0)) # Fraction of calls failing with a 500
+    STUB_LLM_RATE_LIMIT_RATE = float(os.environ.get('STUB_LLM_RATE_LIMIT_RATE', 0.0)) # Fraction of calls failing with a 429
+    STUB_LLM_RETRY_AFTER = float(os.environ.get('STUB_LLM_RETRY_AFTER', 1.0)) # Retry-After sent with stub 429s
+    STUB_LLM_SEED = int(os.environ['STUB_LLM_SEED']) if os.environ.get('STUB_LLM_SEED') else None # Fixed seed = reproducible fault pattern
+
+    # --- Telemetry (see telemetry.py; set PROMETHEUS_MULTIPROC_DIR to aggregate gunicorn workers) ---
+    METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN') # If set, /metrics requires "Authorization: Bearer <token>"
+    METRICS_REFRESH_INTERVAL = float(os.environ.get('METRICS_REFRESH_INTERVAL', 15.0)) # Seconds between cache-stat gauge refreshes
@@ -0,0 +1,67 @@
+# counters.py
+from sqlalchemy import select, update, func, case
+from models import db, TestDefinition, Question, Attempt
+
+# Denormalized TestDefinition counters (question_count, attempt_count, completed_attempt_count,
+# best_score). The record_* helpers issue relative UPDATEs inside the caller's transaction, so the
+# counters commit or roll back together with the rows they count and concurrent writers don't
+# overwrite each other.
+
+
+# --- Transactional Updates ---
+def record_questions_added(test_definition_id, count=1):
+    db.session.execute(update(TestDefinition).where(TestDefinition.id == test_definition_id)
+                       .values(question_count=TestDefinition.question_count + count)
+                       .execution_options(synchronize_session=False))
+
+
+def record_attempt_started(test_definition_id):
+    db.session.execute(update(TestDefinition).where(TestDefinition.id == test_definition_id)
+                       .values(attempt_count=TestDefinition.attempt_count + 1)
+                       .execution_options(synchronize_session=False))
+
+
+def record_attempt_completed(test_definition_id, score):
+    best = case((TestDefinition.best_score.is_(None), score), (TestDefinition.best_score < score, score),
+                else_=TestDefinition.best_score)
+    db.session.execute(update(TestDefinition).where(TestDefinition.id == test_definition_id)
+                       .values(completed_attempt_count=TestDefinition.completed_attempt_count + 1, best_score=best)
+                       .execution_options(synchronize_session=False))
+
+
+# --- Backfill / Consistency ---
+def _actual_values():
+    """Correlated subqueries computing each counter from the source rows."""
+    test_id = TestDefinition.id
+    completed = (Attempt.test_definition_id == test_id) & (Attempt.is_complete == True)
+    return {
+        "question_count": select(func.count(Question.id)).where(Question.test_definition_id == test_id).scalar_subquery(),
+        "attempt_count": select(func.count(Attempt.id)).where(Attempt.test_definition_id == test_id).scalar_subquery(),
+        "completed_attempt_count": select(func.count(Attempt.id)).where(completed).scalar_subquery(),
+        "best_score": select(func.max(Attempt.total_score)).where(completed).scalar_subquery(),
+    }
+
+
+def backfill_counters():
+    """Recomputes every test's counters in one UPDATE (commits). Returns the number of tests updated."""
+    result = db.session.execute(update(TestDefinition).values(**_actual_values())
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+
+def find_counter_drift(limit=None):
+    """Returns [(test_id, column, stored, actual)] for every counter that doesn't match its source rows."""
+    actual = _actual_values()
+    columns = list(actual)
+    stmt = select(TestDefinition.id, *(getattr(TestDefinition, name) for name in columns),
+                  *(expr.label(f"actual_{name}") for name, expr in actual.items()))
+    drift = []
+    for row in db.session.execute(stmt):
+        for name in columns:
+            stored, expected = getattr(row, name), getattr(row, f"actual_{name}")
+            if stored != expected and not (stored is not None and expected is not None and abs(stored - expected) < 1e-9):
+                drift.append((row.id, name, stored, expected))
+                if limit and len(drift) >= limit:
+                    return drift
+    return drift
@@ -0,0 +1,358 @@
+# generation_cache.py
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from models import db, CachedQuestionSet, CachedExplanation, CachedTheme, ThemeStylesheet
+from cache import LRUCache
+from utils import normalize_fib_answer
+
+
+def normalize_source_text(text):
+    """Normalizes source text so trivially different uploads (whitespace, unicode forms) share a cache key."""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def normalize_theme_description(description):
+    """Case, whitespace and surrounding punctuation don't change a theme: "Dark Mode!" == "dark mode"."""
+    return normalize_source_text(description).lower().strip(' .,!?;:\'"')
+
+
+class QuestionSetCache:
+    """
+    Two-tier cache for generated question sets.
+
+    Tier 1 is an in-process LRU; tier 2 is the cached_question_set table, so results are
+    shared across users and gunicorn workers. Entries expire after `ttl` seconds and the
+    table is trimmed to `max_entries` rows (least recently used first).
+    """
+
+    def __init__(self, memory_size=256, ttl=30 * 24 * 3600, max_entries=5000):
+        self.configure(memory_size=memory_size, ttl=ttl, max_entries=max_entries)
+
+    def configure(self, memory_size=256, ttl=30 * 24 * 3600, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory = LRUCache(max_size=memory_size, ttl=ttl)
+
+    def init_app(self, app):
+        self.configure(
+            memory_size=app.config.get('QUESTION_CACHE_MEMORY_SIZE', 256),
+            ttl=app.config.get('QUESTION_CACHE_TTL', 30 * 24 * 3600),
+            max_entries=app.config.get('QUESTION_CACHE_MAX_ENTRIES', 5000),
+        )
+
+    @staticmethod
+    def make_key(text, num_questions, question_types, model, prompt_version):
+        payload = json.dumps({
+            "text": normalize_source_text(text),
+            "num_questions": num_questions,
+            "types": sorted(question_types),
+            "model": model,
+            "prompt_version": prompt_version,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _cutoff(self):
+        return datetime.now(timezone.utc) - timedelta(seconds=self.ttl)
+
+    def get(self, key):
+        """Returns the cached list of question dicts, or None on a miss."""
+        questions = self.memory.get(key)
+        if questions is not None:
+            return questions
+
+        entry = CachedQuestionSet.query.filter(
+            CachedQuestionSet.cache_key == key,
+            CachedQuestionSet.created_at >= self._cutoff()
+        ).first()
+        if entry is None:
+            return None
+
+        entry.hit_count += 1
+        entry.last_used_at = datetime.now(timezone.utc)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback() # Counter update is best-effort
+        questions = entry.questions
+        self.memory.set(key, questions)
+        return questions
+
+    def set(self, key, questions, model=None, prompt_version=None):
+        """Stores a generated question set in both tiers. Committed on its own so a later failure doesn't lose a paid result."""
+        self.memory.set(key, questions)
+        now = datetime.now(timezone.utc)
+        entry = db.session.get(CachedQuestionSet, key)
+        if entry is None:
+            entry = CachedQuestionSet(cache_key=key)
+            db.session.add(entry)
+        entry.questions_json = json.dumps(questions)
+        entry.model = model
+        entry.prompt_version = prompt_version
+        entry.created_at = now
+        entry.last_used_at = now
+        entry.hit_count = entry.hit_count or 0
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Another worker stored the same key first
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not persist question set cache entry: {e}")
+
+    def prune(self):
+        """Deletes expired rows and trims the table to max_entries. Returns the number of rows removed."""
+        removed = CachedQuestionSet.query.filter(CachedQuestionSet.created_at < self._cutoff()).delete(synchronize_session=False)
+        overflow = CachedQuestionSet.query.count() - self.max_entries
+        if overflow > 0:
+            stale_keys = [row.cache_key for row in CachedQuestionSet.query
+                          .with_entities(CachedQuestionSet.cache_key)
+                          .order_by(CachedQuestionSet.last_used_at.asc())
+                          .limit(overflow)]
+            removed += CachedQuestionSet.query.filter(CachedQuestionSet.cache_key.in_(stale_keys)).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def stats(self):
+        return self.memory.stats()
+
+
+question_set_cache = QuestionSetCache()
+
+
+class ExplanationCache:
+    """
+    Shares explanations between answers that are equivalent for a question.
+
+    Only multiple-choice and fill-in-the-blank answers are cached: they have a handful of
+    distinct (normalized answer, is_correct) combinations. Lookups go through a per-process
+    LRU of (row id, text) before hitting the cached_explanation table.
+    """
+    CACHEABLE_TYPES = ('multiple_choice', 'fill_in_the_blank')
+
+    def __init__(self, memory_size=2048):
+        self.memory = LRUCache(max_size=memory_size)
+
+    def init_app(self, app):
+        self.memory = LRUCache(max_size=app.config.get('EXPLANATION_CACHE_MEMORY_SIZE', 2048))
+
+    def make_key(self, question, user_input, is_correct):
+        """Returns (question_id, answer_hash, is_correct), or None if this answer shouldn't be cached."""
+        if question.question_type not in self.CACHEABLE_TYPES or is_correct is None or user_input is None:
+            return None
+        if question.question_type == 'multiple_choice':
+            normalized = str(user_input).strip()
+        else:
+            normalized = normalize_fib_answer(user_input)
+        answer_hash = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        return (question.id, answer_hash, bool(is_correct))
+
+    def get(self, key):
+        """Returns (explanation_id, text) or None."""
+        cached = self.memory.get(key)
+        if cached is not None:
+            return cached
+        question_id, answer_hash, is_correct = key
+        entry = CachedExplanation.query.filter_by(question_id=question_id, answer_hash=answer_hash, is_correct=is_correct).first()
+        if entry is None:
+            return None
+        entry.hit_count += 1 # Committed together with the Answer that references it
+        cached = (entry.id, entry.text)
+        self.memory.set(key, cached)
+        return cached
+
+    def set(self, key, text):
+        """Stores an explanation inside the caller's transaction. Returns (explanation_id, text)."""
+        question_id, answer_hash, is_correct = key
+        entry = CachedExplanation(question_id=question_id, answer_hash=answer_hash, is_correct=is_correct, text=text, hit_count=0)
+        try:
+            with db.session.begin_nested(): # Savepoint: a concurrent insert must not roll back the caller's work
+                db.session.add(entry)
+        except IntegrityError:
+            entry = CachedExplanation.query.filter_by(question_id=question_id, answer_hash=answer_hash, is_correct=is_correct).first()
+            if entry is None:
+                return None
+        cached = (entry.id, entry.text)
+        self.memory.set(key, cached)
+        return cached
+
+
+explanation_cache = ExplanationCache()
+
+
+class ThemeCache:
+    """
+    Generated CSS themes shared across users, keyed by normalized description, model and prompt
+    version (descriptions like "dark mode" repeat constantly).
+
+    Tier 1 is an in-process LRU, tier 2 the cached_theme table. Hits on either tier count towards
+    the row's popularity (hit_count / last_used_at); memory hits are flushed to the DB at most
+    every `touch_interval` seconds per key. prune() drops rows idle for `max_idle` seconds or from
+    an old prompt version, then trims to `max_entries` least recently used.
+    """
+
+    def __init__(self, memory_size=256, max_entries=2000, max_idle=90 * 24 * 3600, touch_interval=300):
+        self._lock = threading.Lock()
+        self.configure(memory_size=memory_size, max_entries=max_entries, max_idle=max_idle, touch_interval=touch_interval)
+
+    def configure(self, memory_size=256, max_entries=2000, max_idle=90 * 24 * 3600, touch_interval=300):
+        self.max_entries = max_entries
+        self.max_idle = max_idle
+        self.touch_interval = touch_interval
+        self.memory = LRUCache(max_size=memory_size)
+        self._pending_hits = {} # key -> (hits not yet in the DB, last flush time)
+
+    def init_app(self, app):
+        self.configure(
+            memory_size=app.config.get('THEME_CACHE_MEMORY_SIZE', 256),
+            max_entries=app.config.get('THEME_CACHE_MAX_ENTRIES', 2000),
+            max_idle=app.config.get('THEME_CACHE_MAX_IDLE', 90 * 24 * 3600),
+            touch_interval=app.config.get('THEME_CACHE_TOUCH_INTERVAL', 300),
+        )
+
+    @staticmethod
+    def make_key(description, model, prompt_version):
+        payload = json.dumps({
+            "description": normalize_theme_description(description),
+            "model": model,
+            "prompt_version": prompt_version,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached CSS, or None on a miss."""
+        css = self.memory.get(key)
+        if css is not None:
+            self._count_memory_hit(key)
+            return css
+
+        entry = db.session.get(CachedTheme, key)
+        if entry is None:
+            return None
+        entry.hit_count += 1
+        entry.last_used_at = datetime.now(timezone.utc)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback() # Counter update is best-effort
+        self.memory.set(key, entry.css)
+        with self._lock:
+            self._pending_hits[key] = (0, time.monotonic())
+        return entry.css
+
+    def _count_memory_hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits, last_flush = self._pending_hits.get(key, (0, now))
+            hits += 1
+            if now - last_flush < self.touch_interval:
+                self._pending_hits[key] = (hits, last_flush)
+                return
+            self._pending_hits[key] = (0, now)
+        try:
+            db.session.execute(update(CachedTheme).where(CachedTheme.cache_key == key)
+                               .values(hit_count=CachedTheme.hit_count + hits, last_used_at=datetime.now(timezone.utc)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback() # Best-effort, like the DB-tier counter
+
+    def set(self, key, description, css, model=None, prompt_version=None):
+        """Stores a generated stylesheet in both tiers (committed on its own)."""
+        self.memory.set(key, css)
+        with self._lock:
+            self._pending_hits[key] = (0, time.monotonic())
+        now = datetime.now(timezone.utc)
+        entry = db.session.get(CachedTheme, key)
+        if entry is None:
+            entry = CachedTheme(cache_key=key, hit_count=0, created_at=now)
+            db.session.add(entry)
+        entry.description = normalize_theme_description(description)[:200]
+        entry.css = css
+        entry.model = model
+        entry.prompt_version = prompt_version
+        entry.last_used_at = now
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Another worker stored the same key first
+        except Exception as e:
+            db.session.rollback()
+            print(f"Could not persist theme cache entry: {e}")
+
+    def prune(self, prompt_version=None):
+        """Deletes idle rows (and rows from other prompt versions), then trims to max_entries. Returns rows removed."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.max_idle)
+        stale = CachedTheme.last_used_at < cutoff
+        if prompt_version is not None:
+            stale = stale | (CachedTheme.prompt_version != prompt_version)
+        removed = CachedTheme.query.filter(stale).delete(synchronize_session=False)
+        overflow = CachedTheme.query.count() - self.max_entries
+        if overflow > 0:
+            stale_keys = [row.cache_key for row in CachedTheme.query
+                          .with_entities(CachedTheme.cache_key)
+                          .order_by(CachedTheme.last_used_at.asc(), CachedTheme.hit_count.asc())
+                          .limit(overflow)]
+            removed += CachedTheme.query.filter(CachedTheme.cache_key.in_(stale_keys)).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+    def stats(self):
+        return self.memory.stats()
+
+
+theme_cache = ThemeCache()
+
+
+class ThemeStylesheets:
+    """
+    Content-addressed theme stylesheets. A hash always maps to the same CSS, so responses can be
+    cached by browsers forever and rows are never updated.
+    """
+    HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+    def __init__(self, memory_size=256):
+        self.memory = LRUCache(max_size=memory_size)
+
+    def init_app(self, app):
+        self.memory = LRUCache(max_size=app.config.get('THEME_CACHE_MEMORY_SIZE', 256))
+
+    @staticmethod
+    def content_hash(css):
+        return hashlib.sha256(css.encode('utf-8')).hexdigest()
+
+    def store(self, css):
+        """Persists the stylesheet (committed on its own) and returns its hash."""
+        content_hash = self.content_hash(css)
+        if self.memory.get(content_hash) is not None:
+            return content_hash
+        if db.session.get(ThemeStylesheet, content_hash) is None:
+            db.session.add(ThemeStylesheet(content_hash=content_hash, css=css))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback() # Same CSS stored concurrently; identical content
+        self.memory.set(content_hash, css)
+        return content_hash
+
+    def get(self, content_hash):
+        """Returns the CSS for a hash, or None if it's unknown or malformed."""
+        if not content_hash or not self.HASH_PATTERN.match(content_hash):
+            return None
+        css = self.memory.get(content_hash)
+        if css is None:
+            entry = db.session.get(ThemeStylesheet, content_hash)
+            if entry is None:
+                return None
+            css = entry.css
+            self.memory.set(content_hash, css)
+        return css
+
+
+theme_stylesheets = ThemeStylesheets()
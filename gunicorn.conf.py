@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# Loaded automatically by gunicorn from the working directory (command-line flags still win).
+import os
+import shutil
+import tempfile
+
+# Prometheus multiprocess mode: every worker writes its metrics to files in this directory
+# and /metrics aggregates them. Must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'study_ai_metrics'))
+
+
+def on_starting(server):
+    # Start clean so counters from a previous run aren't merged in
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,528 @@
+# jobs.py
+import io
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from flask import current_app
+from sqlalchemy import update
+from models import db, User, TestDefinition, Question, GenerationJob
+from models import create_question_from_dict
+from api_handler import APIError, AuthenticationError, RetryDeadlineExceeded, handler_registry, run_async
+from api_handler import DEFAULT_QUESTION_TYPES, QUESTION_PROMPT_VERSION
+from circuit_breaker import CircuitOpenError
+from generation_cache import question_set_cache
+from counters import record_questions_added
+from question_cache import question_snapshots
+from utils import extract_text_from_pdf
+
+
+class GenerationError(Exception):
+    """A failure whose message is safe to show to the user."""
+    pass
+
+
+# --- Job Lifecycle ---
+def create_generation_job(user_id, title, num_questions, source_text=None, pdf_bytes=None, pdf_filename=None):
+    """Persists a pending job. The caller commits and then calls job_runner.submit(job.id)."""
+    job = GenerationJob(
+        user_id=user_id,
+        title=title,
+        num_questions=num_questions,
+        source_text=source_text,
+        source_pdf=pdf_bytes,
+        source_filename=pdf_filename,
+        status='pending'
+    )
+    db.session.add(job)
+    return job
+
+
+def claim_job(job_id):
+    """Atomically moves a job from pending to running. Returns False if someone else already took it."""
+    result = db.session.execute(
+        update(GenerationJob)
+        .where(GenerationJob.id == job_id, GenerationJob.status == 'pending')
+        .values(status='running', started_at=datetime.now(timezone.utc))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def orphaned_pending_jobs(min_age_seconds):
+    """Ids of pending jobs created more than `min_age_seconds` ago, oldest first."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)
+    job_ids = [row.id for row in (GenerationJob.query.with_entities(GenerationJob.id)
+                                  .filter(GenerationJob.status == 'pending', GenerationJob.created_at < cutoff)
+                                  .order_by(GenerationJob.created_at.asc()))]
+    db.session.commit() # End the read transaction
+    return job_ids
+
+
+def requeue_stale_jobs(max_age_seconds):
+    """Puts 'running' jobs back to pending if their worker seems to have died. Returns the count."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+    result = db.session.execute(
+        update(GenerationJob)
+        .where(GenerationJob.status == 'running', GenerationJob.started_at < cutoff)
+        .values(status='pending', started_at=None)
+        .execution_options(synchronize_session=False) # Loaded jobs hold naive datetimes on SQLite; don't evaluate in Python
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def run_generation_job(job_id):
+    """Runs one job end to end (needs an app context). Safe to call for a job that's already claimed elsewhere."""
+    if not claim_job(job_id):
+        return
+    job = db.session.get(GenerationJob, job_id)
+    current_app.logger.info(f"Running generation job {job_id} for user {job.user_id}.")
+    try:
+        test_def, notices = generate_test_from_job(job)
+        job.status = 'complete'
+        job.test_definition_id = test_def.id
+        job.notices = notices
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(GenerationJob, job_id)
+        test_def = db.session.get(TestDefinition, job.test_definition_id) if job.test_definition_id else None
+        if test_def is not None: # Streamed questions were already committed: a failed job leaves no half-built test
+            _discard_test_definition(job, test_def)
+        job.status = 'failed'
+        if isinstance(e, GenerationError):
+            job.error = str(e)
+        else:
+            job.error = "An unexpected error occurred during test generation. Please try again."
+            current_app.logger.error(f"Unexpected error in generation job {job_id}: {e}", exc_info=True)
+    job.finished_at = datetime.now(timezone.utc)
+    job.source_pdf = None # Don't keep uploads around once processed
+    db.session.commit()
+    current_app.logger.info(f"Generation job {job_id} finished with status '{job.status}'.")
+
+    # The test is already playable; hints and option feedback are follow-up stages on the same background worker
+    if job.status == 'complete' and current_app.config.get('HINT_PREGENERATION', True):
+        pregenerate_hints(job.test_definition_id, job.user_id)
+    if job.status == 'complete' and current_app.config.get('OPTION_EXPLANATION_PREGENERATION', True):
+        pregenerate_option_explanations(job.test_definition_id, job.user_id)
+
+
+# --- Generation Pipeline (formerly inline in routes/tests.generate_test) ---
+def generate_test_from_job(job):
+    """Extracts text, gets questions (cache or API) and stores the TestDefinition. Returns (test_def, notices)."""
+    notices = []
+    title = job.title or "Untitled Test"
+
+    # --- 1. Determine Source Text (Text or PDF) ---
+    source_text = (job.source_text or "").strip()
+    if not source_text and job.source_pdf:
+        current_app.logger.info(f"Processing uploaded PDF: {job.source_filename}")
+        extracted_text = extract_text_from_pdf(io.BytesIO(job.source_pdf))
+        if not extracted_text or not extracted_text.strip():
+            raise GenerationError("Could not extract any readable text from the PDF. It might be empty, image-based, or corrupted.")
+        source_text = extracted_text.strip()
+        current_app.logger.info(f"Extracted {len(source_text)} characters from PDF.")
+    if not source_text:
+        raise GenerationError("Source material appears to be empty after processing.")
+
+    # --- 2. Limit Text Length ---
+    # Long documents are chunked and processed concurrently (map-reduce), so this cap only
+    # guards against pathological uploads rather than dropping everything past page two.
+    MAX_TEXT_LENGTH = current_app.config.get('MAX_SOURCE_CHARS', 200000)
+    original_length = len(source_text)
+    if original_length > MAX_TEXT_LENGTH:
+        source_text = source_text[:MAX_TEXT_LENGTH]
+        notices.append(["info", f"Source text was long ({original_length} chars) and has been truncated to {MAX_TEXT_LENGTH} characters for processing."])
+        current_app.logger.info(f"Truncated source text from {original_length} to {len(source_text)} chars.")
+
+    # --- 3. Get Questions (cache first, then API) ---
+    num_questions = job.num_questions
+    model = handler_registry.model_name
+    cache_key = question_set_cache.make_key(source_text, num_questions, DEFAULT_QUESTION_TYPES,
+                                            model, QUESTION_PROMPT_VERSION)
+    generated_q_dicts = question_set_cache.get(cache_key) if not job.test_definition_id else None
+    if job.test_definition_id: # Requeued after its worker died mid-stream: finish the same test
+        return stream_test_from_job(job, title, source_text, cache_key, model, notices)
+    elif generated_q_dicts is not None:
+        current_app.logger.info(f"Question set cache hit for test '{title}' ({cache_key[:12]}).")
+    elif current_app.config.get('GENERATION_STREAMING', True):
+        return stream_test_from_job(job, title, source_text, cache_key, model, notices)
+    else:
+        api_key = _get_job_api_key(job)
+        try:
+            handler = handler_registry.get_async_handler(api_key)
+            current_app.logger.info(f"Requesting {num_questions} questions from API for test '{title}'...")
+            generated_q_dicts = run_async(handler.generate_questions_map_reduce(
+                source_text,
+                num_questions=num_questions,
+                question_types=DEFAULT_QUESTION_TYPES,
+                chunk_tokens=current_app.config.get('GENERATION_CHUNK_TOKENS', 1500),
+                max_workers=current_app.config.get('GENERATION_MAX_WORKERS', 4),
+                token_budget=current_app.config.get('GENERATION_TOKEN_BUDGET'),
+            ))
+        except (APIError, ValueError, RetryDeadlineExceeded, CircuitOpenError) as e: # Bad key, API failure/outage, or a response that never validated
+            raise _to_generation_error(e, api_key)
+        if generated_q_dicts:
+            question_set_cache.set(cache_key, generated_q_dicts, model=model,
+                                   prompt_version=QUESTION_PROMPT_VERSION)
+
+    if not generated_q_dicts: # Checks for None or empty list
+        current_app.logger.warning(f"API returned no questions for test '{title}'.")
+        raise GenerationError("The AI did not return any questions based on the provided text. Try different text or simplify the request.")
+
+    # --- 4. Create DB Objects ---
+    test_def, valid_questions_created = create_test_definition(job.user_id, title, source_text, generated_q_dicts)
+    if valid_questions_created == 0:
+        # If API returned data but NONE could be processed
+        db.session.rollback() # Rollback test definition creation
+        current_app.logger.error(f"Failed to process any questions for test '{title}' after API returned {len(generated_q_dicts)} items.")
+        raise GenerationError("API returned data, but no valid questions could be processed into the required format. Please check the source text or try again.")
+
+    db.session.flush()
+    current_app.logger.info(f"Successfully created test '{title}' (ID: {test_def.id}) with {valid_questions_created} questions for user {job.user_id}.")
+    notices.insert(0, ["success", f"Successfully generated test '{title}' with {valid_questions_created} questions!"])
+
+    # Report if some questions were skipped
+    if valid_questions_created < len(generated_q_dicts):
+        skipped_count = len(generated_q_dicts) - valid_questions_created
+        notices.append(["warning", f"Warning: {skipped_count} item(s) returned by the API could not be processed due to formatting issues."])
+    return test_def, notices
+
+
+def _get_job_api_key(job):
+    user = db.session.get(User, job.user_id)
+    api_key = user.get_api_key() if user else None
+    if not api_key:
+        raise GenerationError("Could not retrieve your API key. Please set it in settings.")
+    return api_key
+
+
+def _to_generation_error(error, api_key):
+    """Maps an API/validation failure to a message the user can act on."""
+    if isinstance(error, AuthenticationError):
+        handler_registry.invalidate(api_key) # Force re-validation next time
+        return GenerationError("Authentication failed with OpenAI. Please check your API key in settings.")
+    if isinstance(error, CircuitOpenError):
+        return GenerationError(str(error)) # Already user-facing
+    return GenerationError(f"Error during question generation: {error}")
+
+
+def stream_test_from_job(job, title, source_text, cache_key, model, notices):
+    """
+    Streaming variant of steps 3-4: the TestDefinition is committed first and every question is
+    committed as soon as it arrives, so the first one is playable while the rest are generated.
+    A job requeued after its worker died carries on with the test it already started.
+    """
+    api_key = _get_job_api_key(job)
+    test_def = db.session.get(TestDefinition, job.test_definition_id) if job.test_definition_id else None
+    if test_def is None:
+        test_def = TestDefinition(user_id=job.user_id, source_text_snippet=source_text[:300], title=title)
+        db.session.add(test_def)
+        db.session.flush()
+        job.test_definition_id = test_def.id
+        db.session.commit() # Visible (still empty) while the job is running
+
+    existing_texts = [q.text for q in Question.query.filter_by(test_definition_id=test_def.id)]
+    created = len(existing_texts)
+    streamed_q_dicts = []
+    skipped_count = 0
+    try:
+        handler = handler_registry.get_handler(api_key)
+        current_app.logger.info(f"Streaming {job.num_questions - created} questions from API for test '{title}'...")
+        for q_data in handler.generate_questions_stream(
+                source_text,
+                num_questions=job.num_questions - created,
+                question_types=DEFAULT_QUESTION_TYPES,
+                chunk_tokens=current_app.config.get('GENERATION_CHUNK_TOKENS', 1500),
+                max_workers=current_app.config.get('GENERATION_MAX_WORKERS', 4),
+                token_budget=current_app.config.get('GENERATION_TOKEN_BUDGET'),
+                exclude_texts=existing_texts):
+            try:
+                db.session.add(build_question(test_def.id, created, q_data))
+                record_questions_added(test_def.id)
+                db.session.commit() # Playable right away
+            except ValueError as e:
+                db.session.rollback()
+                skipped_count += 1
+                current_app.logger.warning(f"Skipping streamed question for test '{title}' due to parsing error: {e}. Data: {q_data}")
+                continue
+            created += 1
+            streamed_q_dicts.append(q_data)
+    except (APIError, ValueError, RetryDeadlineExceeded, CircuitOpenError) as e:
+        db.session.rollback()
+        if created == 0:
+            _discard_test_definition(job, test_def)
+            raise _to_generation_error(e, api_key)
+        current_app.logger.warning(f"Streaming generation for test '{title}' stopped early: {e}")
+        notices.append(["warning", f"Generation stopped early ({e}). The test has {created} of {job.num_questions} questions."])
+
+    if created == 0:
+        _discard_test_definition(job, test_def)
+        current_app.logger.warning(f"API returned no usable questions for test '{title}'.")
+        raise GenerationError("The AI did not return any questions based on the provided text. Try different text or simplify the request.")
+
+    if len(streamed_q_dicts) == job.num_questions: # Only complete, uninterrupted sets are reused
+        question_set_cache.set(cache_key, streamed_q_dicts, model=model, prompt_version=QUESTION_PROMPT_VERSION)
+    current_app.logger.info(f"Successfully streamed test '{title}' (ID: {test_def.id}) with {created} questions for user {job.user_id}.")
+    notices.insert(0, ["success", f"Successfully generated test '{title}' with {created} questions!"])
+    if skipped_count:
+        notices.append(["warning", f"Warning: {skipped_count} item(s) returned by the API could not be processed due to formatting issues."])
+    return test_def, notices
+
+
+def _discard_test_definition(job, test_def):
+    """Deletes a job's test with its questions (and any attempts already started on it)."""
+    job.test_definition_id = None
+    db.session.flush() # Drop the job's reference before the row it points to
+    db.session.delete(test_def)
+    db.session.commit()
+    question_snapshots.invalidate(test_def.id)
+
+
+def build_question(test_definition_id, question_index, q_data):
+    """Builds a Question row from one API question dict. Raises ValueError if the dict is unusable."""
+    # Use the factory function (imported from models)
+    q_obj = create_question_from_dict(q_data)
+
+    # Create the Question DB model instance
+    new_question = Question(
+        test_definition_id=test_definition_id,
+        question_index=question_index,
+        text=q_obj.text,
+        question_type=q_obj.question_type,
+        hint=getattr(q_obj, 'hint', None)
+    )
+    # Store type-specific info
+    if q_obj.question_type == 'multiple_choice':
+        new_question.options = q_obj.options # Uses JSON setter
+        new_question.correct_answer_info = q_obj.correct_answer_index # Uses JSON setter
+    elif q_obj.question_type == 'fill_in_the_blank':
+        new_question.correct_answer_info = q_obj.correct_answer # Uses JSON setter
+    elif q_obj.question_type == 'free_response':
+        new_question.suggested_answer = q_obj.suggested_answer
+    new_question.compile_answer_key() # Grading never decodes / normalizes the stored answer again
+    return new_question
+
+
+def create_test_definition(user_id, title, source_text, generated_q_dicts):
+    """Adds a TestDefinition and its valid Questions to the session (not committed). Returns (test_def, valid_count)."""
+    valid_questions_created = 0
+    new_test_def = TestDefinition(
+        user_id=user_id,
+        source_text_snippet=source_text[:300], # Store slightly longer snippet
+        title=title
+    )
+    # Add *before* the loop in case of errors during question processing
+    db.session.add(new_test_def)
+    db.session.flush()
+
+    # Process each dictionary from the API
+    for i, q_data in enumerate(generated_q_dicts):
+        try:
+            # Keep indices contiguous when items are skipped
+            new_question = build_question(new_test_def.id, valid_questions_created, q_data)
+            db.session.add(new_question)
+            valid_questions_created += 1
+
+        except ValueError as e:
+            current_app.logger.warning(f"Skipping question {i+1} for test '{title}' due to parsing error: {e}. Data: {q_data}")
+        except Exception as e:
+            # Catch any other unexpected errors during object creation
+            current_app.logger.error(f"Unexpected error creating question object {i+1} for test '{title}': {e}. Data: {q_data}", exc_info=True)
+            # Continue processing other questions
+
+    new_test_def.question_count = valid_questions_created # New row, no concurrent writers yet
+    return new_test_def, valid_questions_created
+
+
+# --- Hint / Explanation Pre-generation ---
+def _pregeneration_handler(test_definition_id, user_id, stage):
+    """Handler for a pre-generation stage, or None if it should be skipped (the lazy paths still work)."""
+    user = db.session.get(User, user_id)
+    api_key = user.get_api_key() if user and user.api_key_set else None
+    if not api_key or handler_registry.is_circuit_open(api_key):
+        current_app.logger.info(f"Skipping {stage} pre-generation for test {test_definition_id} (no usable API key or circuit open).")
+        return None
+    try:
+        return handler_registry.get_handler(api_key)
+    except Exception as e:
+        current_app.logger.warning(f"Skipping {stage} pre-generation for test {test_definition_id}: {e}")
+        return None
+
+
+def pregenerate_hints(test_definition_id, user_id):
+    """
+    Fills Question.hint for every question of a test that doesn't have one yet, using batched
+    completions, so hint clicks become plain DB reads. Failures are logged and left to the lazy
+    /hint path. Returns the number of hints stored.
+    """
+    questions = (Question.query
+                 .filter(Question.test_definition_id == test_definition_id, Question.hint.is_(None))
+                 .order_by(Question.question_index).all())
+    if not questions:
+        return 0
+    handler = _pregeneration_handler(test_definition_id, user_id, "hint")
+    if handler is None:
+        return 0
+
+    try:
+        hints = handler.generate_hints_batch([q.text for q in questions],
+                                             batch_size=current_app.config.get('HINT_BATCH_SIZE', 20))
+    except Exception as e:
+        current_app.logger.warning(f"Hint pre-generation failed for test {test_definition_id}: {e}")
+        return 0
+
+    stored = 0
+    for i, hint_text in hints.items():
+        # Conditional write: never overwrite a hint a student's click stored in the meantime
+        result = db.session.execute(
+            update(Question)
+            .where(Question.id == questions[i].id, Question.hint.is_(None))
+            .values(hint=hint_text)
+        )
+        stored += result.rowcount
+    db.session.commit()
+    question_snapshots.invalidate(test_definition_id)
+    current_app.logger.info(f"Pre-generated {stored} hint(s) for test {test_definition_id}.")
+    return stored
+
+
+def pregenerate_option_explanations(test_definition_id, user_id):
+    """
+    Stores an explanation for every option of the test's multiple-choice questions, so submitting
+    a multiple-choice answer renders feedback from the DB (see Answer.explanation) without an LLM
+    call. Questions that already have them, or whose correct option can't be determined, are
+    skipped. Returns the number of questions updated.
+    """
+    questions = [q for q in (Question.query
+                             .filter(Question.test_definition_id == test_definition_id,
+                                     Question.question_type == 'multiple_choice',
+                                     Question.option_explanations_json.is_(None))
+                             .order_by(Question.question_index).all())
+                 if q.options and q.correct_option_index is not None]
+    if not questions:
+        return 0
+    handler = _pregeneration_handler(test_definition_id, user_id, "option explanation")
+    if handler is None:
+        return 0
+
+    try:
+        explanations = handler.generate_option_explanations_batch(
+            [(q.text, q.options, q.correct_option_index) for q in questions],
+            batch_size=current_app.config.get('OPTION_EXPLANATION_BATCH_SIZE', 10))
+    except Exception as e:
+        current_app.logger.warning(f"Option explanation pre-generation failed for test {test_definition_id}: {e}")
+        return 0
+
+    for i, option_explanations in explanations.items():
+        questions[i].option_explanations = option_explanations
+    db.session.commit()
+    question_snapshots.invalidate(test_definition_id)
+    current_app.logger.info(f"Pre-generated option explanations for {len(explanations)} question(s) in test {test_definition_id}.")
+    return len(explanations)
+
+
+# --- Executors ---
+def _run_in_thread(app, job_id):
+    with app.app_context():
+        try:
+            run_generation_job(job_id)
+        finally:
+            db.session.remove()
+
+
+def _run_in_subprocess(job_id):
+    # Spawned interpreter: build the app from scratch (no inherited DB connections)
+    from app import app
+    with app.app_context():
+        run_generation_job(job_id)
+
+
+class JobRunner:
+    """
+    Dispatches generation jobs according to GENERATION_JOB_EXECUTOR:
+      - 'thread':   in-process thread pool (default)
+      - 'process':  in-process pool of spawned worker processes
+      - 'external': do nothing here; `python worker.py` picks pending jobs up from the table
+
+    In-process pools die with their web worker, so the runner also does worker.py's stale-job
+    recovery (see recover_stale_jobs), triggered by submissions and status polls.
+    """
+    RECOVERY_INTERVAL = 60 # Seconds between stale-job sweeps per process
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._last_recovery = None
+        self.app = None
+        self.mode = 'thread'
+        self.max_workers = 2
+        self.stale_after = 900
+        self.orphan_after = 60
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('GENERATION_JOB_EXECUTOR', 'thread')
+        self.max_workers = app.config.get('GENERATION_JOB_WORKERS', 2)
+        self.stale_after = app.config.get('GENERATION_JOB_STALE_AFTER', 900)
+        self.orphan_after = app.config.get('GENERATION_JOB_ORPHAN_AFTER', 60)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid(): # Pools don't survive fork()
+                if self.mode == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='generation-job')
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, job_id):
+        if self.mode == 'external':
+            return
+        self._dispatch(job_id)
+        self.recover_stale_jobs()
+
+    def _dispatch(self, job_id):
+        if self.mode == 'process':
+            self._get_executor().submit(_run_in_subprocess, job_id)
+        else:
+            self._get_executor().submit(_run_in_thread, self.app, job_id)
+
+    def recover_stale_jobs(self):
+        """
+        Requeues 'running' jobs whose worker died (older than GENERATION_JOB_STALE_AFTER) and
+        dispatches pending jobs nobody has started within GENERATION_JOB_ORPHAN_AFTER, e.g. after a
+        gunicorn worker restart lost its pool. Duplicates are harmless: claim_job lets only one run.
+        At most once per RECOVERY_INTERVAL per process (the first call after startup always runs);
+        a no-op with the external executor, where worker.py does this. Needs an app context.
+        Returns the number of jobs dispatched.
+        """
+        if self.mode == 'external':
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            if self._last_recovery is not None and now - self._last_recovery < self.RECOVERY_INTERVAL:
+                return 0
+            self._last_recovery = now
+        try:
+            requeued = requeue_stale_jobs(self.stale_after)
+            job_ids = orphaned_pending_jobs(self.orphan_after)
+        except Exception as e: # Recovery must never break the request that triggered it
+            db.session.rollback()
+            current_app.logger.error(f"Stale generation job recovery failed: {e}")
+            return 0
+        if requeued:
+            current_app.logger.warning(f"Requeued {requeued} stale generation job(s).")
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        if job_ids:
+            current_app.logger.info(f"Dispatched {len(job_ids)} orphaned generation job(s).")
+        return len(job_ids)
+
+
+job_runner = JobRunner()
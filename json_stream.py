@@ -0,0 +1,99 @@
+# json_stream.py
+import re
+import json
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for a streamed JSON object that holds an array under `key`, e.g.
+    {"questions": [{...}, {...}]}. Feed it text deltas; each array element is returned as
+    soon as it is complete, long before the enclosing object closes.
+
+    Elements that aren't valid JSON are skipped and recorded in `errors` as (raw_text, message).
+    Anything outside the array (markdown fences, other keys) is ignored.
+    """
+
+    def __init__(self, key):
+        self._key_pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+        self._buffer = ""
+        self._pos = 0 # Scan position in _buffer
+        self._in_array = False
+        self._item_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.finished = False # True once the array's closing bracket was seen
+        self.items_parsed = 0
+        self.errors = []
+
+    def feed(self, text):
+        """Consumes a chunk of text. Returns the list of elements completed by it."""
+        if self.finished or not text:
+            return []
+        self._buffer += text
+        completed = []
+
+        if not self._in_array:
+            match = self._key_pattern.search(self._buffer)
+            if not match:
+                return completed
+            self._in_array = True
+            self._buffer = self._buffer[match.end():]
+            self._pos = 0
+
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer):
+            char = buffer[i]
+            if self._item_start is None:
+                # Between elements: skip separators, stop at the end of the array
+                if char == ']':
+                    self.finished = True
+                    break
+                if char not in ' \t\r\n,':
+                    self._item_start = i
+                    self._depth = 0
+                    continue # Re-read this char as part of the element
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 0: # A bare string element ends with its quote
+                        self._emit(buffer[self._item_start:i + 1], completed)
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0: # ']' closing the array right after a scalar element
+                    self._emit(buffer[self._item_start:i], completed)
+                    self.finished = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(buffer[self._item_start:i + 1], completed)
+            elif char == ',' and self._depth == 0: # End of a number/true/false/null element
+                self._emit(buffer[self._item_start:i], completed)
+            i += 1
+
+        # Drop consumed text so the buffer only holds the element in progress
+        keep_from = self._item_start if self._item_start is not None else i
+        self._buffer = buffer[keep_from:]
+        self._pos = i - keep_from
+        if self._item_start is not None:
+            self._item_start = 0
+        return completed
+
+    def _emit(self, raw, completed):
+        self._item_start = None
+        raw = raw.strip()
+        if not raw:
+            return
+        try:
+            completed.append(json.loads(raw))
+            self.items_parsed += 1
+        except json.JSONDecodeError as e:
+            self.errors.append((raw[:200], str(e)))
@@ -0,0 +1,281 @@
+# llm_providers.py
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import namedtuple
+import httpx
+from openai import OpenAI, AsyncOpenAI, RateLimitError, InternalServerError
+from utils import estimate_tokens
+
+# Token counts are None when the backend doesn't report usage
+Completion = namedtuple('Completion', ['text', 'prompt_tokens', 'completion_tokens'])
+
+
+class LLMProvider:
+    """
+    Backend used by ChatGPTHandler for raw completions. Retries, validation and rate limiting
+    stay in the handler; a provider only turns messages into text.
+
+    `operation` names the handler method making the call (e.g. "generate_hint"). Real backends
+    ignore it; the stub uses it to pick a response shape. Streams fill the optional `usage`
+    dict with prompt_tokens/completion_tokens once they finish.
+    """
+    name = "base"
+    model = None
+
+    def complete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        """Returns a Completion."""
+        raise NotImplementedError
+
+    async def acomplete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        raise NotImplementedError
+
+    def stream(self, messages, json_mode=False, temperature=0.5, operation=None, usage=None):
+        """Yields text deltas."""
+        raise NotImplementedError
+
+    def validate_key(self):
+        """Raises openai.AuthenticationError if the credentials are rejected."""
+        pass
+
+
+class OpenAIProvider(LLMProvider):
+    """Chat Completions through the official SDK. Pass `client` for sync use, `async_client` for async."""
+    name = "openai"
+
+    def __init__(self, model, client=None, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.model = model
+
+    def _completion_args(self, messages, json_mode, temperature):
+        completion_args = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature,
+        }
+        # JSON mode requires specific prompt instructions for the model (gpt-3.5-turbo-1106 and later)
+        if json_mode:
+            completion_args["response_format"] = {"type": "json_object"}
+        return completion_args
+
+    @staticmethod
+    def _to_completion(response):
+        usage = response.usage
+        return Completion(response.choices[0].message.content,
+                          usage.prompt_tokens if usage else None,
+                          usage.completion_tokens if usage else None)
+
+    def complete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        response = self.client.chat.completions.create(**self._completion_args(messages, json_mode, temperature))
+        return self._to_completion(response)
+
+    async def acomplete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        response = await self.async_client.chat.completions.create(**self._completion_args(messages, json_mode, temperature))
+        return self._to_completion(response)
+
+    def stream(self, messages, json_mode=False, temperature=0.5, operation=None, usage=None):
+        stream = self.client.chat.completions.create(stream=True, stream_options={"include_usage": True},
+                                                     **self._completion_args(messages, json_mode, temperature))
+        for chunk in stream:
+            if chunk.usage and usage is not None: # Sent in a final chunk with no choices
+                usage["prompt_tokens"] = chunk.usage.prompt_tokens
+                usage["completion_tokens"] = chunk.usage.completion_tokens
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    def validate_key(self):
+        if self.client is not None: # Async-only providers are validated through their sync twin
+            self.client.models.list()
+
+
+# --- Local Stub Backend ---
+_STUB_REQUEST = httpx.Request("POST", "http://stub.local/v1/chat/completions")
+_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z\-]{3,}")
+_STOPWORDS = {"this", "that", "with", "from", "have", "they", "their", "which", "there", "were", "been",
+              "will", "would", "could", "should", "about", "into", "than", "then", "also", "these", "those",
+              "what", "when", "where", "does", "text", "question"}
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic offline backend for load tests and benchmarks. Responses are schema-valid for
+    every handler operation and depend only on the prompt, so repeated runs are comparable.
+
+    Args:
+        latency: Seconds added to every call (streams spread it over the tokens).
+        latency_jitter: Extra uniform random latency, 0..latency_jitter seconds.
+        error_rate: Fraction of calls that fail with a 500 (retryable).
+        rate_limit_rate: Fraction of calls that fail with a 429 carrying Retry-After.
+        retry_after: Seconds advertised in the 429's Retry-After header.
+        seed: Seeds the latency/failure RNG (None = nondeterministic).
+    """
+    name = "stub"
+    model = "stub"
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # --- Fault Injection ---
+    def _roll(self):
+        """Returns (delay_seconds, error_or_None) for one call."""
+        with self._lock:
+            delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+            draw = self._rng.random()
+        if draw < self.rate_limit_rate:
+            response = httpx.Response(429, headers={"retry-after": str(self.retry_after)}, request=_STUB_REQUEST)
+            return delay, RateLimitError("Stub rate limit exceeded.", response=response, body=None)
+        if draw < self.rate_limit_rate + self.error_rate:
+            response = httpx.Response(500, request=_STUB_REQUEST)
+            return delay, InternalServerError("Stub server error.", response=response, body=None)
+        return delay, None
+
+    def complete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        delay, error = self._roll()
+        if delay:
+            time.sleep(delay)
+        if error:
+            raise error
+        return self._complete(messages, operation)
+
+    async def acomplete(self, messages, json_mode=False, temperature=0.5, operation=None):
+        delay, error = self._roll()
+        if delay:
+            await asyncio.sleep(delay)
+        if error:
+            raise error
+        return self._complete(messages, operation)
+
+    def stream(self, messages, json_mode=False, temperature=0.5, operation=None, usage=None):
+        delay, error = self._roll()
+        if error:
+            if delay:
+                time.sleep(delay)
+            raise error
+        completion = self._complete(messages, operation)
+        tokens = re.findall(r"\S+\s*", completion.text)
+        for token in tokens:
+            if delay:
+                time.sleep(delay / len(tokens))
+            yield token
+        if usage is not None:
+            usage.update(prompt_tokens=completion.prompt_tokens, completion_tokens=completion.completion_tokens)
+
+    def _complete(self, messages, operation):
+        text = self._respond(messages, operation)
+        return Completion(text, sum(estimate_tokens(m["content"]) for m in messages), estimate_tokens(text))
+
+    # --- Canned Responses ---
+    def _respond(self, messages, operation):
+        # The first user message is the prompt; later ones are retry feedback
+        prompt = next((m["content"] for m in messages if m["role"] == "user"), "")
+        rng = random.Random(hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest())
+        builder = getattr(self, f"_respond_{operation}", None) if operation else None
+        if builder is None:
+            return "This is a stub response."
+        return builder(prompt, rng)
+
+    @staticmethod
+    def _keywords(text, limit=40):
+        words = []
+        for word in _WORD_PATTERN.findall(text):
+            lowered = word.lower()
+            if lowered not in _STOPWORDS and lowered not in words:
+                words.append(lowered)
+            if len(words) >= limit:
+                break
+        return words or ["concept", "process", "structure", "function", "system"]
+
+    def _respond_generate_questions(self, prompt, rng):
+        match = re.search(r"generate (\d+) study questions", prompt)
+        num_questions = int(match.group(1)) if match else 5
+        match = re.search(r"types ONLY: ([a-z_, ]+)\.", prompt)
+        types = [t.strip() for t in match.group(1).split(",")] if match else ["multiple_choice", "fill_in_the_blank", "free_response"]
+        source = prompt.split("Source Text:", 1)[-1]
+        words = self._keywords(source)
+        offset = rng.randrange(len(words)) # Follow-up requests (different prompt) get different questions
+
+        questions = []
+        for i in range(num_questions):
+            q_type = types[i % len(types)]
+            word = words[(offset + i) % len(words)]
+            related = words[(offset + i + 1) % len(words)]
+            if q_type == "multiple_choice":
+                distractors = [w for w in words if w not in (word, related)] or ["none"]
+                options = [word] + rng.sample(distractors, k=min(3, len(distractors)))
+                rng.shuffle(options)
+                questions.append({"type": q_type, "text": f"Which term does the text discuss alongside '{related}'?",
+                                  "options": options, "answer": options.index(word)})
+            elif q_type == "fill_in_the_blank":
+                questions.append({"type": q_type, "text": f"According to the text, ___ is closely related to {related}.", "answer": word})
+            else:
+                questions.append({"type": q_type, "text": f"Explain the role of '{word}' in the text.",
+                                  "answer": f"The text describes {word} and how it relates to {related}."})
+        return json.dumps({"questions": questions})
+
+    def _respond_generate_hint(self, prompt, rng):
+        match = re.search(r'Question:\s*"(.*?)"', prompt, flags=re.DOTALL)
+        word = rng.choice(self._keywords(match.group(1) if match else prompt))
+        return f"Think about what the text says about {word}."
+
+    def _respond_generate_explanation(self, prompt, rng):
+        match = re.search(r'Correct Answer:\s*"(.*?)"', prompt, flags=re.DOTALL)
+        answer = match.group(1) if match else "the stated answer"
+        return f"The correct answer is {answer} because it matches the concept described in the source material."
+
+    def _respond_generate_css_theme(self, prompt, rng):
+        primary = "#%06x" % rng.randrange(0x1000000)
+        background = "#%06x" % rng.randrange(0x1000000)
+        return (f"body {{ background-color: {background}; }}\n"
+                f".navbar {{ background-color: {primary} !important; }}\n"
+                f".btn-primary {{ background-color: {primary}; border-color: {primary}; }}\n"
+                f".card {{ border-radius: 0.5rem; }}")
+
+    def _respond_grade_free_response(self, prompt, rng):
+        return json.dumps({"score": round(rng.random(), 2)})
+
+    def _respond_grade_free_responses_batch(self, prompt, rng):
+        ids = [int(i) for i in re.findall(r'\{"id": (\d+),', prompt)]
+        return json.dumps({"scores": [{"id": i, "score": round(rng.random(), 2)} for i in ids]})
+
+    def _respond_generate_hints_batch(self, prompt, rng):
+        items = [json.loads(line) for line in re.findall(r'^\s*(\{"id": \d+, "question": .*\})\s*$', prompt, flags=re.MULTILINE)]
+        return json.dumps({"hints": [{"id": item["id"], "hint": f"Think about what the text says about {rng.choice(self._keywords(item['question']))}."}
+                                     for item in items]})
+
+    def _respond_generate_option_explanations_batch(self, prompt, rng):
+        items = [json.loads(line) for line in re.findall(r'^\s*(\{"id": \d+, "question": .*\})\s*$', prompt, flags=re.MULTILINE)]
+        explanations = []
+        for item in items:
+            options = item["options"]
+            correct = options[item["correct_index"]] if 0 <= item["correct_index"] < len(options) else "the correct option"
+            explanations.append({"id": item["id"], "options": [
+                f"Correct: {option} matches the concept described in the source material." if i == item["correct_index"]
+                else f"Not quite: {option} doesn't fit here; the source material points to {correct}."
+                for i, option in enumerate(options)]})
+        return json.dumps({"explanations": explanations})
+
+    # Streaming operations share the plain-text responses
+    _respond_stream_questions = _respond_generate_questions
+    _respond_stream_hint = _respond_generate_hint
+    _respond_stream_explanation = _respond_generate_explanation
+
+
+def create_openai_provider(api_key, model, http_client=None, use_async=False):
+    """OpenAIProvider with SDK retries disabled (retries are handled by retry_policy)."""
+    if use_async:
+        return OpenAIProvider(model, async_client=AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0))
+    return OpenAIProvider(model, client=OpenAI(api_key=api_key, http_client=http_client, max_retries=0))
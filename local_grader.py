@@ -0,0 +1,197 @@
+# local_grader.py
+import re
+import hashlib
+import threading
+from collections import Counter, namedtuple
+from cache import LRUCache
+from utils import content_terms, normalize_fib_answer
+from telemetry import LOCAL_GRADER_DECISIONS, LOCAL_GRADER_SCORES
+
+# decision: 'blank' / 'exact' / 'match' / 'unrelated' (decided locally) or 'uncertain' (send to the LLM)
+LocalGrade = namedtuple('LocalGrade', ['decision', 'score', 'combined', 'features'])
+
+FEATURE_WEIGHTS = {"overlap": 0.3, "bm25": 0.3, "embedding": 0.4}
+QUESTION_TERM_WEIGHT = 0.3 # Repeating the question's own words is weak evidence
+MIN_DISTINCT_RATIO = 0.6 # Answers repeating their terms more than this (keyword stuffing) are never accepted locally
+NEGATIONS = frozenset("no not never none nothing nobody nowhere neither nor without".split()) # Plus "cannot" / "...n't" as "not"
+_WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+def _stem(term):
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if len(term) > len(suffix) + 3 and term.endswith(suffix):
+            return term[:-len(suffix)]
+    return term
+
+
+def _terms(text):
+    return [_stem(t) for t in content_terms(text)]
+
+
+def _negations(text):
+    """Negation words in the text ("not", "never", "doesn't", ...); content_terms drops them as stopwords."""
+    words = ("not" if w == "cannot" or w.endswith("n't") else w for w in _WORD_PATTERN.findall((text or "").lower()))
+    return Counter(w for w in words if w in NEGATIONS)
+
+
+class LocalGrader:
+    """
+    Cheap pre-scoring of free-response answers against the suggested answer, so only unclear cases
+    cost an LLM call.
+
+    Features (each 0..1):
+    - overlap: share of the suggested answer's terms that appear in the student answer.
+    - bm25: BM25 with the student answer as the document and the suggested answer as the query,
+      normalized by the best achievable score. Length normalization penalizes keyword-stuffed
+      answers; terms that merely repeat the question get a lower IDF-style weight.
+    - embedding (optional): cosine similarity from a small sentence-transformers model. Suggested
+      answer embeddings are cached. Skipped if the package or model isn't available.
+
+    An answer identical to the suggested one (after normalization) is 'exact' and an empty one
+    'blank'; answers without content terms (numbers, short words, other scripts) are 'uncertain'.
+    Otherwise the embedding similarity has to confirm any local decision, since bag-of-words features
+    can't see word order ("converts glucose into light" vs "converts light into glucose") or synonyms
+    ("CO2"): the answer scores 1.0 when both it and the weighted mean are >= accept_threshold (and the
+    answer isn't keyword stuffing or negated differently than the suggested answer), 0.0 when both are
+    <= reject_threshold. Anything else, and everything without an embedding model, is 'uncertain'.
+    """
+
+    def __init__(self, accept_threshold=0.9, reject_threshold=0.05, embedding_model=None, cache_size=1024,
+                 k1=1.2, b=0.75, enabled=True):
+        self.configure(accept_threshold, reject_threshold, embedding_model, cache_size, k1, b, enabled)
+
+    def configure(self, accept_threshold=0.9, reject_threshold=0.05, embedding_model=None, cache_size=1024,
+                  k1=1.2, b=0.75, enabled=True):
+        self.accept_threshold = accept_threshold
+        self.reject_threshold = reject_threshold
+        self.embedding_model_name = embedding_model or None
+        self.k1 = k1
+        self.b = b
+        self.enabled = enabled
+        self._model = None
+        self._model_failed = False
+        self._model_lock = threading.Lock()
+        self._embeddings = LRUCache(max_size=cache_size)
+        self._decisions = Counter()
+
+    def init_app(self, app):
+        self.configure(
+            accept_threshold=app.config.get('LOCAL_GRADER_ACCEPT_THRESHOLD', 0.9),
+            reject_threshold=app.config.get('LOCAL_GRADER_REJECT_THRESHOLD', 0.05),
+            embedding_model=app.config.get('LOCAL_GRADER_EMBEDDING_MODEL'),
+            cache_size=app.config.get('LOCAL_GRADER_EMBEDDING_CACHE_SIZE', 1024),
+            enabled=app.config.get('LOCAL_GRADER_ENABLED', True),
+        )
+
+    # --- Scoring ---
+    def grade(self, question_text, suggested_answer, user_answer):
+        """Returns a LocalGrade. Callers should only use `score` when decision != 'uncertain'."""
+        normalized = normalize_fib_answer(user_answer or "")
+        answer_terms = _terms(user_answer)
+        suggested_terms = _terms(suggested_answer)
+        features = {}
+
+        if normalized and suggested_answer and normalized == normalize_fib_answer(suggested_answer):
+            result = LocalGrade('exact', 1.0, 1.0, features)
+        elif not (user_answer or "").strip():
+            result = LocalGrade('blank', 0.0, 0.0, features)
+        elif not answer_terms or not suggested_terms: # Nothing lexical to compare
+            result = LocalGrade('uncertain', None, None, features)
+        else:
+            question_terms = set(_terms(question_text))
+            features["overlap"] = self._overlap(answer_terms, suggested_terms)
+            features["bm25"] = self._bm25(answer_terms, suggested_terms, question_terms)
+            similarity = self._embedding_similarity(suggested_answer, user_answer)
+            if similarity is not None:
+                features["embedding"] = similarity
+            combined = (sum(FEATURE_WEIGHTS[name] * value for name, value in features.items())
+                        / sum(FEATURE_WEIGHTS[name] for name in features))
+            if similarity is None: # Lexical features alone never decide
+                result = LocalGrade('uncertain', None, combined, features)
+            elif (min(combined, similarity) >= self.accept_threshold
+                    and self._acceptable(answer_terms, suggested_answer, user_answer)):
+                result = LocalGrade('match', 1.0, combined, features)
+            elif max(combined, similarity) <= self.reject_threshold:
+                result = LocalGrade('unrelated', 0.0, combined, features)
+            else:
+                result = LocalGrade('uncertain', None, combined, features)
+
+        self._record(result)
+        return result
+
+    @staticmethod
+    def _overlap(answer_terms, suggested_terms):
+        expected = set(suggested_terms)
+        return len(expected & set(answer_terms)) / len(expected)
+
+    def _bm25(self, answer_terms, suggested_terms, question_terms):
+        tf = Counter(answer_terms)
+        # The suggested answer's length stands in for the average document length
+        length_norm = 1 - self.b + self.b * len(answer_terms) / max(len(suggested_terms), 1)
+        score = best = 0.0
+        for term in set(suggested_terms):
+            weight = QUESTION_TERM_WEIGHT if term in question_terms else 1.0
+            best += weight # tf=1 in an answer of average length scores exactly `weight`
+            if tf[term]:
+                score += weight * tf[term] * (self.k1 + 1) / (tf[term] + self.k1 * length_norm)
+        return min(score / best, 1.0) if best else 0.0
+
+    @staticmethod
+    def _acceptable(answer_terms, suggested_answer, user_answer):
+        """A high-scoring answer is accepted only if it isn't keyword stuffing and keeps the suggested answer's negations."""
+        if len(set(answer_terms)) < MIN_DISTINCT_RATIO * len(answer_terms):
+            return False
+        return _negations(user_answer) == _negations(suggested_answer)
+
+    # --- Optional Embeddings ---
+    def _get_model(self):
+        if not self.embedding_model_name or self._model_failed:
+            return None
+        with self._model_lock:
+            if self._model is None and not self._model_failed:
+                try:
+                    from sentence_transformers import SentenceTransformer # Optional dependency
+                    self._model = SentenceTransformer(self.embedding_model_name, device='cpu')
+                except Exception as e:
+                    print(f"Local grader: embedding model '{self.embedding_model_name}' unavailable ({e}); using lexical features only.")
+                    self._model_failed = True
+            return self._model
+
+    def _embed_suggested(self, model, suggested_answer):
+        key = hashlib.sha256(suggested_answer.encode('utf-8')).hexdigest()
+        embedding = self._embeddings.get(key)
+        if embedding is None:
+            embedding = model.encode(suggested_answer, normalize_embeddings=True)
+            self._embeddings.set(key, embedding)
+        return embedding
+
+    def _embedding_similarity(self, suggested_answer, user_answer):
+        model = self._get_model()
+        if model is None:
+            return None
+        try:
+            suggested = self._embed_suggested(model, suggested_answer)
+            answer = model.encode(user_answer, normalize_embeddings=True)
+            return max(0.0, min(1.0, float(suggested @ answer)))
+        except Exception as e:
+            print(f"Local grader: embedding failed ({e}); using lexical features only.")
+            return None
+
+    # --- Stats ---
+    def _record(self, result):
+        self._decisions[result.decision] += 1
+        try:
+            LOCAL_GRADER_DECISIONS.labels(result.decision).inc()
+            if result.combined is not None:
+                LOCAL_GRADER_SCORES.labels(result.decision).observe(result.combined)
+        except Exception as e: # Metrics must never break grading
+            print(f"Could not record local grader telemetry: {e}")
+
+    def stats(self):
+        decisions = dict(self._decisions)
+        total = sum(decisions.values())
+        decisions["escalation_rate"] = self._decisions['uncertain'] / total if total else 0.0
+        return {"decisions": decisions, "embeddings": self._embeddings.stats()}
+
+
+local_grader = LocalGrader()
@@ -0,0 +1,29 @@
+"""Add theme_stylesheet table
+
+Revision ID: 0b5e2c8a4f61
+Revises: f3a7d9b1c5e8
+Create Date: 2026-10-18 16:48:27.911350
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5e2c8a4f61'
+down_revision = 'f3a7d9b1c5e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('theme_stylesheet',
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('css', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('content_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('theme_stylesheet')
@@ -0,0 +1,46 @@
+"""Add indexes for the hot foreign-key and ordering queries
+
+Revision ID: 1c9f4e7a2b30
+Revises: 0b5e2c8a4f61
+Create Date: 2026-10-18 17:21:05.662913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c9f4e7a2b30'
+down_revision = '0b5e2c8a4f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('test_definition', schema=None) as batch_op:
+        batch_op.create_index('ix_test_definition_user_id_timestamp', ['user_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.create_index('ix_question_test_definition_id_question_index', ['test_definition_id', 'question_index'], unique=False)
+
+    with op.batch_alter_table('attempt', schema=None) as batch_op:
+        batch_op.create_index('ix_attempt_test_definition_id_is_complete', ['test_definition_id', 'is_complete'], unique=False)
+        batch_op.create_index('ix_attempt_user_id_test_definition_id_completed', ['user_id', 'test_definition_id', 'timestamp_completed'], unique=False)
+
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_answer_question_id'), ['question_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_answer_question_id'))
+
+    with op.batch_alter_table('attempt', schema=None) as batch_op:
+        batch_op.drop_index('ix_attempt_user_id_test_definition_id_completed')
+        batch_op.drop_index('ix_attempt_test_definition_id_is_complete')
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index('ix_question_test_definition_id_question_index')
+
+    with op.batch_alter_table('test_definition', schema=None) as batch_op:
+        batch_op.drop_index('ix_test_definition_user_id_timestamp')
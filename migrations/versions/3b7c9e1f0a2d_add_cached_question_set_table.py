@@ -0,0 +1,33 @@
+"""Add cached_question_set table
+
+Revision ID: 3b7c9e1f0a2d
+Revises: 22a5aede0563
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c9e1f0a2d'
+down_revision = '22a5aede0563'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cached_question_set',
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('questions_json', sa.Text(), nullable=False),
+    sa.Column('model', sa.String(length=50), nullable=True),
+    sa.Column('prompt_version', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.Column('hit_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('cache_key')
+    )
+
+
+def downgrade():
+    op.drop_table('cached_question_set')
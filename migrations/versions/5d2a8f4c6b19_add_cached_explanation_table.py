@@ -0,0 +1,41 @@
+"""Add cached_explanation table and answer.explanation_id
+
+Revision ID: 5d2a8f4c6b19
+Revises: 3b7c9e1f0a2d
+Create Date: 2026-10-18 10:03:15.472916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a8f4c6b19'
+down_revision = '3b7c9e1f0a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cached_explanation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('question_id', sa.String(length=36), nullable=False),
+    sa.Column('answer_hash', sa.String(length=64), nullable=False),
+    sa.Column('is_correct', sa.Boolean(), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('hit_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('question_id', 'answer_hash', 'is_correct', name='_explanation_key_uc')
+    )
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('explanation_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_answer_explanation_id', 'cached_explanation', ['explanation_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('answer', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_answer_explanation_id', type_='foreignkey')
+        batch_op.drop_column('explanation_id')
+    op.drop_table('cached_explanation')
@@ -0,0 +1,43 @@
+"""Add denormalized counters to test_definition
+
+Revision ID: 6a2d8e0f4c17
+Revises: 1c9f4e7a2b30
+Create Date: 2026-10-18 18:03:44.208736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2d8e0f4c17'
+down_revision = '1c9f4e7a2b30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('test_definition', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('question_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('attempt_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('completed_attempt_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('best_score', sa.Float(), nullable=True))
+
+    # Backfill from existing rows (same as `flask backfill-test-counters`)
+    op.execute("""
+        UPDATE test_definition SET
+            question_count = (SELECT COUNT(*) FROM question WHERE question.test_definition_id = test_definition.id),
+            attempt_count = (SELECT COUNT(*) FROM attempt WHERE attempt.test_definition_id = test_definition.id),
+            completed_attempt_count = (SELECT COUNT(*) FROM attempt
+                                       WHERE attempt.test_definition_id = test_definition.id AND attempt.is_complete),
+            best_score = (SELECT MAX(attempt.total_score) FROM attempt
+                          WHERE attempt.test_definition_id = test_definition.id AND attempt.is_complete)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('test_definition', schema=None) as batch_op:
+        batch_op.drop_column('best_score')
+        batch_op.drop_column('completed_attempt_count')
+        batch_op.drop_column('attempt_count')
+        batch_op.drop_column('question_count')
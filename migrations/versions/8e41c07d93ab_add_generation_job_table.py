@@ -0,0 +1,44 @@
+"""Add generation_job table
+
+Revision ID: 8e41c07d93ab
+Revises: 5d2a8f4c6b19
+Create Date: 2026-10-18 11:26:51.903317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41c07d93ab'
+down_revision = '5d2a8f4c6b19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generation_job',
+    sa.Column('id', sa.String(length=36), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('title', sa.String(length=200), nullable=True),
+    sa.Column('num_questions', sa.Integer(), nullable=False),
+    sa.Column('source_text', sa.Text(), nullable=True),
+    sa.Column('source_pdf', sa.LargeBinary(), nullable=True),
+    sa.Column('source_filename', sa.String(length=255), nullable=True),
+    sa.Column('test_definition_id', sa.String(length=36), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('notices_json', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['test_definition_id'], ['test_definition.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generation_job_status_created_at', 'generation_job', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_generation_job_status_created_at', table_name='generation_job')
+    op.drop_table('generation_job')
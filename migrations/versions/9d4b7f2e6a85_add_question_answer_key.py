@@ -0,0 +1,27 @@
+"""Add question.answer_key_json
+
+Revision ID: 9d4b7f2e6a85
+Revises: 6a2d8e0f4c17
+Create Date: 2026-10-18 19:10:58.734102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b7f2e6a85'
+down_revision = '6a2d8e0f4c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows are compiled by `flask compile-answer-keys` (until then they compile on read)
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('answer_key_json', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_column('answer_key_json')
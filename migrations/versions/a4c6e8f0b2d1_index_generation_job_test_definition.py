@@ -0,0 +1,26 @@
+"""Index generation_job.test_definition_id
+
+Revision ID: a4c6e8f0b2d1
+Revises: 8e41c07d93ab
+Create Date: 2026-10-18 14:02:37.418220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c6e8f0b2d1'
+down_revision = '8e41c07d93ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('generation_job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_generation_job_test_definition_id'), ['test_definition_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generation_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_generation_job_test_definition_id'))
@@ -0,0 +1,31 @@
+"""Add circuit_breaker_state table
+
+Revision ID: c7d1e5a9f3b0
+Revises: a4c6e8f0b2d1
+Create Date: 2026-10-18 15:21:09.533107
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d1e5a9f3b0'
+down_revision = 'a4c6e8f0b2d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('circuit_breaker_state',
+    sa.Column('scope', sa.String(length=80), nullable=False),
+    sa.Column('state', sa.String(length=10), nullable=False),
+    sa.Column('failure_count', sa.Integer(), nullable=False),
+    sa.Column('opened_at', sa.Float(), nullable=True),
+    sa.Column('updated_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+    )
+
+
+def downgrade():
+    op.drop_table('circuit_breaker_state')
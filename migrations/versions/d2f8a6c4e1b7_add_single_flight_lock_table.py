@@ -0,0 +1,29 @@
+"""Add single_flight_lock table
+
+Revision ID: d2f8a6c4e1b7
+Revises: c7d1e5a9f3b0
+Create Date: 2026-10-18 16:04:52.118940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f8a6c4e1b7'
+down_revision = 'c7d1e5a9f3b0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('single_flight_lock',
+    sa.Column('key', sa.String(length=120), nullable=False),
+    sa.Column('owner', sa.String(length=64), nullable=False),
+    sa.Column('expires_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('single_flight_lock')
@@ -0,0 +1,26 @@
+"""Add question.option_explanations_json
+
+Revision ID: e9b3c1d7a5f2
+Revises: d2f8a6c4e1b7
+Create Date: 2026-10-18 17:12:40.602381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b3c1d7a5f2'
+down_revision = 'd2f8a6c4e1b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('option_explanations_json', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_column('option_explanations_json')
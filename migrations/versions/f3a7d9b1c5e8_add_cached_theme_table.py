@@ -0,0 +1,34 @@
+"""Add cached_theme table
+
+Revision ID: f3a7d9b1c5e8
+Revises: e9b3c1d7a5f2
+Create Date: 2026-10-18 16:05:12.304518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7d9b1c5e8'
+down_revision = 'e9b3c1d7a5f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cached_theme',
+    sa.Column('cache_key', sa.String(length=64), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=False),
+    sa.Column('css', sa.Text(), nullable=False),
+    sa.Column('model', sa.String(length=50), nullable=True),
+    sa.Column('prompt_version', sa.String(length=20), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.Column('hit_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('cache_key')
+    )
+
+
+def downgrade():
+    op.drop_table('cached_theme')
@@ -38,10 +38,19 @@ class TestDefinition(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     source_text_snippet = db.Column(db.Text, nullable=True)
     title = db.Column(db.String(200), nullable=True, default="Untitled Test")
+    # Denormalized counters, updated in the same transaction as the rows they count (see counters.py)
+    question_count = db.Column(db.Integer, default=0, nullable=False)
+    attempt_count = db.Column(db.Integer, default=0, nullable=False)
+    completed_attempt_count = db.Column(db.Integer, default=0, nullable=False)
+    best_score = db.Column(db.Float, nullable=True) # Best total_score among completed attempts
     questions = db.relationship('Question', backref='test_definition', lazy=True, cascade="all, delete-orphan")
     attempts = db.relationship('Attempt', backref='test_definition', lazy=True, cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_test_definition_user_id_timestamp', 'user_id', 'timestamp'),) # Dashboard: a user's tests, newest first
     @property
-    def question_count(self): return len(self.questions)
+    def active_generation_job(self):
+        """The pending/running job still streaming questions into this test, or None."""
+        return GenerationJob.query.filter(GenerationJob.test_definition_id == self.id,
+                                          GenerationJob.status.in_(('pending', 'running'))).first()
 
 
 class Question(db.Model):
@@ -55,7 +64,11 @@ class Question(db.Model):
     correct_answer_info_json = db.Column(db.Text, nullable=True)
     suggested_answer = db.Column(db.Text, nullable=True)
     hint = db.Column(db.Text, nullable=True)
+    option_explanations_json = db.Column(db.Text, nullable=True) # Multiple choice: one explanation per option, same order as options
+    answer_key_json = db.Column(db.Text, nullable=True) # Compiled AnswerKey (see answer_key.py), set when the question is created
     answers = db.relationship('Answer', backref='question', lazy=True, cascade="all, delete-orphan")
+    cached_explanations = db.relationship('CachedExplanation', backref='question', lazy=True, cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_question_test_definition_id_question_index', 'test_definition_id', 'question_index'),) # A test's questions in order
     @property
     def options(self): return json.loads(self.options_json) if self.options_json else []
     @options.setter
@@ -65,18 +78,36 @@ class Question(db.Model):
     @correct_answer_info.setter
     def correct_answer_info(self, value): self.correct_answer_info_json = json.dumps(value) if value is not None else None
     @property
+    def option_explanations(self): return json.loads(self.option_explanations_json) if self.option_explanations_json else []
+    @option_explanations.setter
+    def option_explanations(self, value): self.option_explanations_json = json.dumps(value) if value else None
+    @property
+    def correct_option_index(self):
+        """Multiple choice: index of the correct option, or None if the stored answer info doesn't match one."""
+        from answer_key import resolve_option_index # Imported here: answer_key depends on utils (PDF / tokenizer libs)
+        return resolve_option_index(self.options, self.correct_answer_info)
+    def compile_answer_key(self):
+        """Stores the compiled grading key; call once options / answer info are set."""
+        from answer_key import AnswerKey # Imported here: answer_key depends on utils (PDF / tokenizer libs)
+        self.answer_key_json = AnswerKey.compile(self.question_type, self.options, self.correct_answer_info, self.suggested_answer).to_json()
+    @property
+    def answer_key(self):
+        """The compiled AnswerKey (compiled on the fly for rows created before answer_key_json existed)."""
+        from answer_key import AnswerKey
+        if self.answer_key_json: return AnswerKey.from_json(self.answer_key_json)
+        return AnswerKey.compile(self.question_type, self.options, self.correct_answer_info, self.suggested_answer)
+    def explanation_for_answer(self, user_input):
+        """Precomputed explanation for a multiple-choice submission (an option index), or None."""
+        if self.question_type != 'multiple_choice' or not self.option_explanations_json: return None
+        try: return self.option_explanations[int(user_input)] or None
+        except (ValueError, TypeError, IndexError): return None
+    @property
     def correct_answer_display(self):
         q_type = self.question_type; info = self.correct_answer_info
         if q_type == 'multiple_choice':
             try:
-                opts = self.options
-                if isinstance(info, int) and 0 <= info < len(opts): return opts[info]
-                elif isinstance(info, str):
-                    if info in opts: return info
-                    info_lower = info.lower()
-                    for opt in opts:
-                        if opt.lower() == info_lower: return opt
-                return "N/A (Invalid Info)"
+                index = self.correct_option_index
+                return self.options[index] if index is not None else "N/A (Invalid Info)"
             except Exception: return "N/A (Error)"
         elif q_type == 'fill_in_the_blank': return str(info) if info is not None else "N/A"
         elif q_type == 'free_response': return self.suggested_answer or "No suggested answer."
@@ -120,6 +151,10 @@ class Attempt(db.Model):
     is_complete = db.Column(db.Boolean, default=False, nullable=False)
     current_question_index = db.Column(db.Integer, default=0, nullable=False)
     answers = db.relationship('Answer', backref='attempt', lazy='dynamic', cascade="all, delete-orphan")
+    __table_args__ = (
+        db.Index('ix_attempt_test_definition_id_is_complete', 'test_definition_id', 'is_complete'), # Best score per test
+        db.Index('ix_attempt_user_id_test_definition_id_completed', 'user_id', 'test_definition_id', 'timestamp_completed'), # Results history
+    )
     @property
     def max_possible_score(self): return float(self.test_definition.question_count) if self.test_definition else 0.0
 
@@ -128,13 +163,109 @@ class Answer(db.Model):
     # ... (Answer definition - keep as is) ...
     id = db.Column(db.Integer, primary_key=True)
     attempt_id = db.Column(db.String(36), db.ForeignKey('attempt.id'), nullable=False)
-    question_id = db.Column(db.String(36), db.ForeignKey('question.id'), nullable=False)
+    question_id = db.Column(db.String(36), db.ForeignKey('question.id'), nullable=False, index=True) # attempt_id is covered by the unique constraint
     user_input = db.Column(db.Text, nullable=True)
     is_correct = db.Column(db.Boolean, nullable=True)
     score = db.Column(db.Float, nullable=True)
-    explanation = db.Column(db.Text, nullable=True)
+    explanation_text = db.Column('explanation', db.Text, nullable=True) # Per-answer text (free response, errors)
+    explanation_id = db.Column(db.Integer, db.ForeignKey('cached_explanation.id'), nullable=True) # Shared cached text
+    cached_explanation = db.relationship('CachedExplanation', lazy=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     __table_args__ = (db.UniqueConstraint('attempt_id', 'question_id', name='_attempt_question_uc'),)
+    @property
+    def explanation(self):
+        if self.explanation_text is None and self.cached_explanation is not None: return self.cached_explanation.text
+        if self.explanation_text is None and self.question is not None: return self.question.explanation_for_answer(self.user_input)
+        return self.explanation_text
+    @explanation.setter
+    def explanation(self, value): self.explanation_text = value
+
+
+class CachedExplanation(db.Model):
+    """One explanation per (question, normalized answer, correctness), referenced by every Answer that matches it."""
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.String(36), db.ForeignKey('question.id'), nullable=False)
+    answer_hash = db.Column(db.String(64), nullable=False)
+    is_correct = db.Column(db.Boolean, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    hit_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    __table_args__ = (db.UniqueConstraint('question_id', 'answer_hash', 'is_correct', name='_explanation_key_uc'),)
+
+
+class CachedQuestionSet(db.Model):
+    """Generated question dicts shared across users, keyed by a hash of the normalized source text and generation params."""
+    cache_key = db.Column(db.String(64), primary_key=True)
+    questions_json = db.Column(db.Text, nullable=False)
+    model = db.Column(db.String(50), nullable=True)
+    prompt_version = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    last_used_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    hit_count = db.Column(db.Integer, default=0, nullable=False)
+    @property
+    def questions(self): return json.loads(self.questions_json)
+
+
+class CachedTheme(db.Model):
+    """Generated CSS themes shared across users, keyed by a hash of the normalized description, model and prompt version."""
+    cache_key = db.Column(db.String(64), primary_key=True)
+    description = db.Column(db.String(200), nullable=False) # Normalized, for inspection
+    css = db.Column(db.Text, nullable=False)
+    model = db.Column(db.String(50), nullable=True)
+    prompt_version = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    last_used_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    hit_count = db.Column(db.Integer, default=0, nullable=False)
+
+
+class ThemeStylesheet(db.Model):
+    """Theme CSS stored under its sha256, served from /theme/<hash>.css (the session only holds the hash)."""
+    content_hash = db.Column(db.String(64), primary_key=True)
+    css = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+
+class GenerationJob(db.Model):
+    """A queued test generation request, processed in the background (see jobs.py)."""
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending / running / complete / failed
+    title = db.Column(db.String(200), nullable=True)
+    num_questions = db.Column(db.Integer, nullable=False, default=5)
+    source_text = db.Column(db.Text, nullable=True)
+    source_pdf = db.Column(db.LargeBinary, nullable=True) # Raw upload; extracted by the job, then cleared
+    source_filename = db.Column(db.String(255), nullable=True)
+    test_definition_id = db.Column(db.String(36), db.ForeignKey('test_definition.id'), nullable=True, index=True) # Set as soon as questions start streaming in
+    error = db.Column(db.Text, nullable=True)
+    notices_json = db.Column(db.Text, nullable=True) # [[category, message], ...] flashed when the user picks up the result
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_generation_job_status_created_at', 'status', 'created_at'),)
+    @property
+    def notices(self): return json.loads(self.notices_json) if self.notices_json else []
+    @notices.setter
+    def notices(self, value): self.notices_json = json.dumps(value) if value else None
+    @property
+    def is_finished(self): return self.status in ('complete', 'failed')
+
+
+class CircuitBreakerState(db.Model):
+    """Circuit breaker state per scope ('provider:openai', 'key:<sha256>'), shared by all workers (see circuit_breaker.py)."""
+    __tablename__ = 'circuit_breaker_state'
+    scope = db.Column(db.String(80), primary_key=True)
+    state = db.Column(db.String(10), nullable=False, default='closed') # closed / open / half_open
+    failure_count = db.Column(db.Integer, nullable=False, default=0) # Consecutive failures
+    opened_at = db.Column(db.Float, nullable=True) # Epoch seconds the circuit opened (or the half-open probe started)
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+class SingleFlightLock(db.Model):
+    """Cross-worker lock for one in-progress computation, e.g. 'hint:<question_id>' (see single_flight.py)."""
+    __tablename__ = 'single_flight_lock'
+    key = db.Column(db.String(120), primary_key=True)
+    owner = db.Column(db.String(64), nullable=False) # '<pid>:<uuid>' of the leader
+    expires_at = db.Column(db.Float, nullable=False) # Epoch seconds; an expired lock can be taken over
 
 
 # --- Factory Function (Keep at the end) ---
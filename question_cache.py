@@ -0,0 +1,154 @@
+# question_cache.py
+import json
+from cache import LRUCache
+from models import Question
+from answer_key import AnswerKey
+
+
+class QuestionSnapshot:
+    """
+    Read-only copy of a Question with the answer key already resolved. Exposes the attributes
+    and helpers view_question, check_answer_logic and the templates use, so it can stand in for
+    the model in the answer loop.
+    """
+    __slots__ = ('id', 'question_index', 'text', 'question_type', 'options', 'correct_answer_info',
+                 'correct_option_index', 'correct_answer_display', 'suggested_answer', 'hint',
+                 'option_explanations', 'answer_key')
+    FIELDS = __slots__
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+        self.options = tuple(self.options or ())
+        self.option_explanations = tuple(self.option_explanations or ())
+        if isinstance(self.answer_key, str): # From the shared tier
+            self.answer_key = AnswerKey.from_json(self.answer_key)
+
+    @classmethod
+    def from_question(cls, question):
+        answer_key = question.answer_key
+        return cls(id=question.id, question_index=question.question_index, text=question.text,
+                   question_type=question.question_type, options=question.options,
+                   correct_answer_info=question.correct_answer_info, correct_option_index=answer_key.correct_index,
+                   correct_answer_display=answer_key.display, suggested_answer=question.suggested_answer,
+                   hint=question.hint, option_explanations=question.option_explanations, answer_key=answer_key)
+
+    def to_dict(self):
+        values = {name: getattr(self, name) for name in self.FIELDS}
+        values["answer_key"] = self.answer_key.to_json()
+        return values
+
+    def explanation_for_answer(self, user_input):
+        """Same as Question.explanation_for_answer."""
+        if self.question_type != 'multiple_choice' or not self.option_explanations: return None
+        try: return self.option_explanations[int(user_input)] or None
+        except (ValueError, TypeError, IndexError): return None
+
+
+class QuestionSnapshotCache:
+    """
+    Read-through cache of a test's questions (a tuple of QuestionSnapshot, in question_index order).
+
+    Questions don't change once stored, except for new questions streaming in (the entry is
+    tagged with TestDefinition.question_count, so a count change is a miss) and hints / option
+    explanations written later (writers call invalidate()).
+
+    Tier 1 is an in-process LRU whose short `local_ttl` bounds how long another worker's copy can
+    miss a later hint. Tier 2 (optional, QUESTION_SNAPSHOT_REDIS_URL) is shared by all workers
+    and cleared by invalidate().
+    """
+    SHARED_PREFIX = 'qsnap:'
+
+    def __init__(self, memory_size=512, local_ttl=60, shared_ttl=3600, redis_url=None):
+        self.configure(memory_size, local_ttl, shared_ttl, redis_url)
+
+    def configure(self, memory_size=512, local_ttl=60, shared_ttl=3600, redis_url=None):
+        self.memory = LRUCache(max_size=memory_size, ttl=local_ttl)
+        self.shared_ttl = shared_ttl
+        self.redis_url = redis_url or None
+        self._redis = None
+        self._redis_failed = False
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    def init_app(self, app):
+        self.configure(
+            memory_size=app.config.get('QUESTION_SNAPSHOT_CACHE_SIZE', 512),
+            local_ttl=app.config.get('QUESTION_SNAPSHOT_LOCAL_TTL', 60),
+            shared_ttl=app.config.get('QUESTION_SNAPSHOT_SHARED_TTL', 3600),
+            redis_url=app.config.get('QUESTION_SNAPSHOT_REDIS_URL'),
+        )
+
+    def get(self, test_def):
+        """Returns the test's questions as a tuple of snapshots."""
+        cached = self.memory.get(test_def.id)
+        if cached is not None and cached[0] == test_def.question_count:
+            return cached[1]
+
+        snapshots = self._shared_get(test_def)
+        if snapshots is None:
+            questions = Question.query.filter_by(test_definition_id=test_def.id).order_by(Question.question_index).all()
+            snapshots = tuple(QuestionSnapshot.from_question(q) for q in questions)
+            if len(snapshots) != test_def.question_count:
+                return snapshots # A question landed between the two reads; don't tag it with the wrong count
+            self._shared_set(test_def, snapshots)
+        self.memory.set(test_def.id, (test_def.question_count, snapshots))
+        return snapshots
+
+    def invalidate(self, test_definition_id):
+        """Drops a test's snapshots after one of its questions changed (e.g. a hint was stored)."""
+        self.memory.pop(test_definition_id)
+        client = self._shared()
+        if client is not None:
+            try:
+                client.delete(self.SHARED_PREFIX + test_definition_id)
+            except Exception as e:
+                print(f"Could not invalidate shared question snapshots for test {test_definition_id}: {e}")
+
+    # --- Optional Shared Tier ---
+    def _shared(self):
+        if not self.redis_url or self._redis_failed:
+            return None
+        if self._redis is None:
+            try:
+                import redis # Optional dependency
+                self._redis = redis.Redis.from_url(self.redis_url, socket_timeout=0.5)
+            except Exception as e:
+                print(f"Shared question snapshot tier unavailable ({e}); using the per-process cache only.")
+                self._redis_failed = True
+                return None
+        return self._redis
+
+    def _shared_get(self, test_def):
+        client = self._shared()
+        if client is None:
+            return None
+        try:
+            raw = client.get(self.SHARED_PREFIX + test_def.id)
+        except Exception as e:
+            print(f"Shared question snapshot read failed: {e}")
+            return None
+        payload = json.loads(raw) if raw else None
+        if payload is None or payload["question_count"] != test_def.question_count:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        return tuple(QuestionSnapshot(**values) for values in payload["questions"])
+
+    def _shared_set(self, test_def, snapshots):
+        client = self._shared()
+        if client is None:
+            return
+        payload = {"question_count": test_def.question_count, "questions": [s.to_dict() for s in snapshots]}
+        try:
+            client.set(self.SHARED_PREFIX + test_def.id, json.dumps(payload), ex=self.shared_ttl)
+        except Exception as e:
+            print(f"Shared question snapshot write failed: {e}")
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats.update(shared_enabled=self._shared() is not None, shared_hits=self.shared_hits, shared_misses=self.shared_misses)
+        return stats
+
+
+question_snapshots = QuestionSnapshotCache()
@@ -0,0 +1,169 @@
+# retry_policy.py
+import time
+import random
+import asyncio
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError, APIStatusError
+
+
+class RetryDeadlineExceeded(Exception):
+    """Raised when a call could not complete (or even start) before its deadline."""
+    pass
+
+
+def parse_retry_after(error):
+    """Returns the server-requested wait in seconds from Retry-After(-ms) headers, or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try: return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError: pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try: # HTTP-date form
+            return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection errors and 5xx are worth retrying; auth/bad requests/bugs are not."""
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+class RetryState:
+    """Per-call bookkeeping: attempts made, time spent waiting, and the deadline."""
+
+    def __init__(self, max_attempts, deadline):
+        self.max_attempts = max_attempts
+        self.deadline_at = time.monotonic() + deadline if deadline else None
+        self.attempt = 0
+        self.backoff_wait = 0.0
+        self.limiter_wait = 0.0
+
+    def next_attempt(self):
+        if self.attempt >= self.max_attempts or self.remaining() == 0:
+            return False
+        self.attempt += 1
+        return True
+
+    def remaining(self):
+        if self.deadline_at is None:
+            return None
+        return max(0.0, self.deadline_at - time.monotonic())
+
+    def can_wait(self, delay):
+        remaining = self.remaining()
+        return self.attempt < self.max_attempts and (remaining is None or delay < remaining)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, capped at `max_delay`, that honors Retry-After
+    headers and never waits past the per-call `deadline` (seconds).
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0, deadline=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def begin(self, max_attempts=None):
+        return RetryState(max_attempts or self.max_attempts, self.deadline)
+
+    def compute_delay(self, attempt, error=None):
+        retry_after = parse_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter. Callers reserve a token and are told how long to wait for it,
+    so bursts queue up behind each other instead of all hitting the API at once.
+    A rate of None disables limiting.
+    """
+
+    def __init__(self, rate_per_second=None, capacity=10):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, timeout=None):
+        """Takes a token. Returns seconds to wait before using it, or None if that would exceed `timeout`."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                return None
+            self._tokens -= 1 # May go negative: later callers queue behind this one
+            return wait
+
+    def acquire(self, timeout=None):
+        wait = self.reserve(timeout)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, timeout=None):
+        wait = self.reserve(timeout)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class RetryStats:
+    """Process-wide counters for retries and time spent waiting (backoff and rate limiter)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.backoff_wait_seconds = 0.0
+        self.limiter_wait_seconds = 0.0
+
+    def record(self, state, succeeded):
+        with self._lock:
+            self.calls += 1
+            self.attempts += state.attempt
+            self.retries += max(0, state.attempt - 1)
+            self.failures += 0 if succeeded else 1
+            self.backoff_wait_seconds += state.backoff_wait
+            self.limiter_wait_seconds += state.limiter_wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failures": self.failures,
+                "backoff_wait_seconds": round(self.backoff_wait_seconds, 3),
+                "limiter_wait_seconds": round(self.limiter_wait_seconds, 3),
+            }
+
+
+retry_stats = RetryStats()
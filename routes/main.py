@@ -1,54 +1,98 @@
 # routes/main.py
-from flask import Blueprint, render_template, redirect, url_for, session, flash, current_app, request
+from flask import Blueprint, render_template, redirect, url_for, session, flash, current_app, request, Response, abort
 from flask_login import login_required, current_user
-from models import db, TestDefinition, Attempt # Import necessary models
-from api_handler import ChatGPTHandler, APIError, AuthenticationError # Import API Handler
+from sqlalchemy import select, or_, and_
+from models import db, TestDefinition # Import necessary models
+from api_handler import ChatGPTHandler, APIError, AuthenticationError, handler_registry # Import API Handler
+from api_handler import CSS_PROMPT_VERSION
+from generation_cache import theme_cache, theme_stylesheets
+from telemetry import telemetry
 
 bp = Blueprint('main', __name__)
 
+def dashboard_page(user_id, after_id=None, page_size=20):
+    """
+    One page of a user's tests, newest first, with their question count, attempt count and best
+    completed score, in a single statement (the counters are stored on test_definition, see
+    counters.py). Paginated by keyset on (timestamp, id): `after_id` is the last test of the
+    previous page. Returns (rows, next_after_id).
+    """
+    test = TestDefinition.__table__
+    stmt = (select(test.c.id, test.c.title, test.c.timestamp, test.c.question_count,
+                   test.c.attempt_count, test.c.best_score)
+            .where(test.c.user_id == user_id)
+            .order_by(test.c.timestamp.desc(), test.c.id.desc())
+            .limit(page_size + 1)) # One extra row tells us whether there's a next page
+    if after_id:
+        cursor = select(test.c.timestamp).where(test.c.id == after_id, test.c.user_id == user_id).scalar_subquery()
+        stmt = stmt.where(or_(test.c.timestamp < cursor, and_(test.c.timestamp == cursor, test.c.id < after_id)))
+
+    rows = db.session.execute(stmt).all()
+    next_after_id = rows[page_size - 1].id if len(rows) > page_size else None
+    return rows[:page_size], next_after_id
+
 @bp.route('/')
 @login_required # Require login for the main page now
 def index():
-    # Fetch test definitions created by the current user
-    user_tests = TestDefinition.query.filter_by(user_id=current_user.id).order_by(TestDefinition.timestamp.desc()).all()
-
-    display_tests = []
-    for test_def in user_tests:
-        best_score = None
-        max_score = float(test_def.question_count) if test_def.question_count > 0 else 0.0
-        completed_attempts = Attempt.query.filter_by(test_definition_id=test_def.id, is_complete=True).all()
-        if completed_attempts:
-            # Ensure scores are not None before finding max
-            valid_scores = [a.total_score for a in completed_attempts if a.total_score is not None]
-            if valid_scores:
-                best_score = max(valid_scores)
-
-        display_tests.append({
-            'id': test_def.id,
-            'title': test_def.title or "Untitled Test",
-            'timestamp': test_def.timestamp,
-            'question_count': test_def.question_count,
-            'best_score': best_score,
-            'max_possible_score': max_score,
-            'attempt_count': len(test_def.attempts) # Access attempts relationship
-        })
-
-    return render_template('index.html', tests=display_tests)
+    after_id = request.args.get('after')
+    rows, next_after_id = dashboard_page(current_user.id, after_id, current_app.config.get('DASHBOARD_PAGE_SIZE', 20))
+
+    display_tests = [{
+        'id': row.id,
+        'title': row.title or "Untitled Test",
+        'timestamp': row.timestamp,
+        'question_count': row.question_count,
+        'best_score': row.best_score,
+        'max_possible_score': float(row.question_count),
+        'attempt_count': row.attempt_count,
+    } for row in rows]
+
+    return render_template('index.html', tests=display_tests, next_after_id=next_after_id, is_first_page=not after_id)
 
 # --- Theme Routes (moved from app.py, require login) ---
+THEME_CACHE_CONTROL = 'public, max-age=31536000, immutable' # URLs are content hashes, so they never change
+
+def apply_theme(css):
+    """Stores the stylesheet server-side and points the session at it (keeps the cookie small)."""
+    session['theme_hash'] = theme_stylesheets.store(css)
+    session.pop('custom_css', None) # Sessions from before themes were served as files
+
+@bp.route('/theme/<content_hash>.css')
+def theme_stylesheet(content_hash):
+    css = theme_stylesheets.get(content_hash)
+    if css is None:
+        abort(404)
+    response = Response(css, mimetype='text/css')
+    response.set_etag(content_hash)
+    response.headers['Cache-Control'] = THEME_CACHE_CONTROL
+    return response.make_conditional(request) # 304 when If-None-Match matches
+
 @bp.route('/generate_theme', methods=['POST'])
 @login_required
 def generate_theme():
-    # Check if user has API key set
-    if not current_user.api_key_set or not current_user.get_api_key():
-        flash("Please set your OpenAI API key in settings first.", "warning")
-        return redirect(url_for('settings.account_settings')) # Redirect to settings
-
     theme_description = request.form.get('theme_description')
     if not theme_description:
         flash("Please enter a theme description.", "warning")
         return redirect(url_for('settings.account_settings')) # Redirect to settings
 
+    # Popular descriptions ("dark mode") are served from the shared cache without an API call
+    cache_key = theme_cache.make_key(theme_description, handler_registry.model_name, CSS_PROMPT_VERSION)
+    try:
+        cached_css = theme_cache.get(cache_key)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Theme cache lookup failed: {e}")
+        cached_css = None
+    if cached_css is not None:
+        apply_theme(cached_css)
+        flash("CSS theme applied for this session!", "success")
+        return redirect(url_for('settings.account_settings'))
+
+    # Check if user has API key set
+    if not current_user.api_key_set or not current_user.get_api_key():
+        flash("Please set your OpenAI API key in settings first.", "warning")
+        return redirect(url_for('settings.account_settings')) # Redirect to settings
+
     try:
         # Get API key for the current user
         api_key = current_user.get_api_key()
@@ -56,11 +100,14 @@ def generate_theme():
             flash("Could not retrieve your API key.", "danger")
             return redirect(url_for('settings.account_settings'))
 
-        handler = ChatGPTHandler(api_key=api_key)
+        handler = handler_registry.get_handler(api_key) # Reuses pooled client for this key
         css_code = handler.generate_css_theme(theme_description)
-        session['custom_css'] = css_code # Store theme in session
+        theme_cache.set(cache_key, theme_description, css_code, model=handler_registry.model_name,
+                        prompt_version=CSS_PROMPT_VERSION)
+        apply_theme(css_code) # The session only stores the stylesheet's hash
         flash("CSS theme generated and applied for this session!", "success")
     except AuthenticationError:
+        handler_registry.invalidate(current_user.get_api_key())
         flash("API Authentication failed. Please check your API key in settings.", "danger")
         # Optionally clear the invalid key flag for the user in DB?
         # current_user.api_key_set = False
@@ -74,6 +121,16 @@ def generate_theme():
 @bp.route('/clear_theme')
 @login_required
 def clear_theme():
+    session.pop('theme_hash', None)
     session.pop('custom_css', None)
     flash("Custom theme cleared for this session.", "info")
-    return redirect(url_for('settings.account_settings')) # Redirect back to settings page
\ No newline at end of file
+    return redirect(url_for('settings.account_settings')) # Redirect back to settings page
+
+# --- Metrics (Prometheus scrape target, no login) ---
+@bp.route('/metrics')
+def metrics():
+    token = current_app.config.get('METRICS_AUTH_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        abort(403)
+    body, content_type = telemetry.render()
+    return Response(body, content_type=content_type)
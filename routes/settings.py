@@ -1,9 +1,11 @@
 # routes/settings.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session
 from flask_login import login_required, current_user
 from models import db, User
 from forms import SettingsForm, ThemeForm # Define these forms
 from encryption import encrypt_data, decrypt_data
+from api_handler import handler_registry
+from generation_cache import theme_stylesheets
 
 bp = Blueprint('settings', __name__)
 
@@ -20,6 +22,8 @@ def account_settings():
             # handler = ChatGPTHandler(api_key=api_key) # This makes an API call! Careful.
             # Maybe just check format? if not api_key.startswith("sk-"): raise ValueError("Invalid format")
 
+            old_key = current_user.get_api_key()
+            if old_key: handler_registry.invalidate(old_key) # Drop pooled client for the old key
             current_user.set_api_key(api_key) # Encrypts and sets flag
             db.session.commit()
             flash('OpenAI API Key updated successfully!', 'success')
@@ -40,4 +44,5 @@ def account_settings():
                            title='Settings',
                            settings_form=settings_form,
                            theme_form=theme_form,
-                           api_key_status=api_key_status)
\ No newline at end of file
+                           api_key_status=api_key_status,
+                           theme_css=theme_stylesheets.get(session.get('theme_hash')))
\ No newline at end of file
@@ -2,17 +2,24 @@
 import json
 import string
 from datetime import datetime, timezone
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from models import db, User, TestDefinition, Question, Attempt, Answer
-from models import create_question_from_dict
+from sqlalchemy import select
+from models import db, User, TestDefinition, Question, Attempt, Answer, GenerationJob
 from forms import GenerateTestForm # Define this form
-from api_handler import ChatGPTHandler, APIError, AuthenticationError
-from utils import extract_text_from_pdf
+from api_handler import ChatGPTHandler, APIError, AuthenticationError, handler_registry, run_concurrently
+from circuit_breaker import CircuitOpenError, circuit_breaker
+from single_flight import SingleFlightTimeout, hint_flight
+from generation_cache import explanation_cache
+from local_grader import local_grader
+from counters import record_attempt_started, record_attempt_completed
+from question_cache import question_snapshots
+from jobs import create_generation_job, job_runner
 bp = Blueprint('tests', __name__)
 
 # --- Helper: Get API Handler for Current User ---
-def get_user_api_handler():
+def get_user_api_handler(use_async=False):
+    """Returns the pooled handler for the current user (AsyncChatGPTHandler if use_async=True), or None."""
     if not current_user.is_authenticated or not current_user.api_key_set:
         flash("Please log in and set your API key in settings.", "warning")
         return None
@@ -24,7 +31,9 @@ def get_user_api_handler():
         # db.session.commit()
         return None
     try:
-        handler = ChatGPTHandler(api_key=api_key)
+        if use_async:
+            return handler_registry.get_async_handler(api_key)
+        handler = handler_registry.get_handler(api_key) # Pooled client, cached key validation
         return handler
     except ValueError as e: # Handles invalid key format during init
         flash(f"API Key Error: {e}. Please update in settings.", "danger")
@@ -43,37 +52,8 @@ def get_user_api_handler():
 
 # --- Helper: Check Answer Logic (same as before) ---
 def check_answer_logic(question_model, user_input):
-    is_correct = None; score = None
-    q_type = question_model.question_type
-    correct_info = question_model.correct_answer_info # Use property
-
-    if q_type == 'multiple_choice':
-        try:
-            user_choice_index = int(user_input)
-            # Need correct index from stored info
-            opts = question_model.options
-            correct_index = -1
-            if isinstance(correct_info, int) and 0 <= correct_info < len(opts):
-                correct_index = correct_info
-            elif isinstance(correct_info, str):
-                try: correct_index = opts.index(correct_info)
-                except ValueError: pass # Try case insensitive below
-                if correct_index == -1:
-                    try: correct_index = [o.lower() for o in opts].index(correct_info.lower())
-                    except ValueError: pass
-
-            is_correct = (user_choice_index == correct_index) if correct_index != -1 else False
-            score = 1.0 if is_correct else 0.0
-        except (ValueError, TypeError, IndexError): is_correct = False; score = 0.0
-    elif q_type == 'fill_in_the_blank':
-        correct_answer_str = str(correct_info) if correct_info is not None else ""
-        translator = str.maketrans('', '', string.punctuation)
-        processed_user = str(user_input).lower().translate(translator).strip()
-        processed_correct = correct_answer_str.lower().translate(translator).strip()
-        is_correct = (processed_user == processed_correct)
-        score = 1.0 if is_correct else 0.0
-    elif q_type == 'free_response': is_correct = None; score = None # Graded by API later
-    return is_correct, score
+    """Returns (is_correct, score) from the question's compiled answer key; (None, None) for free response."""
+    return question_model.answer_key.grade(user_input)
 
 
 # --- Route to Generate New Test Definition ---
@@ -82,164 +62,51 @@ def check_answer_logic(question_model, user_input):
 def generate_test():
     form = GenerateTestForm()
     if form.validate_on_submit():
-        # --- 1. Get Handler (Checks API Key) ---
-        handler = get_user_api_handler()
-        if not handler:
-            # Handler function already flashes a message
+        # --- 1. Check API Key (the job only builds a handler on a question-cache miss) ---
+        if not current_user.api_key_set:
+            flash("Please log in and set your API key in settings.", "warning")
             return redirect(url_for('settings.account_settings'))
 
-        # --- 2. Initialize Variables ---
-        source_text = None
-        extracted_from_pdf = False # Flag to know the source
-
-        # --- 3. Get Data from Form ---
+        # --- 2. Get Data from Form ---
         text_input_data = form.text_input.data.strip()
         pdf_file_data = form.pdf_file.data # This is a FileStorage object
         num_questions = form.num_questions.data
         title = form.title.data.strip() or "Untitled Test" # Use strip() and default
 
-        # --- 4. Determine Source Text (Text Area or PDF) ---
+        # --- 3. Capture Source (extraction and the LLM call happen in the background job) ---
+        pdf_bytes = None
+        pdf_filename = None
         if text_input_data:
-            source_text = text_input_data
-            current_app.logger.info(f"Using text input for test generation (length: {len(source_text)}).")
+            current_app.logger.info(f"Using text input for test generation (length: {len(text_input_data)}).")
         elif pdf_file_data:
-            current_app.logger.info(f"Processing uploaded PDF: {pdf_file_data.filename}")
-            try:
-                # Check filename extension again just in case
-                if not pdf_file_data.filename or not pdf_file_data.filename.lower().endswith('.pdf'):
-                    flash("Invalid file type uploaded. Please upload a PDF.", "warning")
-                    return render_template('tests/generate.html', form=form)
-
-                # Attempt PDF extraction
-                extracted_text = extract_text_from_pdf(pdf_file_data.stream)
-
-                if not extracted_text or not extracted_text.strip():
-                    flash("Could not extract any readable text from the PDF. It might be empty, image-based, or corrupted.", "danger")
-                    return render_template('tests/generate.html', form=form)
-
-                source_text = extracted_text.strip()
-                extracted_from_pdf = True
-                current_app.logger.info(f"Extracted {len(source_text)} characters from PDF.")
-
-            except Exception as e:
-                current_app.logger.error(f"Error processing PDF file '{pdf_file_data.filename}': {e}", exc_info=True) # Log full traceback
-                flash(f"An unexpected error occurred while processing the PDF file.", "danger")
+            # Check filename extension again just in case
+            if not pdf_file_data.filename or not pdf_file_data.filename.lower().endswith('.pdf'):
+                flash("Invalid file type uploaded. Please upload a PDF.", "warning")
                 return render_template('tests/generate.html', form=form)
+            pdf_bytes = pdf_file_data.read()
+            pdf_filename = pdf_file_data.filename
+            current_app.logger.info(f"Queued uploaded PDF: {pdf_filename} ({len(pdf_bytes)} bytes)")
         else:
             # This case should theoretically be caught by form.validate_on_submit()
             # but we add it as a safeguard.
             flash("No source material provided. Please paste text or upload a PDF.", "warning")
             return render_template('tests/generate.html', form=form)
 
-        # --- 5. Check if source_text is valid after processing ---
-        if not source_text:
-            # This might happen if PDF extraction yielded only whitespace
-            flash("Source material appears to be empty after processing.", "danger")
-            return render_template('tests/generate.html', form=form)
-
-        # --- 6. Limit Text Length ---
-        MAX_TEXT_LENGTH = 8000 # Consider making this configurable
-        original_length = len(source_text)
-        if original_length > MAX_TEXT_LENGTH:
-            source_text = source_text[:MAX_TEXT_LENGTH]
-            flash(f"Source text was long ({original_length} chars) and has been truncated to {MAX_TEXT_LENGTH} characters for processing.", "info")
-            current_app.logger.info(f"Truncated source text from {original_length} to {len(source_text)} chars.")
-
-        # --- 7. Call API and Process Results ---
+        # --- 4. Queue the Job and Return Immediately ---
         try:
-            current_app.logger.info(f"Requesting {num_questions} questions from API for test '{title}'...")
-            generated_q_dicts = handler.generate_questions(source_text, num_questions=num_questions)
-
-            if not generated_q_dicts: # Checks for None or empty list
-                flash("The AI did not return any questions based on the provided text. Try different text or simplify the request.", "warning")
-                current_app.logger.warning(f"API returned no questions for test '{title}'.")
-                return render_template('tests/generate.html', form=form)
-
-            current_app.logger.info(f"API returned {len(generated_q_dicts)} potential questions.")
-
-            # --- Create DB Objects ---
-            valid_questions_created = 0
-            new_test_def = TestDefinition(
-                user_id=current_user.id,
-                source_text_snippet=source_text[:300], # Store slightly longer snippet
-                title=title
-            )
-            # Add *before* the loop in case of errors during question processing
-            db.session.add(new_test_def)
-            db.session.flush()
-
-            # Process each dictionary from the API
-            for i, q_data in enumerate(generated_q_dicts):
-                try:
-                    # Use the factory function (imported from utils)
-                    q_obj = create_question_from_dict(q_data)
-
-                    # Create the Question DB model instance
-                    new_question = Question(
-                        # test_definition=new_test_def, # Can assign relationship directly
-                        test_definition_id=new_test_def.id, # Or assign FK after flush
-                        question_index=i,
-                        text=q_obj.text,
-                        question_type=q_obj.question_type,
-                        hint=getattr(q_obj, 'hint', None)
-                    )
-                    # Store type-specific info
-                    if q_obj.question_type == 'multiple_choice':
-                        new_question.options = q_obj.options # Uses JSON setter
-                        new_question.correct_answer_info = q_obj.correct_answer_index # Uses JSON setter
-                    elif q_obj.question_type == 'fill_in_the_blank':
-                        new_question.correct_answer_info = q_obj.correct_answer # Uses JSON setter
-                    elif q_obj.question_type == 'free_response':
-                        new_question.suggested_answer = q_obj.suggested_answer
-
-                    db.session.add(new_question)
-                    valid_questions_created += 1
-
-                except ValueError as e:
-                    current_app.logger.warning(f"Skipping question {i+1} for test '{title}' due to parsing error: {e}. Data: {q_data}")
-                except Exception as e:
-                    # Catch any other unexpected errors during object creation
-                    current_app.logger.error(f"Unexpected error creating question object {i+1} for test '{title}': {e}. Data: {q_data}", exc_info=True)
-                    # Continue processing other questions
-
-            # --- Final Checks and Commit ---
-            if valid_questions_created == 0:
-                # If API returned data but NONE could be processed
-                flash("API returned data, but no valid questions could be processed into the required format. Please check the source text or try again.", "danger")
-                db.session.rollback() # Rollback test definition creation
-                current_app.logger.error(f"Failed to process any questions for test '{title}' after API returned {len(generated_q_dicts)} items.")
-                return render_template('tests/generate.html', form=form)
-
-            # Commit changes (TestDefinition and all valid Questions)
+            job = create_generation_job(current_user.id, title, num_questions,
+                                        source_text=text_input_data or None,
+                                        pdf_bytes=pdf_bytes, pdf_filename=pdf_filename)
             db.session.commit()
-            current_app.logger.info(f"Successfully created test '{title}' (ID: {new_test_def.id}) with {valid_questions_created} questions for user {current_user.id}.")
-            flash(f"Successfully generated test '{title}' with {valid_questions_created} questions!", "success")
-
-            # Report if some questions were skipped
-            if valid_questions_created < len(generated_q_dicts):
-                skipped_count = len(generated_q_dicts) - valid_questions_created
-                flash(f"Warning: {skipped_count} item(s) returned by the API could not be processed due to formatting issues.", "warning")
-
-            # Redirect to start the first attempt
-            return redirect(url_for('tests.start_attempt', test_id=new_test_def.id))
-
-        # --- Error Handling for API call or DB operations ---
-        except AuthenticationError:
-            # This specific error should ideally be caught by get_user_api_handler now
-            flash("Authentication failed with OpenAI. Please check your API key in settings.", "danger")
-            db.session.rollback() # Rollback any potential partial adds
-            return redirect(url_for('settings.account_settings')) # Go to settings
-        except (APIError, ValueError) as e: # Catch specific API/Value errors
-            db.session.rollback()
-            flash(f"Error during question generation: {e}", "danger")
-            current_app.logger.error(f"API/Value error during question gen for user {current_user.id}: {e}")
-        except Exception as e: # Catch unexpected errors during the process
+        except Exception as e:
             db.session.rollback()
             flash(f"An unexpected error occurred during test generation. Please try again.", "danger")
-            current_app.logger.error(f"Unexpected error in generate_test for user {current_user.id}: {e}", exc_info=True)
+            current_app.logger.error(f"Could not queue generation job for user {current_user.id}: {e}", exc_info=True)
+            return render_template('tests/generate.html', form=form)
 
-        # If any exception occurred, re-render form
-        return render_template('tests/generate.html', form=form)
+        job_runner.submit(job.id)
+        current_app.logger.info(f"Queued generation job {job.id} ({num_questions} questions) for user {current_user.id}.")
+        return redirect(url_for('tests.generation_status', job_id=job.id))
 
     # --- Handle GET request or POST with validation errors ---
     elif request.method == 'POST':
@@ -247,6 +114,48 @@ def generate_test():
         current_app.logger.warning(f"Test generation form validation failed: {form.errors}")
 
     return render_template('tests/generate.html', form=form)
+# --- Generation Job Status ---
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def generation_status(job_id):
+    job = GenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if job.status == 'complete':
+        return redirect(url_for('tests.finish_generation', job_id=job.id))
+    return render_template('tests/generation_status.html', job=job)
+
+
+@bp.route('/jobs/<job_id>/status', methods=['GET'])
+@login_required
+def generation_status_json(job_id):
+    job = GenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if not job.is_finished:
+        job_runner.recover_stale_jobs() # The pool that had this job may have died with its web worker
+    payload = {"id": job.id, "status": job.status, "error": job.error, "questions_ready": 0}
+    if job.status == 'complete':
+        payload["redirect_url"] = url_for('tests.finish_generation', job_id=job.id)
+    elif job.status == 'running' and job.test_definition_id:
+        # Streaming generation: start as soon as the first question is stored
+        payload["questions_ready"] = db.session.execute(select(TestDefinition.question_count)
+                                                        .where(TestDefinition.id == job.test_definition_id)).scalar() or 0
+        if payload["questions_ready"]:
+            payload["redirect_url"] = url_for('tests.start_attempt', test_id=job.test_definition_id)
+    return jsonify(payload)
+
+
+@bp.route('/jobs/<job_id>/finish', methods=['GET'])
+@login_required
+def finish_generation(job_id):
+    job = GenerationJob.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    if job.status != 'complete' or not job.test_definition_id:
+        return redirect(url_for('tests.generation_status', job_id=job.id))
+    for category, message in job.notices:
+        flash(message, category)
+    job.notices = None # Only flash once
+    db.session.commit()
+    # Redirect to start the first attempt
+    return redirect(url_for('tests.start_attempt', test_id=job.test_definition_id))
+
+
 # --- Route to Start a New Attempt ---
 @bp.route('/<test_id>/start', methods=['GET']) # Changed to GET for link simplicity
 @login_required
@@ -259,6 +168,7 @@ def start_attempt(test_id):
         user_id=current_user.id
     )
     db.session.add(new_attempt)
+    record_attempt_started(test_def.id)
     db.session.commit() # Commit to get the ID
 
     # Store active attempt in session
@@ -275,12 +185,30 @@ def start_attempt(test_id):
 def view_question(attempt_id, question_index):
     attempt = Attempt.query.filter_by(id=attempt_id, user_id=current_user.id).first_or_404()
     test_def = attempt.test_definition # Access via relationship
-    questions = Question.query.filter_by(test_definition_id=test_def.id).order_by(Question.question_index).all()
+    questions = question_snapshots.get(test_def) # Read-only snapshots, cached per test
 
     if attempt.is_complete:
         flash("This attempt is already complete.", "info")
         return redirect(url_for('tests.view_results', attempt_id=attempt.id))
 
+    # Set while questions are still streaming in (see jobs.stream_test_from_job)
+    generation_job = test_def.active_generation_job
+    total_questions = max(len(questions), generation_job.num_questions) if generation_job else len(questions)
+    if question_index == len(questions) == attempt.current_question_index:
+        if generation_job:
+            # Every stored question is answered; wait for the next one
+            return render_template('tests/waiting_for_question.html',
+                                   attempt_id=attempt.id,
+                                   question_index=question_index,
+                                   total_questions=total_questions)
+        # Generation ended (possibly short) after the last answer was saved
+        attempt.is_complete = True
+        attempt.timestamp_completed = datetime.now(timezone.utc)
+        record_attempt_completed(test_def.id, attempt.total_score)
+        db.session.commit()
+        current_app.logger.info(f"Attempt {attempt.id} completed.")
+        return redirect(url_for('tests.view_results', attempt_id=attempt.id))
+
     if not 0 <= question_index < len(questions):
         flash("Invalid question number.", "warning")
         return redirect(url_for('tests.view_question', attempt_id=attempt.id, question_index=attempt.current_question_index))
@@ -304,9 +232,9 @@ def view_question(attempt_id, question_index):
                                    attempt_id=attempt.id,
                                    question_index=question_index,
                                    question=current_question,
-                                   total_questions=len(questions),
+                                   total_questions=total_questions,
                                    answer_details=existing_answer, # Pass DB object
-                                   is_last_question=(question_index == len(questions) - 1))
+                                   is_last_question=(question_index == len(questions) - 1 and not generation_job))
 
         user_input = request.form.get('user_answer')
         if user_input is None:
@@ -316,40 +244,80 @@ def view_question(attempt_id, question_index):
         # --- Check Answer / Grade FR ---
         is_correct, score = check_answer_logic(current_question, user_input)
         explanation = None # Initialize explanation
-
-        handler = get_user_api_handler()
-        if not handler:
+        explanation_id = None # Set when the text comes from (or goes into) the shared explanation cache
+
+        # MC feedback precomputed at test creation is read through Answer.explanation - no LLM call, nothing to cache
+        precomputed_explanation = current_question.explanation_for_answer(user_input)
+        # MC / FIB answers usually repeat across attempts - reuse a stored explanation if we have one
+        explanation_key = explanation_cache.make_key(current_question, user_input, is_correct) if not precomputed_explanation else None
+        cached_explanation = explanation_cache.get(explanation_key) if explanation_key else None
+        if precomputed_explanation:
+            current_app.logger.info(f"Using precomputed option explanation for attempt {attempt.id}, Q {question_id}")
+        elif cached_explanation:
+            explanation_id = cached_explanation[0]
+            current_app.logger.info(f"Explanation cache hit for attempt {attempt.id}, Q {question_id}")
+
+        needs_grading = current_question.question_type == 'free_response'
+        if needs_grading and local_grader.enabled:
+            # Blank, near-identical and clearly unrelated answers are scored locally; only unclear ones go to the LLM
+            local = local_grader.grade(current_question.text, current_question.suggested_answer or "", user_input)
+            features = {name: round(value, 3) for name, value in local.features.items()}
+            current_app.logger.info(f"Local grader for attempt {attempt.id}, Q {question_id}: {local.decision} "
+                                    f"(combined={local.combined if local.combined is None else round(local.combined, 3)}, {features})")
+            if local.decision != 'uncertain':
+                score = local.score
+                needs_grading = False
+        # With streaming on, the page pulls the explanation over SSE after the answer is saved
+        needs_explanation = not (precomputed_explanation or cached_explanation) and not current_app.config.get('STREAM_EXPLANATIONS', True)
+        handler = get_user_api_handler(use_async=True) if (needs_grading or needs_explanation) else None
+        if (needs_grading or needs_explanation) and not handler:
             # Allow proceeding without grading/explanation if handler fails? Or block?
             flash("API Handler unavailable. Cannot grade free response or get explanation.", "warning")
-            if current_question.question_type == 'free_response': score = 0.0 # Default score if no handler
-        else:
-            # Grade FR if applicable
-            if current_question.question_type == 'free_response':
-                try:
-                    current_app.logger.info(f"Grading FR for attempt {attempt.id}, Q {question_id}")
-                    fr_score = handler.grade_free_response(
-                        current_question.text,
-                        current_question.suggested_answer,
-                        user_input
-                    )
-                    score = fr_score
-                except Exception as e:
-                    current_app.logger.error(f"FR Grading error: {e}")
-                    flash(f"Could not grade free response: {e}", "warning")
-                    score = 0.0 # Default score on error
-
-            # Generate Explanation
-            try:
+            if needs_grading: score = 0.0 # Default score if no handler
+        elif handler:
+            # Grading and explanation are independent, so run them concurrently
+            tasks = {}
+            if needs_explanation:
                 current_app.logger.info(f"Generating explanation for attempt {attempt.id}, Q {question_id}")
-                explanation = handler.generate_explanation(
+                tasks['explanation'] = handler.generate_explanation(
                     current_question.text,
                     current_question.correct_answer_display,
                     user_input,
                     is_correct
                 )
-            except Exception as e:
-                current_app.logger.error(f"Explanation error: {e}")
-                explanation = f"Could not generate explanation: {e}"
+            if needs_grading:
+                current_app.logger.info(f"Grading FR for attempt {attempt.id}, Q {question_id}")
+                tasks['score'] = handler.grade_free_response(
+                    current_question.text,
+                    current_question.suggested_answer,
+                    user_input
+                )
+
+            results = dict(zip(tasks.keys(), run_concurrently(*tasks.values())))
+
+            if 'explanation' in results:
+                explanation = results['explanation']
+                if isinstance(explanation, CircuitOpenError):
+                    # Outage: save the answer without an explanation rather than storing an error message
+                    current_app.logger.warning(f"Skipping explanation for attempt {attempt.id}, Q {question_id}: {explanation}")
+                    flash("Explanations are temporarily unavailable. Your answer has been saved.", "info")
+                    explanation = None
+                elif isinstance(explanation, Exception):
+                    current_app.logger.error(f"Explanation error: {explanation}")
+                    explanation = f"Could not generate explanation: {explanation}"
+                elif explanation_key:
+                    stored = explanation_cache.set(explanation_key, explanation)
+                    if stored:
+                        explanation_id = stored[0]
+                        explanation = None # Text lives in the shared cache row
+
+            if 'score' in results:
+                fr_score = results['score']
+                if isinstance(fr_score, Exception):
+                    current_app.logger.error(f"FR Grading error: {fr_score}")
+                    flash(f"Could not grade free response: {fr_score}", "warning")
+                    fr_score = 0.0 # Default score on error
+                score = fr_score
 
 
         # --- Save Answer to DB ---
@@ -359,7 +327,8 @@ def view_question(attempt_id, question_index):
             user_input=user_input,
             is_correct=is_correct,
             score=score if score is not None else 0.0, # Ensure score is not None
-            explanation=explanation
+            explanation=explanation,
+            explanation_id=explanation_id
         )
         db.session.add(new_answer)
 
@@ -367,9 +336,10 @@ def view_question(attempt_id, question_index):
         attempt.current_question_index = question_index + 1
         attempt.total_score += new_answer.score # Add score to total
 
-        if attempt.current_question_index >= len(questions):
+        if attempt.current_question_index >= len(questions) and not generation_job:
             attempt.is_complete = True
             attempt.timestamp_completed = datetime.now(timezone.utc)
+            record_attempt_completed(test_def.id, attempt.total_score) # Rolled back with the answer if the commit fails
             current_app.logger.info(f"Attempt {attempt.id} completed.")
 
         try:
@@ -386,18 +356,40 @@ def view_question(attempt_id, question_index):
                                attempt_id=attempt.id,
                                question_index=question_index,
                                question=current_question,
-                               total_questions=len(questions),
+                               total_questions=total_questions,
                                answer_details=new_answer, # Pass the newly created answer
-                               is_last_question=(question_index == len(questions) - 1))
+                               is_last_question=(question_index == len(questions) - 1 and not generation_job))
 
     # --- GET Request ---
     return render_template('tests/question.html',
                            attempt_id=attempt.id,
                            question_index=question_index,
                            question=current_question,
-                           total_questions=len(questions),
+                           total_questions=total_questions,
                            answer_details=existing_answer, # Pass if already answered
-                           is_last_question=(question_index == len(questions) - 1))
+                           is_last_question=(question_index == len(questions) - 1 and not generation_job))
+
+
+# --- Helper: Fail Fast While the LLM Circuit Is Open ---
+def service_unavailable(error=None):
+    """503 JSON response with Retry-After, for a CircuitOpenError (or a pre-check that found the circuit open)."""
+    retry_after = error.retry_after if error else int(circuit_breaker.recovery_timeout)
+    response = jsonify({"error": "The AI service is temporarily unavailable. Please try again shortly.", "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+
+def circuit_open_response():
+    """Returns service_unavailable() if the current user's key or provider circuit is open, else None."""
+    if current_user.api_key_set and handler_registry.is_circuit_open(current_user.get_api_key()):
+        return service_unavailable()
+    return None
+
+
+def stored_hint(question_id):
+    """Reads Question.hint on its own connection, so hints committed by other workers mid-request are visible."""
+    with db.engine.connect() as conn:
+        return conn.execute(select(Question.hint).where(Question.id == question_id)).scalar()
 
 
 # --- Route to View Results of an Attempt ---
@@ -412,7 +404,7 @@ def view_results(attempt_id):
         return redirect(url_for('tests.view_question', attempt_id=attempt.id, question_index=attempt.current_question_index))
 
     # Fetch questions and their answers for this attempt
-    questions = Question.query.filter_by(test_definition_id=test_def.id).order_by(Question.question_index).all()
+    questions = question_snapshots.get(test_def)
     answers = Answer.query.filter_by(attempt_id=attempt.id).all()
     answers_dict = {ans.question_id: ans for ans in answers} # Map question_id to answer object
 
@@ -459,19 +451,146 @@ def get_hint():
         current_app.logger.info(f"Returning cached hint for Q {question_id}")
         return jsonify({"hint": question.hint})
 
+    unavailable = circuit_open_response()
+    if unavailable: return unavailable
+
     handler = get_user_api_handler()
     if not handler: return jsonify({"error": "API handler unavailable."}), 503 # Service unavailable
 
-    try:
+    def generate_and_store():
         current_app.logger.info(f"Generating hint for Q {question_id}")
         hint_text = handler.generate_hint(question.text)
 
         # Cache hint in DB
         question.hint = hint_text
         db.session.commit()
+        question_snapshots.invalidate(question.test_definition_id)
+        return hint_text
 
+    try:
+        # Concurrent requests for the same question (double-clicks, shared tests) share one LLM call
+        hint_text = hint_flight.run(question_id, generate_and_store, lookup=lambda: stored_hint(question_id))
         return jsonify({"hint": hint_text})
+    except CircuitOpenError as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Hint for Q {question_id} skipped: {e}")
+        return service_unavailable(e)
+    except SingleFlightTimeout as e:
+        current_app.logger.warning(f"Hint for Q {question_id}: {e}")
+        return jsonify({"error": "The hint is taking longer than expected. Please try again."}), 504
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Hint generation error: {e}")
-        return jsonify({"error": f"Error generating hint: {e}"}), 500
\ No newline at end of file
+        return jsonify({"error": f"Error generating hint: {e}"}), 500
+
+# --- Streaming (Server-Sent Events) ---
+def _sse(payload, event=None):
+    """Formats one Server-Sent Event."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+
+def _sse_response(generator):
+    return Response(stream_with_context(generator), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}) # Stop proxies buffering the stream
+
+
+@bp.route('/hint/stream', methods=['GET'])
+@login_required
+def stream_hint():
+    question_id = request.args.get('question_id')
+    if not question_id: return jsonify({"error": "Missing 'question_id'"}), 400
+    question = Question.query.get(question_id)
+    if not question: return jsonify({"error": "Question not found"}), 404
+
+    if question.hint:
+        current_app.logger.info(f"Returning cached hint for Q {question_id} (stream)")
+        return _sse_response(iter([_sse({"text": question.hint}, event='done')]))
+
+    unavailable = circuit_open_response()
+    if unavailable: return unavailable
+
+    handler = get_user_api_handler()
+    if not handler: return jsonify({"error": "API handler unavailable."}), 503
+
+    def generate():
+        parts = []
+        flight = None
+        try:
+            # Only the leader streams from the LLM; coalesced requests get the finished hint in one event
+            flight = hint_flight.acquire(question_id, lookup=lambda: stored_hint(question_id))
+            if not flight.is_leader:
+                yield _sse({"text": flight.value}, event='done')
+                return
+            current_app.logger.info(f"Streaming hint for Q {question_id}")
+            for delta in handler.stream_hint(question.text):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+            hint_text = "".join(parts).strip()
+            question.hint = hint_text # Persist so later clicks are plain DB reads
+            db.session.commit()
+            question_snapshots.invalidate(question.test_definition_id)
+            flight.finish(hint_text)
+            yield _sse({"text": hint_text}, event='done')
+        except CircuitOpenError as e:
+            db.session.rollback()
+            if flight is not None and flight.is_leader: flight.fail(e)
+            current_app.logger.warning(f"Hint stream for Q {question_id} skipped: {e}")
+            yield _sse({"error": str(e), "retry_after": e.retry_after}, event='error')
+        except Exception as e:
+            db.session.rollback()
+            if flight is not None and flight.is_leader: flight.fail(e)
+            current_app.logger.error(f"Hint streaming error: {e}")
+            yield _sse({"error": f"Error generating hint: {e}"}, event='error')
+        finally:
+            if flight is not None and flight.is_leader and not flight.done: # Client disconnected mid-stream
+                flight.fail(RuntimeError("Hint generation was interrupted. Please try again."))
+
+    return _sse_response(generate())
+
+
+@bp.route('/attempt/<attempt_id>/question/<question_id>/explanation/stream', methods=['GET'])
+@login_required
+def stream_explanation(attempt_id, question_id):
+    attempt = Attempt.query.filter_by(id=attempt_id, user_id=current_user.id).first_or_404()
+    answer = Answer.query.filter_by(attempt_id=attempt.id, question_id=question_id).first_or_404()
+    question = answer.question
+
+    if answer.explanation:
+        return _sse_response(iter([_sse({"text": answer.explanation}, event='done')]))
+
+    unavailable = circuit_open_response()
+    if unavailable: return unavailable
+
+    handler = get_user_api_handler()
+    if not handler: return jsonify({"error": "API handler unavailable."}), 503
+
+    def generate():
+        parts = []
+        try:
+            current_app.logger.info(f"Streaming explanation for attempt {attempt.id}, Q {question_id}")
+            for delta in handler.stream_explanation(question.text, question.correct_answer_display,
+                                                    answer.user_input, answer.is_correct):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+            explanation = handler._clean_explanation("".join(parts).strip())
+
+            # Persist: shared cache row for MC/FIB, otherwise on the Answer itself
+            explanation_key = explanation_cache.make_key(question, answer.user_input, answer.is_correct)
+            stored = explanation_cache.set(explanation_key, explanation) if explanation_key else None
+            if stored:
+                answer.explanation_id = stored[0]
+            else:
+                answer.explanation = explanation
+            db.session.commit()
+            yield _sse({"text": explanation}, event='done')
+        except CircuitOpenError as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Explanation stream for attempt {attempt.id} skipped: {e}")
+            yield _sse({"error": str(e), "retry_after": e.retry_after}, event='error')
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Explanation streaming error: {e}")
+            yield _sse({"error": f"Could not generate explanation: {e}"}, event='error')
+
+    return _sse_response(generate())
@@ -0,0 +1,187 @@
+# single_flight.py
+import os
+import time
+import uuid
+import threading
+from sqlalchemy import insert, delete
+from sqlalchemy.exc import IntegrityError
+from models import db, SingleFlightLock
+from telemetry import SINGLE_FLIGHT_REQUESTS, SINGLE_FLIGHT_WAIT
+
+
+class SingleFlightTimeout(Exception):
+    """The leader for a key didn't produce a result within the group's timeout."""
+    pass
+
+
+class Flight:
+    """One in-progress computation for a key. Followers block in wait(); the leader calls finish() or fail()."""
+
+    def __init__(self, group, key):
+        self.group = group
+        self.key = key
+        self.is_leader = False
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex}" # DB lock owner token
+        self.holds_lock = False
+        self.done = False
+        self.value = None
+        self.error = None
+        self._event = threading.Event()
+
+    @classmethod
+    def completed(cls, group, key, value):
+        flight = cls(group, key)
+        flight.value, flight.done = value, True
+        flight._event.set()
+        return flight
+
+    def wait(self, timeout):
+        if not self._event.wait(timeout):
+            raise SingleFlightTimeout(f"Timed out waiting for '{self.key}' to be computed by another request.")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def finish(self, value):
+        """Publishes the result. Call it only once the result is persisted, so other workers can read it."""
+        self._complete(value, None)
+
+    def fail(self, error):
+        self._complete(None, error)
+
+    def _complete(self, value, error):
+        if self.done:
+            return
+        self.value, self.error, self.done = value, error, True
+        self.group._release(self)
+        self._event.set()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key: one leader does the work, everyone else
+    gets its result.
+
+    - Within a worker, followers wait on the leader's Event.
+    - Across workers, leaders race for a row in single_flight_lock. The loser polls `lookup()`
+      (the persisted result, e.g. Question.hint) until the winner has stored it, and takes over
+      if the winner's lock is released or expires without a result.
+
+    Outcomes are counted in telemetry (single_flight_requests_total) by group and role.
+    """
+    lock_table = SingleFlightLock.__table__
+
+    def __init__(self, name, timeout=45.0, poll_interval=0.25):
+        self.name = name
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.engine = None
+        self._flights = {} # key -> Flight led by a thread in this process
+        self._lock = threading.Lock()
+
+    def init_app(self, app, timeout_key=None):
+        if timeout_key:
+            self.timeout = app.config.get(timeout_key, self.timeout)
+        self.poll_interval = app.config.get('SINGLE_FLIGHT_POLL_INTERVAL', self.poll_interval)
+        with app.app_context():
+            self.engine = db.engine
+
+    def run(self, key, compute, lookup=None):
+        """Returns compute()'s result, calling it at most once per key across concurrent callers."""
+        flight = self.acquire(key, lookup)
+        if not flight.is_leader:
+            return flight.value
+        try:
+            value = compute()
+        except Exception as e:
+            flight.fail(e)
+            raise
+        flight.finish(value)
+        return value
+
+    def acquire(self, key, lookup=None):
+        """
+        Returns a Flight. If flight.is_leader, the caller must compute and then finish()/fail() it;
+        otherwise flight.value already holds the result (or acquire raised the leader's error).
+        """
+        full_key = f"{self.name}:{key}"
+        with self._lock:
+            flight = self._flights.get(full_key)
+            is_follower = flight is not None
+            if not is_follower:
+                flight = Flight(self, full_key)
+                self._flights[full_key] = flight
+        if is_follower:
+            started = time.monotonic()
+            try:
+                value = flight.wait(self.timeout * 2) # The leader may poll for up to `timeout` before computing
+            finally:
+                self._record('coalesced_local', time.monotonic() - started)
+            return Flight.completed(self, full_key, value) # The follower's own (non-leader) view
+
+        # Local leader: make sure no other worker is already computing it
+        started = time.monotonic()
+        waited = False
+        while True:
+            try:
+                acquired = self._try_lock(flight)
+            except Exception as e: # Coordination is an optimization; never fail the request over it
+                print(f"Single-flight lock unavailable ({e}); computing '{full_key}' without it.")
+                acquired = True
+            # After waiting, the lock is usually free because the other worker just stored its result
+            value = lookup() if lookup and waited else None
+            if acquired and value is None:
+                flight.is_leader = True
+                self._record('leader', time.monotonic() - started)
+                return flight
+            if value is not None:
+                flight.finish(value) # Wakes local followers too
+                self._record('coalesced_remote', time.monotonic() - started)
+                return flight
+            if time.monotonic() - started >= self.timeout:
+                print(f"Single-flight wait for '{full_key}' timed out; computing it here.")
+                flight.is_leader = True
+                self._record('timeout', time.monotonic() - started)
+                return flight
+            time.sleep(self.poll_interval)
+            waited = True
+
+    # --- Cross-worker Lock ---
+    def _try_lock(self, flight):
+        if self.engine is None:
+            return True
+        now = time.time()
+        with self.engine.begin() as conn: # Reclaim a lock whose holder died
+            conn.execute(delete(self.lock_table).where(self.lock_table.c.key == flight.key,
+                                                       self.lock_table.c.expires_at < now))
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(self.lock_table).values(key=flight.key, owner=flight.owner,
+                                                            expires_at=now + self.timeout))
+        except IntegrityError:
+            return False
+        flight.holds_lock = True
+        return True
+
+    def _release(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if flight.holds_lock:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(delete(self.lock_table).where(self.lock_table.c.key == flight.key,
+                                                               self.lock_table.c.owner == flight.owner))
+            except Exception as e:
+                print(f"Could not release single-flight lock '{flight.key}' (it will expire): {e}")
+
+    def _record(self, role, waited):
+        try:
+            SINGLE_FLIGHT_REQUESTS.labels(self.name, role).inc()
+            if role != 'leader' and waited:
+                SINGLE_FLIGHT_WAIT.labels(self.name).inc(waited)
+        except Exception as e: # Metrics must never break a request
+            print(f"Could not record single-flight telemetry: {e}")
+
+
+hint_flight = SingleFlight('hint')
@@ -0,0 +1,134 @@
+# telemetry.py
+import os
+import time
+import threading
+from prometheus_client import Counter, Histogram, Gauge, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+# Multiprocess mode (gunicorn) is switched on by PROMETHEUS_MULTIPROC_DIR, which has to be set
+# before this module is imported - gunicorn.conf.py takes care of that.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+# --- LLM Call Metrics ---
+LLM_CALLS = Counter('llm_calls_total', 'Handler calls to the LLM provider.', ['operation', 'model', 'outcome'])
+LLM_LATENCY = Histogram('llm_call_duration_seconds', 'Wall time per handler call, including retries and waits.',
+                        ['operation', 'model'], buckets=LATENCY_BUCKETS)
+LLM_ATTEMPTS = Histogram('llm_call_attempts', 'Attempts made per handler call.', ['operation'],
+                         buckets=(1, 2, 3, 4, 5, 8))
+LLM_TOKENS = Counter('llm_tokens_total', 'Tokens reported by the provider, summed over attempts.',
+                     ['operation', 'model', 'kind'])
+LLM_VALIDATION_FAILURES = Counter('llm_validation_failures_total', 'Responses rejected by a validation function.', ['operation'])
+LLM_WAIT = Counter('llm_wait_seconds_total', 'Time handler calls spent waiting before an attempt.', ['operation', 'reason'])
+
+# --- Single-flight Coalescing (see single_flight.py) ---
+SINGLE_FLIGHT_REQUESTS = Counter('single_flight_requests_total',
+                                 'Requests through a single-flight group by role: leader, coalesced_local, coalesced_remote, timeout.',
+                                 ['group', 'role'])
+SINGLE_FLIGHT_WAIT = Counter('single_flight_wait_seconds_total', 'Time non-leaders spent waiting for a result.', ['group'])
+
+# --- Local Free-response Pre-scoring (see local_grader.py) ---
+LOCAL_GRADER_DECISIONS = Counter('local_grader_decisions_total',
+                                 'Free-response answers by local decision (uncertain = sent to the LLM).', ['decision'])
+LOCAL_GRADER_SCORES = Histogram('local_grader_combined_score', 'Combined local similarity per decision, for tuning thresholds.',
+                                ['decision'], buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0))
+
+# --- In-process Cache / Registry Stats (summed over live workers) ---
+APP_STATS = Gauge('app_stats', 'Per-process counters from caches, the handler registry and retries.', ['source', 'stat'],
+                  multiprocess_mode='livesum')
+
+
+class LLMCallRecord:
+    """Collects what happened during one handler call; finish() publishes it."""
+
+    def __init__(self, operation, model):
+        self.operation = operation or 'unknown'
+        self.model = model or 'unknown'
+        self.started = time.perf_counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.validation_failures = 0
+
+    def add_usage(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens += prompt_tokens or 0
+        self.completion_tokens += completion_tokens or 0
+
+    def finish(self, state, succeeded):
+        """`state` is the call's retry_policy.RetryState."""
+        try:
+            LLM_CALLS.labels(self.operation, self.model, 'success' if succeeded else 'failure').inc()
+            LLM_LATENCY.labels(self.operation, self.model).observe(time.perf_counter() - self.started)
+            LLM_ATTEMPTS.labels(self.operation).observe(state.attempt)
+            if self.prompt_tokens:
+                LLM_TOKENS.labels(self.operation, self.model, 'prompt').inc(self.prompt_tokens)
+            if self.completion_tokens:
+                LLM_TOKENS.labels(self.operation, self.model, 'completion').inc(self.completion_tokens)
+            if self.validation_failures:
+                LLM_VALIDATION_FAILURES.labels(self.operation).inc(self.validation_failures)
+            if state.backoff_wait:
+                LLM_WAIT.labels(self.operation, 'backoff').inc(state.backoff_wait)
+            if state.limiter_wait:
+                LLM_WAIT.labels(self.operation, 'rate_limiter').inc(state.limiter_wait)
+        except Exception as e: # Metrics must never break an API call
+            print(f"Could not record LLM telemetry: {e}")
+
+
+class Telemetry:
+    """
+    Flask wiring for /metrics. In-process stats (caches, registry, retries) are copied into
+    gauges at most every `refresh_interval` seconds (after a request), so each worker's numbers
+    stay reasonably fresh.
+    """
+
+    def __init__(self, refresh_interval=15.0):
+        self.refresh_interval = refresh_interval
+        self._sources = {}
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('METRICS_REFRESH_INTERVAL', 15.0)
+        app.after_request(self._after_request)
+
+    def register_stats_source(self, name, stats_func):
+        """`stats_func` returns a dict of numbers (or nested dicts of numbers, flattened as a_b)."""
+        self._sources[name] = stats_func
+
+    def _after_request(self, response):
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+        return response
+
+    def refresh(self):
+        with self._lock:
+            self._last_refresh = time.monotonic()
+            for name, stats_func in self._sources.items():
+                try:
+                    for source, stat, value in self._flatten(name, stats_func()):
+                        APP_STATS.labels(source, stat).set(value)
+                except Exception as e:
+                    print(f"Could not refresh stats for '{name}': {e}")
+
+    @staticmethod
+    def _flatten(name, stats):
+        nested = {k: v for k, v in stats.items() if isinstance(v, dict)}
+        if not nested:
+            return [(name, stat, value) for stat, value in stats.items() if isinstance(value, (int, float))]
+        rows = []
+        for key, value in nested.items():
+            rows.extend(Telemetry._flatten(f"{name}_{key}", value))
+        return rows
+
+    def render(self):
+        """Returns (body, content_type) in Prometheus text format, aggregated across workers if enabled."""
+        self.refresh()
+        if MULTIPROCESS:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+telemetry = Telemetry()
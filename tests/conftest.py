@@ -0,0 +1,34 @@
+# tests/conftest.py
+import os
+import sys
+import pytest
+from cryptography.fernet import Fernet
+
+# config.py reads the environment at import time
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode())
+os.environ.setdefault('LLM_PROVIDER', 'stub')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from app import create_app
+from models import db
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    yield app # Requests push their own app context (flask_login caches the user on `g`)
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,52 @@
+# tests/test_dashboard.py
+from contextlib import contextmanager
+from sqlalchemy import event
+import models
+from models import db, User
+
+
+def make_user(app, username, test_count):
+    with app.app_context():
+        user = User(username=username)
+        user.set_password('secret1')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(test_count):
+            db.session.add(models.TestDefinition(user_id=user.id, title=f"Test {i}", question_count=5, attempt_count=2, best_score=3.0))
+        db.session.commit()
+        return user.id
+
+
+@contextmanager
+def count_statements(app):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def dashboard_statements(app, client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    with count_statements(app) as statements:
+        response = client.get('/')
+    assert response.status_code == 200
+    return statements, response.get_data(as_text=True)
+
+
+def test_dashboard_query_count_does_not_grow_with_tests(app, client):
+    page_size = app.config['DASHBOARD_PAGE_SIZE']
+    one_test_user = make_user(app, 'one_test_user', 1)
+    many_tests_user = make_user(app, 'many_tests_user', page_size + 5)
+
+    one, one_page = dashboard_statements(app, client, one_test_user)
+    many, many_page = dashboard_statements(app, client, many_tests_user)
+    assert one_page.count('/start') == 1 and many_page.count('/start') == page_size
+    assert len(one) == len(many), (one, many)
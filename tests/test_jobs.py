@@ -0,0 +1,55 @@
+# tests/test_jobs.py
+from datetime import datetime, timezone, timedelta
+import jobs
+import models
+from models import db, User, GenerationJob, Question
+from jobs import job_runner, run_generation_job
+
+
+def make_user(username):
+    user = User(username=username)
+    user.set_password('secret1')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def test_in_process_runner_recovers_stale_and_orphaned_jobs(app, monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(job_runner, '_dispatch', dispatched.append)
+    monkeypatch.setattr(job_runner, '_last_recovery', None)
+    old = datetime.now(timezone.utc) - timedelta(hours=1)
+    with app.app_context():
+        user = make_user('stale_jobs_user')
+        stuck = GenerationJob(user_id=user.id, status='running', started_at=old, created_at=old)
+        orphan = GenerationJob(user_id=user.id, status='pending', created_at=old)
+        fresh = GenerationJob(user_id=user.id, status='pending')
+        db.session.add_all([stuck, orphan, fresh])
+        db.session.commit()
+
+        assert job_runner.recover_stale_jobs() == 2
+        assert sorted(dispatched) == sorted([stuck.id, orphan.id])
+        assert db.session.get(GenerationJob, stuck.id).status == 'pending'
+        assert job_runner.recover_stale_jobs() == 0 # Throttled until RECOVERY_INTERVAL passes
+
+
+def test_failed_job_discards_its_partially_streamed_test(app, monkeypatch):
+    def fail_mid_stream(job):
+        raise RuntimeError("worker blew up after the first question")
+    monkeypatch.setattr(jobs, 'generate_test_from_job', fail_mid_stream)
+    with app.app_context():
+        user = make_user('partial_test_user')
+        test_def = models.TestDefinition(user_id=user.id, title='Partial', question_count=1)
+        db.session.add(test_def)
+        db.session.flush()
+        db.session.add(Question(test_definition_id=test_def.id, question_index=0, text='Q?', question_type='free_response', suggested_answer='A'))
+        job = GenerationJob(user_id=user.id, test_definition_id=test_def.id)
+        db.session.add(job)
+        db.session.commit()
+        job_id, test_id = job.id, test_def.id
+
+        run_generation_job(job_id)
+        job = db.session.get(GenerationJob, job_id)
+        assert (job.status, job.test_definition_id) == ('failed', None)
+        assert db.session.get(models.TestDefinition, test_id) is None
+        assert Question.query.filter_by(test_definition_id=test_id).count() == 0
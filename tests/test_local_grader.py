@@ -0,0 +1,63 @@
+# tests/test_local_grader.py
+import pytest
+from local_grader import LocalGrader
+
+QUESTION = "What does photosynthesis do?"
+SUGGESTED = "Photosynthesis converts light energy into chemical energy stored in glucose."
+
+
+class Vector(tuple):
+    def __matmul__(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+
+class FakeEmbeddings:
+    """Stands in for a sentence-transformers model: every text maps to a fixed unit vector."""
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def encode(self, text, normalize_embeddings=True):
+        return Vector(self.vectors.get(text, (0.0, 1.0)))
+
+
+def grader_with_embeddings(vectors):
+    grader = LocalGrader(embedding_model='fake')
+    grader._model = FakeEmbeddings(vectors)
+    return grader
+
+
+@pytest.mark.parametrize("question, suggested, answer", [
+    (QUESTION, SUGGESTED, "Photosynthesis converts chemical energy stored in glucose into light energy."),
+    (QUESTION, SUGGESTED, "light energy chemical energy glucose stored converts photosynthesis"),
+    ("Who was the first US president?", "George Washington", "Washington George"),
+])
+def test_reordered_answers_are_not_accepted_without_embeddings(question, suggested, answer):
+    result = LocalGrader().grade(question, suggested, answer)
+    assert result.decision == 'uncertain' and result.score is None
+
+
+def test_unrelated_answers_are_not_rejected_without_embeddings():
+    assert LocalGrader().grade("Which gas do plants absorb?", "carbon dioxide", "CO2").decision == 'uncertain'
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("photosynthesis converts light energy into chemical energy stored in glucose", ('exact', 1.0)),
+    ("   ", ('blank', 0.0)),
+])
+def test_exact_and_blank_answers_are_decided_locally(answer, expected):
+    result = LocalGrader().grade(QUESTION, SUGGESTED, answer)
+    assert (result.decision, result.score) == expected
+
+
+def test_embedding_similarity_decides_the_match():
+    paraphrase = "Photosynthesis converts light energy into chemical energy, stored in glucose molecules."
+    reversed_answer = "Photosynthesis converts chemical energy stored in glucose into light energy."
+    grader = grader_with_embeddings({SUGGESTED: (1.0, 0.0), paraphrase: (1.0, 0.0), reversed_answer: (0.6, 0.8)})
+    assert grader.grade(QUESTION, SUGGESTED, paraphrase).decision == 'match'
+    assert grader.grade(QUESTION, SUGGESTED, reversed_answer).decision == 'uncertain'
+
+
+def test_negated_answers_are_not_accepted_even_with_similar_embeddings():
+    negated = "Photosynthesis does not convert light energy into chemical energy stored in glucose."
+    grader = grader_with_embeddings({SUGGESTED: (1.0, 0.0), negated: (1.0, 0.0)})
+    assert grader.grade(QUESTION, SUGGESTED, negated).decision == 'uncertain'
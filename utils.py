@@ -2,6 +2,15 @@
 from PyPDF2 import PdfReader
 import io
 import json
+import re
+import math
+import string
+from collections import Counter
+import tiktoken
+
+_PUNCTUATION_TRANSLATOR = str.maketrans('', '', string.punctuation)
+_TOKEN_ENCODING = "o200k_base" # Tokenizer used by the gpt-4o family
+_encoding = None
 
 def extract_text_from_pdf(pdf_file_stream):
     """
@@ -27,3 +36,168 @@ def extract_text_from_pdf(pdf_file_stream):
         print(f"Error extracting text from PDF: {e}")
         return None
 
+
+def normalize_fib_answer(value):
+    """Normalizes a fill-in-the-blank answer for cache keys (lowercase, no punctuation, collapsed whitespace)."""
+    return " ".join(str(value).lower().translate(_PUNCTUATION_TRANSLATOR).split())
+
+
+def fib_grading_form(value):
+    """The form fill-in-the-blank answers are graded in: lowercase, no punctuation, outer whitespace stripped (inner spacing still counts)."""
+    return str(value).lower().translate(_PUNCTUATION_TRANSLATOR).strip()
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token for English text)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def count_tokens(text):
+    """Exact token count with the model's tokenizer; falls back to estimate_tokens if it can't be loaded."""
+    global _encoding
+    if not text:
+        return 0
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding(_TOKEN_ENCODING)
+        except Exception as e: # e.g. BPE file can't be downloaded in an offline container
+            print(f"Could not load tokenizer '{_TOKEN_ENCODING}', using estimates: {e}")
+            _encoding = False
+    if _encoding is False:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def split_into_chunks(text, max_tokens=1500, overlap_tokens=100):
+    """
+    Splits text into chunks of at most `max_tokens` (estimated), breaking on paragraph and
+    sentence boundaries where possible. Consecutive chunks share ~`overlap_tokens` of context.
+
+    Returns:
+        list[str]: The chunks, in document order.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    # Break into sentence-sized pieces; hard-split anything still too long
+    max_chars = max_tokens * 4
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph.strip()):
+            while len(sentence) > max_chars:
+                pieces.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                pieces.append(sentence)
+
+    # Pack pieces greedily (sizes tracked in characters, including the joining space)
+    overlap_chars = overlap_tokens * 4
+    chunks = []
+    current = []
+    current_chars = 0
+    for piece in pieces:
+        if current and current_chars + len(piece) + 1 > max_chars:
+            chunks.append(" ".join(current))
+            # Carry the tail of the previous chunk over for context
+            overlap = []
+            overlap_size = 0
+            for prev in reversed(current):
+                overlap_size += len(prev) + 1
+                if overlap_size > overlap_chars:
+                    break
+                overlap.insert(0, prev)
+            current = overlap
+            current_chars = sum(len(p) + 1 for p in current)
+            if current_chars + len(piece) + 1 > max_chars:
+                current, current_chars = [], 0 # No room for overlap next to a very long piece
+        current.append(piece)
+        current_chars += len(piece) + 1
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+# --- Source Text Condensation ---
+_PAGE_NUMBER_LINE = re.compile(r'^\s*(page\s*)?\d+(\s*(of|/)\s*\d+)?\s*$', re.IGNORECASE)
+_TERM_PATTERN = re.compile(r'[a-z0-9]{3,}')
+_STOPWORDS = frozenset("""
+the and for are but not you all any can had her was one our out has his how its may new now old see two who
+did get let put say she too use with that this have from they will would there their what about which when
+make like time just know take into year your some could them than then also these those been were more most
+other such only over very where after before because while each does being both through between under
+""".split())
+
+
+def content_terms(text):
+    """Lowercased terms of 3+ characters with common stopwords removed (for TF-IDF / lexical matching)."""
+    return [t for t in _TERM_PATTERN.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def strip_repeated_lines(text, min_repeats=3, max_line_length=100):
+    """
+    Removes page numbers and short lines repeated `min_repeats`+ times (running headers/footers).
+    Lines are compared with digits masked, so "Chapter 2 - page 14" matches "Chapter 2 - page 15".
+    """
+    lines = text.splitlines()
+    def signature(line):
+        return re.sub(r'\d+', '#', " ".join(line.lower().split()))
+    counts = Counter(signature(line) for line in lines if line.strip() and len(line) <= max_line_length)
+    kept = [line for line in lines
+            if not line.strip()
+            or not (_PAGE_NUMBER_LINE.match(line) or counts[signature(line)] >= min_repeats)]
+    return "\n".join(kept)
+
+
+def _split_sentences(text):
+    sentences = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = " ".join(paragraph.split())
+        sentences.extend(s for s in re.split(r'(?<=[.!?])\s+', paragraph) if s)
+    return sentences
+
+
+def rank_sentences(sentences):
+    """
+    Scores each sentence by TF-IDF salience (every sentence is a document). Terms that are frequent
+    in a sentence but rare across the text score highest. Returns a list of floats.
+    """
+    term_lists = [content_terms(s) for s in sentences]
+    document_frequency = Counter(term for terms in term_lists for term in set(terms))
+    n = len(sentences)
+    scores = []
+    for terms in term_lists:
+        if not terms:
+            scores.append(0.0)
+            continue
+        tf = Counter(terms)
+        weight = sum((count / len(terms)) * math.log(1 + n / document_frequency[term]) for term, count in tf.items())
+        scores.append(weight * math.sqrt(len(tf))) # Favor sentences that carry several distinct terms
+    return scores
+
+
+def condense_text(text, max_tokens):
+    """
+    Fits source text into a prompt budget: strips boilerplate lines, then keeps the most salient
+    sentences (TF-IDF) that fit in `max_tokens` (real tokenizer), in their original order.
+    Text already within budget is only cleaned.
+    """
+    cleaned = strip_repeated_lines(text or "").strip()
+    if count_tokens(cleaned) <= max_tokens:
+        return cleaned
+
+    sentences = _split_sentences(cleaned)
+    scores = rank_sentences(sentences)
+    selected = set()
+    used = 0
+    for i in sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True):
+        if max_tokens - used < 8: # Budget is effectively full
+            break
+        cost = count_tokens(sentences[i]) + 1 # +1 for the joining space
+        if used + cost > max_tokens:
+            continue
+        selected.add(i)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(selected))
@@ -0,0 +1,53 @@
+# worker.py
+# Standalone generation worker. Use with GENERATION_JOB_EXECUTOR=external so web workers only enqueue.
+# To run: python worker.py
+import time
+from app import app
+from models import db, GenerationJob
+from jobs import run_generation_job, requeue_stale_jobs
+from generation_cache import theme_cache
+from api_handler import CSS_PROMPT_VERSION
+
+POLL_INTERVAL = 1.0 # Seconds between checks when the queue is empty
+
+
+def main():
+    with app.app_context():
+        stale_after = app.config.get('GENERATION_JOB_STALE_AFTER', 900)
+        theme_prune_interval = app.config.get('THEME_CACHE_PRUNE_INTERVAL', 3600)
+        app.logger.info("Generation worker started.")
+        last_requeue = 0.0
+        last_theme_prune = 0.0
+        while True:
+            if time.monotonic() - last_requeue > 60:
+                requeued = requeue_stale_jobs(stale_after)
+                if requeued:
+                    app.logger.warning(f"Requeued {requeued} stale generation job(s).")
+                last_requeue = time.monotonic()
+
+            if time.monotonic() - last_theme_prune > theme_prune_interval:
+                try:
+                    pruned = theme_cache.prune(prompt_version=CSS_PROMPT_VERSION)
+                    if pruned:
+                        app.logger.info(f"Pruned {pruned} cached theme(s).")
+                except Exception as e: # Housekeeping must never stop the worker
+                    db.session.rollback()
+                    app.logger.error(f"Theme cache prune failed: {e}")
+                last_theme_prune = time.monotonic()
+
+            job = (GenerationJob.query.with_entities(GenerationJob.id)
+                   .filter_by(status='pending')
+                   .order_by(GenerationJob.created_at.asc())
+                   .first())
+            db.session.commit() # End the read transaction so we see new jobs next time
+            if job is None:
+                time.sleep(POLL_INTERVAL)
+                continue
+            try:
+                run_generation_job(job.id) # No-op if another worker claimed it first
+            finally:
+                db.session.remove()
+
+
+if __name__ == '__main__':
+    main()